@@ -0,0 +1,181 @@
+# Benchmarks of the conversion stages on synthetic segmentations
+# python benchmarks/run_benchmarks.py --size 64 --size 128 -o results.json
+# python benchmarks/run_benchmarks.py --baseline results_v0.json   (reports the stages that got slower)
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import SIZES, synthetic_file
+
+from tissue2mrprop.functions.volume import volume
+from tissue2mrprop.functions.utils.select_tool import TOOL_VERSIONS
+from tissue2mrprop.functions.utils.provenance import provenance, peak_memory_mb
+
+# Stages of the conversion, in the order they run
+CREATE_STAGES = {
+    "create_sus_dist": lambda vol: vol.create_sus_dist(),
+    "create_t1_vol": lambda vol: vol.create_t1_vol(),
+    "create_t2_vol": lambda vol: vol.create_t2_vol(),
+    "create_t2_star_vol": lambda vol: vol.create_t2_star_vol(),
+    "create_pd_vol": lambda vol: vol.create_pd_vol(),
+    "create_static_vol": lambda vol: vol.create_static_vol("perm3T"),
+}
+# Types grouped by group_seg_labels, the static one adds the Perm & Cond values
+GROUP_TYPES = ["sus", "t1", "t2", "t2s", "pd", "perm3T"]
+
+
+class StageTimer:
+    # Wall time, CPU time and memory high-water mark of every stage
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        self.stages[name] = {
+            "wall_s": time.perf_counter() - wall,
+            "cpu_s": time.process_time() - cpu,
+            # Peak of the memory allocated during the stage (NumPy arrays included)
+            "peak_mb": tracemalloc.get_traced_memory()[1] / 2**20,
+        }
+
+
+def run_case(tool, version, path):
+    # Runs every stage once on a segmentation, returns the StageTimer
+    timer = StageTimer()
+    with timer.stage("load"):
+        vol = volume(nib.load(path))
+    if tool == "compare_fm" and version == "dyn":
+        vol.new_chi = -2.438
+    with timer.stage("group_seg_labels"):
+        vol.group_seg_labels(tool, version, GROUP_TYPES, ref=0)
+    with timer.stage("check_pixels"):
+        vol.check_pixels(path)
+    for name, create in CREATE_STAGES.items():
+        with timer.stage(name):
+            create(vol)
+    with timer.stage("save"):
+        vol.save_sus_dist_nii("benchmark.nii.gz")
+
+    # Only the last created volume is needed by the Gaussian path
+    vol.sus_dist = vol.t1_vol = vol.t2_vol = vol.t2star_vol = vol.pd_dist = vol.static_vol = None
+    vol.gauss_flag = 1
+    vol.seed = 0
+    with timer.stage("gauss"):
+        vol.calc_regions()
+        vol.create_gauss_sc_dist("sus")
+    del vol
+    return timer
+
+
+def best_of(runs):
+    # Fastest run of every stage, with the largest memory peak
+    stages = {}
+    for name in runs[0].stages:
+        times = [run.stages[name] for run in runs]
+        stages[name] = {
+            "wall_s": round(min(t["wall_s"] for t in times), 4),
+            "cpu_s": round(min(t["cpu_s"] for t in times), 4),
+            "peak_mb": round(max(t["peak_mb"] for t in times), 1),
+        }
+    return stages
+
+
+def compare(results, baseline, threshold):
+    # Stages whose wall time grew by more than threshold compared with the baseline
+    old = {(r["tool"], r["version"], r["size"]): r["stages"] for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        key = (result["tool"], result["version"], result["size"])
+        for name, stage in result["stages"].items():
+            before = old.get(key, {}).get(name)
+            # Very short stages are too noisy to compare
+            if before and before["wall_s"] > 0.01 and stage["wall_s"] > threshold * before["wall_s"]:
+                regressions.append((key, name, before["wall_s"], stage["wall_s"]))
+    return regressions
+
+
+@click.command()
+@click.option("--size", "sizes", multiple=True, type=click.Choice(list(SIZES) + ["all"]), default=["64", "128"],
+              help="Size of the synthetic segmentations, repeat the option for several sizes")
+@click.option("-s", "--segtool", "tools", multiple=True, type=click.Choice(list(TOOL_VERSIONS)),
+              help="Segmentation tools to benchmark, all of them by default")
+@click.option("-v", "--version", "versions", multiple=True,
+              help="Versions to benchmark, all the versions of every tool by default")
+@click.option("-n", "--repeat", type=int, default=1, help="Number of runs of every case, the fastest is kept")
+@click.option("-w", "--workdir", type=click.Path(), default=os.path.join(tempfile.gettempdir(), "tissue2mrprop_bench"),
+              help="Folder of the synthetic segmentations (reused between runs) and of the outputs")
+@click.option("-o", "--output", type=click.Path(), default="benchmark_results.json", help="JSON file with the results")
+@click.option("--baseline", type=click.Path(exists=True), default=None,
+              help="Results of a previous run, the stages that got slower are reported")
+@click.option("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+def benchmark(sizes, tools, versions, repeat, workdir, output, baseline, threshold):
+    sizes = list(SIZES) if "all" in sizes else list(sizes)
+    cases = [(tool, version) for tool in (tools or TOOL_VERSIONS) for version in TOOL_VERSIONS[tool]
+             if not versions or version in versions]
+    output = os.path.abspath(output)
+    os.makedirs(workdir, exist_ok=True)
+    # volume writes in the current folder
+    os.chdir(workdir)
+
+    tracemalloc.start()
+    results = []
+    for size in sizes:
+        for tool, version in cases:
+            path = synthetic_file(tool, version, SIZES[size], os.path.join(workdir, "data"))
+            runs = []
+            for _ in range(repeat):
+                # The prints of the converter are not part of the benchmark
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    runs.append(run_case(tool, version, path))
+            stages = best_of(runs)
+            results.append({"tool": tool, "version": version, "size": size, "shape": list(SIZES[size]),
+                            "stages": stages})
+            total = sum(stage["wall_s"] for stage in stages.values())
+            print(f"{tool} {version} {size}: {total:.3f} s, " +
+                  ", ".join(f"{name} {stage['wall_s']:.3f}" for name, stage in stages.items()))
+    tracemalloc.stop()
+
+    report = {
+        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "provenance": provenance(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "nibabel": nib.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "repeat": repeat,
+        "memory peak (MB)": peak_memory_mb(),
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print("Results saved to: ", output)
+
+    if baseline:
+        with open(baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), threshold)
+        for (tool, version, size), name, before, after in regressions:
+            print(f"Regression: {tool} {version} {size} {name}: {before:.3f} s -> {after:.3f} s")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No stage slower than {threshold}x the baseline")
+
+
+if __name__ == "__main__":
+    benchmark()
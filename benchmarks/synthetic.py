@@ -0,0 +1,66 @@
+# Synthetic segmentations for the benchmarks
+# Label maps made of blocks of random labels of a tool/version, surrounded by air (label 0),
+# stored as integers like the segmentations of TotalSegmentator.
+import os
+
+import numpy as np
+
+from tissue2mrprop.functions.utils.select_tool import compile_labels
+from tissue2mrprop.functions.utils.nifti_io import NiftiSlabWriter
+
+# Sizes of the benchmarks, from a small crop to a whole body CT
+SIZES = {
+    "64": (64, 64, 64),
+    "128": (128, 128, 128),
+    "256": (256, 256, 256),
+    "512x512x800": (512, 512, 800),
+}
+
+
+def synthetic_labels(tool, version, shape, block=8, margin=0.1, seed=0):
+    """
+    Label map with blocks of random labels of the look up table.
+
+    Args:
+        tool (str): segmentation tool
+        version (str): version of the tool
+        shape (tuple): shape of the label map
+        block (int): side of the blocks, in voxels
+        margin (float): fraction of every side that is air (label 0)
+        seed (int): seed of the labels
+
+    Returns:
+        np.ndarray: label map, uint8 or int16 depending on the largest label
+    """
+    ids = np.array(sorted(compile_labels(tool, version)))
+    dtype = np.uint8 if ids.max() < 256 else np.int16
+    rng = np.random.default_rng(seed)
+    coarse = rng.choice(ids, size=tuple(-(-s // block) for s in shape)).astype(dtype)
+    labels = coarse.repeat(block, 0)[:shape[0]].repeat(block, 1)[:, :shape[1]].repeat(block, 2)[..., :shape[2]]
+    labels = np.asfortranarray(labels)
+
+    for axis, size in enumerate(shape):
+        border = int(size * margin)
+        index = [slice(None)] * 3
+        index[axis] = np.r_[0:border, size - border:size]
+        labels[tuple(index)] = 0
+    return labels
+
+
+def synthetic_file(tool, version, shape, folder, **kwargs):
+    """
+    Synthetic segmentation saved as .nii.gz, made once and reused by later runs.
+
+    Returns:
+        str: path of the file
+    """
+    path = os.path.join(folder, f"{tool}_{version}_{'x'.join(str(s) for s in shape)}.nii.gz")
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        labels = synthetic_labels(tool, version, shape, **kwargs)
+        # Written under another name first, an interrupted run doesn't leave a truncated file
+        part = path[:-len(".nii.gz")] + ".part.nii.gz"
+        with NiftiSlabWriter(part, shape, np.eye(4), labels.dtype) as writer:
+            writer.write(labels)
+        os.replace(part, path)
+    return path
@@ -0,0 +1,43 @@
+# Fixtures shared by the tests: a small random segmentation in a temporary working folder and a runner of
+# tissue_to_MR on it. The CLI writes to output/ of the working folder.
+import numpy as np
+import nibabel as nib
+import pytest
+from click.testing import CliRunner
+
+from tissue2mrprop.cli.tissue_to_mr import converter
+
+# Labels of TotalSeg_CT mod0 (264 is fat)
+LABELS = (0, 1, 2, 5, 90, 264)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def make_segmentation(workdir):
+    # make_segmentation(path, labels, shape, affine, seed): saves random labels and returns them
+    def make(path="seg.nii.gz", labels=LABELS, shape=(8, 8, 4), affine=None, seed=0):
+        data = np.random.default_rng(seed).choice(labels, size=shape).astype(np.int16)
+        nib.save(nib.Nifti1Image(data, np.eye(4) if affine is None else affine), workdir / path)
+        return data
+    return make
+
+
+@pytest.fixture
+def segmentation(make_segmentation):
+    # Labels of seg.nii.gz
+    return make_segmentation()
+
+
+@pytest.fixture
+def run_converter(workdir):
+    # run_converter(*args): result of tissue_to_MR on seg.nii.gz (TotalSeg_CT mod0 by default), checks the exit code
+    def run(*args, seg="seg.nii.gz", segtool="TotalSeg_CT", version="mod0", exit_code=0):
+        result = CliRunner().invoke(converter, ['-i', seg, '-s', segtool, '-v', version, *args])
+        assert result.exit_code == exit_code, result.output
+        return result
+    return run
@@ -0,0 +1,47 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from tissue2mrprop import convert_labels
+from tissue2mrprop.functions.volume import volume
+
+
+def test_convert_labels_in_memory(workdir, capsys):
+    labels = np.random.default_rng(0).choice([0, 1, 2, 5, 90, 264], size=(8, 7, 6)).astype(np.int16)
+    maps = convert_labels(labels, "TotalSeg_CT", "mod0", ["sus", "t1", "perm3T"], affine=np.diag([2, 2, 2, 1]))
+    assert list(maps) == ["sus", "t1", "perm3T"]
+    np.testing.assert_allclose(maps["sus"][labels == 264], -8.92, rtol=1e-6)
+
+    # Same values as the volume class, from a nibabel image
+    vol = volume(nib.Nifti1Image(labels, np.eye(4)), verbose=False)
+    vol.group_seg_labels("TotalSeg_CT", "mod0", ["sus", "t1", "perm3T"], ref=0)
+    for type in maps:
+        assert maps[type].dtype == np.float32
+        np.testing.assert_array_equal(maps[type], vol.map_property(type))
+    np.testing.assert_array_equal(convert_labels(nib.Nifti1Image(labels, np.eye(4)), "TotalSeg_CT", "mod0", "t1")["t1"],
+                                  maps["t1"])
+
+    # Nothing written, nothing printed
+    assert list(workdir.iterdir()) == []
+    assert capsys.readouterr().out == ""
+
+
+def test_convert_labels_pixel_policy():
+    labels = np.array([0, 1, 500, 264], dtype=np.int16).reshape(2, 2, 1)
+    with pytest.raises(ValueError, match="500"):
+        convert_labels(labels, "TotalSeg_CT", "mod0", "sus")
+    maps = convert_labels(labels, "TotalSeg_CT", "mod0", "sus", pixel_policy="zero")
+    assert maps["sus"][1, 0, 0] == maps["sus"][0, 0, 0]
+    # The caller's labels are not corrected in place
+    assert labels[1, 0, 0] == 500
+    maps = convert_labels(labels, "TotalSeg_CT", "mod0", "sus", pixel_policy="map", map_label=264)
+    assert maps["sus"][1, 0, 0] == maps["sus"][1, 1, 0]
+    with pytest.raises(ValueError, match="map_label 999"):
+        convert_labels(labels, "TotalSeg_CT", "mod0", "sus", pixel_policy="map", map_label=999)
+
+
+def test_convert_all_types_with_texture():
+    labels = np.random.default_rng(0).choice([0, 1, 196, 324], size=(6, 6, 4)).astype(np.int16)
+    maps = convert_labels(labels, "TotalSeg_CT", "mod2", "all", gauss=True, seed=1)
+    assert len(np.unique(maps["cond7T"][labels == 324])) == 1
+    assert len(np.unique(maps["sus"][labels == 324])) > 1
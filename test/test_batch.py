@@ -0,0 +1,75 @@
+import csv
+import os
+
+from click.testing import CliRunner
+
+from tissue2mrprop.cli import batch as batch_module
+from tissue2mrprop.cli.batch import batch
+
+
+def test_batch_manifest_continues_after_failure(tmp_path, segmentation):
+    (tmp_path / "manifest.csv").write_text(
+        "input,segtool,version,type,output\n"
+        "missing.nii.gz,TotalSeg_CT,mod0,sus,\n"
+        "seg.nii.gz,TotalSeg_CT,mod0,sus;t1,phantom.nii.gz\n"
+    )
+
+    result = CliRunner().invoke(batch, ["-f", "manifest.csv", "-j", "1"])
+
+    assert result.exit_code == 1
+    with open(tmp_path / "output" / "batch_summary.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["status"] for row in rows] == ["failed", "success"]
+    assert (tmp_path / "output" / "phantom_sus.nii.gz").exists()
+    assert (tmp_path / "output" / "phantom_t1.nii.gz").exists()
+
+
+def test_batch_rejects_zero_jobs(workdir):
+    result = CliRunner().invoke(batch, ["-i", "*.nii.gz", "-s", "TotalSeg_CT", "-v", "mod0", "-t", "sus", "-j", "0"])
+    assert result.exit_code == 2
+    assert "--jobs" in result.output
+
+
+def test_batch_same_basename_outputs_are_told_apart(tmp_path, make_segmentation):
+    for subject in ["sub01", "sub02"]:
+        (tmp_path / subject).mkdir()
+        make_segmentation(f"{subject}/seg.nii.gz")
+
+    result = CliRunner().invoke(batch, ["-i", "*/seg.nii.gz", "-s", "TotalSeg_CT", "-v", "mod0", "-t", "sus", "-j", "1"])
+
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "output" / "sub01_seg_sus.nii.gz").exists()
+    assert (tmp_path / "output" / "sub02_seg_sus.nii.gz").exists()
+
+
+def test_batch_refuses_same_output(tmp_path, workdir):
+    (tmp_path / "manifest.csv").write_text(
+        "input,segtool,version,type,output\n"
+        "a.nii.gz,TotalSeg_CT,mod0,sus,phantom.nii.gz\n"
+        "b.nii.gz,TotalSeg_CT,mod0,sus,phantom.nii.gz\n"
+    )
+    result = CliRunner().invoke(batch, ["-f", "manifest.csv", "-j", "1"])
+    assert result.exit_code == 2
+    assert "same output" in result.output
+
+
+def test_batch_continues_after_worker_crash(tmp_path, make_segmentation, monkeypatch):
+    # The worker converting crash.nii.gz dies, the other jobs still run (workers are forked with the patch)
+    real_convert = batch_module.convert
+
+    def convert(input_file, **kwargs):
+        if input_file == "crash.nii.gz":
+            os._exit(1)
+        return real_convert(input_file=input_file, **kwargs)
+
+    monkeypatch.setattr(batch_module, "convert", convert)
+    for name in ["a", "b", "crash", "c", "d"]:
+        make_segmentation(f"{name}.nii.gz")
+
+    result = CliRunner().invoke(batch, ["-i", "*.nii.gz", "-s", "TotalSeg_CT", "-v", "mod0", "-t", "sus", "-j", "2"])
+
+    assert result.exit_code == 1
+    with open(tmp_path / "output" / "batch_summary.csv", newline="") as f:
+        status = {row["input"]: row["status"] for row in csv.DictReader(f)}
+    assert status == {"a.nii.gz": "success", "b.nii.gz": "success", "c.nii.gz": "success",
+                      "crash.nii.gz": "failed", "d.nii.gz": "success"}
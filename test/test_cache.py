@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import nibabel as nib
+import pytest
+from click.testing import CliRunner
+
+from tissue2mrprop.cli.cache import cache
+from tissue2mrprop.functions.utils.cache import ResultCache, conversion_key
+
+
+@pytest.fixture
+def run(run_converter, workdir, monkeypatch):
+    # Converter with --cache, the cache is in the working folder
+    monkeypatch.setenv("TISSUE2MRPROP_CACHE_DIR", str(workdir / "cache"))
+    return lambda *args: run_converter('--cache', *args).output
+
+
+def test_converter_cache(tmp_path, segmentation, run):
+
+    assert "found in the cache" not in run('-t', 'sus', '-t', 't1', '-o', 'a.nii.gz')
+    # Same conversion under other names, streamed: copied from the cache
+    assert "found in the cache" in run('-t', 'sus', '-t', 't1', '-o', 'b.nii.gz', '--stream')
+    for type in ["sus", "t1"]:
+        a = np.asanyarray(nib.load(tmp_path / "output" / f"a_{type}.nii.gz").dataobj)
+        np.testing.assert_array_equal(np.asanyarray(nib.load(tmp_path / "output" / f"b_{type}.nii.gz").dataobj), a)
+    sidecar = json.loads((tmp_path / "output" / "b.json").read_text())
+    assert sidecar["cache"]["hit"] and sidecar["properties"] == {"sus": "b_sus.nii.gz", "t1": "b_t1.nii.gz"}
+
+    # Any parameter changes the key
+    assert "found in the cache" not in run('-t', 'sus', '-t', 't1', '-o', 'c.nii.gz', '--dtype', 'float64')
+    # And so does the encoding of the files
+    assert "found in the cache" not in run('-t', 'sus', '-t', 't1', '-o', 'd.nii.gz', '--compression', '9')
+
+    result = CliRunner().invoke(cache, ['info'])
+    assert "entries: 3" in result.output
+    result = CliRunner().invoke(cache, ['clear'])
+    assert "Removed 3 entries" in result.output
+
+
+def test_cache_key_and_eviction(tmp_path):
+    labels = np.arange(60, dtype=np.int16).reshape(3, 4, 5)
+    key = conversion_key([labels], labels.shape, labels.dtype, np.eye(4), {"sus": np.ones(3)}, {"a": 1})
+    # Slabs along z hash like the whole volume
+    assert conversion_key([labels[..., :2], labels[..., 2:]], labels.shape, labels.dtype, np.eye(4),
+                          {"sus": np.ones(3)}, {"a": 1}) == key
+    assert conversion_key([labels], labels.shape, labels.dtype, np.eye(4), {"sus": np.ones(3)}, {"a": 2}) != key
+
+    (tmp_path / "out.nii").write_bytes(b"0" * 1000)
+    result_cache = ResultCache(str(tmp_path / "cache"), max_bytes=2500)
+    for key in ["aa1", "bb2", "cc3"]:
+        result_cache.store(key, {"sus": "out.nii"}, str(tmp_path))
+    # The oldest entry was evicted to fit in the size bound
+    assert [entry[0] for entry in result_cache.entries()] == ["bb2", "cc3"]
+    assert result_cache.restore("aa1", {"sus": "a.nii"}, str(tmp_path)) is None
+    assert result_cache.restore("bb2", {"sus": "b.nii"}, str(tmp_path)) is not None
+    assert (tmp_path / "b.nii").read_bytes() == b"0" * 1000
+
+
+def test_cache_hit_stats_of_corrected_labels(tmp_path, make_segmentation, run):
+    make_segmentation(labels=(0, 1, 264, 500))
+
+    run('-t', 'sus', '-o', 'a.nii.gz', '-p', 'zero', '--stats', 'json')
+    assert "found in the cache" in run('-t', 'sus', '-o', 'b.nii.gz', '-p', 'zero', '--stats', 'json')
+    stats = [json.loads((tmp_path / "output" / f"{name}_stats.json").read_text()) for name in "ab"]
+    assert stats[0] == stats[1]
+    assert 500 not in [row["label_id"] for row in stats[1]["rows"]]
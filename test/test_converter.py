@@ -1,18 +1,33 @@
-import sys
-import os
-# With the next line we add to path the project folder to navigate into functions folder
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
 
-from click.testing import CliRunner
-from tissue2mrprop.cli.tissue_to_mr import hello
-from tissue2mrprop.functions import is_nifti
+import numpy as np
+import nibabel as nib
 
+from tissue2mrprop.functions.utils.utils import is_nifti
 
-def test_converter():
-    runner = CliRunner()
-    result = runner.invoke(hello, ['-i', 'input.nii', '--type', 'MR', '-o', 'output.nii'])
-    assert result.exit_code == 0
-    assert 'Input: input.nii Type: MR' in result.output
+
+def test_converter(tmp_path, segmentation, run_converter):
+    data = segmentation
+    run_converter('-t', 'sus', '-o', 'chi.nii.gz')
+
+    chi = np.asanyarray(nib.load(tmp_path / "output" / "chi.nii.gz").dataobj)
+    assert chi.dtype == np.float32
+    np.testing.assert_allclose(chi[data == 264], -8.92, rtol=1e-6)
+    sidecar = json.loads((tmp_path / "output" / "chi.json").read_text())
+    assert sidecar['input dtype'] == 'int16'
+    assert 'load' in sidecar['timings (s)']
+
+
+def test_converter_wrong_version(segmentation, run_converter):
+    result = run_converter('-t', 'sus', version='v1', exit_code=2)
+    assert "choose from" in result.output
+
+
+def test_converter_pixel_integrity(tmp_path, make_segmentation, run_converter):
+    make_segmentation(labels=(0, 1, 500))
+    result = run_converter('-t', 'sus', exit_code=1)
+    assert "Pixel integrity error" in result.output
+    assert not (tmp_path / "output" / "sus_dist.nii.gz").exists()
 
 
 def test_is_nifti():
@@ -20,4 +35,42 @@ def test_is_nifti():
     wrong_filepath = 'example.txt'
 
     assert is_nifti(good_filepath), "is_nifti failed for a correct filepath"
+    assert is_nifti('example.nii.gz'), "is_nifti failed for a compressed filepath"
     assert is_nifti(wrong_filepath) is False, "is_nifti failed for a wrong filepath"
+
+
+def test_converter_uncompressed_output(tmp_path, segmentation, run_converter):
+    run_converter('-t', 'sus', '-o', 'chi.nii', '--threads', '2')
+    assert nib.load(tmp_path / "output" / "chi.nii").shape == (8, 8, 4)
+    assert (tmp_path / "output" / "chi.json").exists()
+
+
+def test_converter_chi_sweep(tmp_path, make_segmentation, run_converter):
+    data = make_segmentation(labels=(0, 2, 7, 8))
+    run_converter('-t', 'sus', '-x', '-3:-2:0.5', '-l', '4d', '-o', 'sweep.nii.gz', segtool='compare_fm', version='dyn')
+    series = np.asanyarray(nib.load(tmp_path / "output" / "sweep.nii.gz").dataobj)
+    assert series.shape == (8, 8, 4, 3)
+    sidecar = json.loads((tmp_path / "output" / "sweep.json").read_text())
+    assert sidecar['chi sweep']['frames'] == {"0": -3.0, "1": -2.5, "2": -2.0}
+
+    # Every frame is the phantom made with that chi
+    for i, chi in enumerate([-3.0, -2.5, -2.0]):
+        run_converter('-t', 'sus', '-x', str(chi), '-o', f'single{i}.nii.gz', segtool='compare_fm', version='dyn')
+        single = np.asanyarray(nib.load(tmp_path / "output" / f"single{i}.nii.gz").dataobj)
+        np.testing.assert_array_equal(series[..., i], single)
+        np.testing.assert_allclose(single[np.isin(data, [7, 8])], chi)
+
+    run_converter('-t', 'sus', '-x', '-3,-2', segtool='compare_fm', version='mod0', exit_code=2)
+    result = run_converter('-t', 'sus', '-x', ',', segtool='compare_fm', version='dyn', exit_code=2)
+    assert "No value" in result.output
+
+
+def test_converter_all_types_with_texture(tmp_path, make_segmentation, run_converter):
+    # The Perm & Cond types have no texture, the spinal cord keeps their piece-wise value
+    data = make_segmentation(labels=(0, 1, 196, 324))
+    for args in [[], ['-l', '4d'], ['--stream']]:
+        run_converter('-t', 'all', '-g', '1', '--seed', '2', *args, '-o', 'all.nii.gz', version='mod2')
+    perm = np.asanyarray(nib.load(tmp_path / "output" / "gauss_all_perm3T.nii.gz").dataobj)
+    assert len(np.unique(perm[data == 196])) == 1
+    t1 = np.asanyarray(nib.load(tmp_path / "output" / "gauss_all_t1.nii.gz").dataobj)
+    assert len(np.unique(t1[data == 196])) > 1
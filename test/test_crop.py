@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+import nibabel as nib
+import pytest
+
+from tissue2mrprop.functions.utils.crop import crop_box, crop_affine
+
+
+def test_crop_box_and_affine():
+    labels = np.zeros((10, 9, 8), dtype=np.int16)
+    labels[2:5, 3, 4:6] = 5
+    labels[7, 6, 1] = 90
+    assert crop_box(labels) == (slice(2, 8), slice(3, 7), slice(1, 6))
+    assert crop_box(labels, keep=[5], margin=1) == (slice(1, 6), slice(2, 5), slice(3, 7))
+    assert crop_box(labels, keep=[5], margin=10) == (slice(0, 10), slice(0, 9), slice(0, 8))
+    assert crop_box(np.zeros((3, 3, 3))) is None
+    affine = np.array([[0, -2, 0, 10], [1, 0, 0, -5], [0, 0, 3, 1], [0, 0, 0, 1]], dtype=float)
+    box = crop_box(labels)
+    cropped = crop_affine(affine, box)
+    # The first voxel of the box is at the same place in both grids
+    np.testing.assert_allclose(cropped @ [0, 0, 0, 1], affine @ [2, 3, 1, 1])
+
+
+@pytest.fixture
+def run(run_converter):
+    # Susceptibility phantom of the converter, the output file is the last argument
+    def convert(*args, seg="seg.nii.gz", version="mod0", prefix=""):
+        run_converter('-t', 'sus', *args, seg=seg, version=version)
+        return nib.load(f"output/{prefix}{args[-1]}")
+    return convert
+
+
+def test_converter_crop(workdir, run):
+    data = np.zeros((12, 10, 8), dtype=np.int16)
+    data[3:8, 2:6, 2:7] = np.random.default_rng(0).choice([1, 2, 5, 90, 264], size=(5, 4, 5))
+    affine = np.diag([1.0, 2.0, 3.0, 1.0])
+    affine[:3, 3] = [-4, 5, 6]
+    nib.save(nib.Nifti1Image(data, affine), "seg.nii.gz")
+    full = run('-o', 'full.nii.gz')
+    full_data = np.asanyarray(full.dataobj)
+
+    cropped = run('--crop', '--crop-margin', '1', '-o', 'crop.nii.gz')
+    assert cropped.shape == (7, 6, 7)
+    np.testing.assert_allclose(cropped.affine, full.affine @ np.array([[1, 0, 0, 2], [0, 1, 0, 1], [0, 0, 1, 1],
+                                                                         [0, 0, 0, 1]]))
+    np.testing.assert_array_equal(np.asanyarray(cropped.dataobj), full_data[2:9, 1:7, 1:8])
+    sidecar = json.loads((workdir / "output" / "crop.json").read_text())
+    assert sidecar["crop"]["start"] == [2, 1, 1] and "update" not in sidecar
+
+    padded = run('--crop', '--pad', '-o', 'pad.nii.gz')
+    assert padded.shape == full.shape
+    np.testing.assert_allclose(padded.affine, full.affine)
+    np.testing.assert_array_equal(np.asanyarray(padded.dataobj), full_data)
+
+    fat = run('--crop-labels', 'fat', '--crop-margin', '0', '-o', 'fat.nii.gz')
+    coords = np.argwhere(data == 264)
+    assert fat.shape == tuple(coords.max(axis=0) - coords.min(axis=0) + 1)
+
+    # The texture of the spinal cord is the same with or without cropping
+    sc = np.where(data > 0, np.random.default_rng(1).choice([196, 324], size=data.shape), 0).astype(np.int16)
+    nib.save(nib.Nifti1Image(sc, affine), "sc.nii.gz")
+    args = ('-g', '1', '--seed', '4')
+    gauss = run(*args, '-o', 'g.nii.gz', seg="sc.nii.gz", version="mod2", prefix="gauss_")
+    gauss_pad = run(*args, '--crop', '--pad', '-o', 'gp.nii.gz', seg="sc.nii.gz", version="mod2", prefix="gauss_")
+    np.testing.assert_array_equal(np.asanyarray(gauss_pad.dataobj), np.asanyarray(gauss.dataobj))
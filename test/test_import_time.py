@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+
+# Import time budget of the CLI in seconds, --help should stay well under a second
+IMPORT_BUDGET = 0.5
+# Modules that must not be imported until a conversion needs them
+HEAVY_MODULES = ["nibabel", "pandas", "matplotlib", "git", "scipy", "argparse"]
+
+CODE = """
+import json, sys, time
+start = time.perf_counter()
+import tissue2mrprop.cli.tissue_to_mr
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def import_cli():
+    # Fresh interpreter every time, modules already imported by pytest don't count
+    out = subprocess.run([sys.executable, "-c", CODE], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def test_cli_import_is_slim():
+    assert import_cli()["loaded"] == []
+
+
+def test_cli_import_time_budget():
+    # Best of a few runs, to not fail on a busy machine
+    elapsed = min(import_cli()["elapsed"] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, f"Importing the CLI took {elapsed:.3f} s, budget is {IMPORT_BUDGET} s"
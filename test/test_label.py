@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from tissue2mrprop.functions.label import SegmentationLabel, LabelTable, LABEL_COLUMNS
+from tissue2mrprop.functions.utils.select_tool import return_dict_labels
+from tissue2mrprop.functions.utils.property_map import PROPERTY_ATTRS, PROPERTY_FALLBACK
+
+
+TOOLS = [("TotalSeg_CT", "v2"), ("TotalSeg_CT", "mod0"), ("TotalSeg_CT", "mod1"), ("TotalSeg_CT", "mod2"),
+         ("TotalSeg_MRI", "v1"), ("TotalSeg_MRI", "mod0"), ("charles", "v1"), ("compare_fm", "mod0"),
+         ("compare_fm", "mod_PAM50"), ("compare_fm", "ds005616")]
+
+
+def label_objects(look_up, static):
+    # Labels made one by one, as group_seg_labels used to do
+    labels = {}
+    for label_id, (name, sus) in look_up.items():
+        label = SegmentationLabel(label_id)
+        if static:
+            label.set_static_name(name)
+        label.set_name(name)
+        label.set_susceptibility(sus)
+        labels[label_id] = label
+    return labels
+
+
+@pytest.mark.parametrize("static", [False, True])
+@pytest.mark.parametrize("tool, version", TOOLS)
+def test_table_matches_labels(tool, version, static):
+    look_up = return_dict_labels(tool, version)
+    table = LabelTable.from_look_up(look_up, static=static)
+    labels = label_objects(look_up, static)
+
+    for label_id, label in labels.items():
+        view = table.label(label_id)
+        assert view.name == label.name
+        for col in LABEL_COLUMNS:
+            assert getattr(view, col) == getattr(label, col), (label_id, col)
+
+    for prop in PROPERTY_ATTRS:
+        lut, missing = table.lut(prop)
+        assert len(lut) == max(labels) + 1
+        assert np.isnan(np.delete(lut, list(labels))).all()
+        for label_id, label in labels.items():
+            value = getattr(label, PROPERTY_ATTRS[prop])
+            expected = PROPERTY_FALLBACK[prop] if value is None else value
+            np.testing.assert_equal(lut[label_id], expected)
+        assert missing == sorted(l for l, label in labels.items() if getattr(label, PROPERTY_ATTRS[prop]) is None)
+
+
+@pytest.mark.parametrize("prop, expected", [
+    ("sus", [0.35, -9.05, -8.92]),
+    ("t1", [0.01, 1328, 401.2]),
+    ("t2", [0.01, 60.9, 129.3]),
+    ("t2s", [0.01, 16.3, 64.65]),
+    ("pd", [0.01, 75, 20]),
+])
+def test_lut_values(prop, expected):
+    # air, spleen and fat of TotalSeg_CT mod0
+    lut, missing = LabelTable.from_look_up(return_dict_labels("TotalSeg_CT", "mod0")).lut(prop)
+    np.testing.assert_allclose(lut[[0, 1, 264]], expected)
+    assert len(lut) == 265 and missing == []
+
+
+def test_lut_fallback_values():
+    # Lungs and trachea of compare_fm dyn have no chi until one is given, other labels have no T1
+    table = LabelTable.from_look_up(return_dict_labels("compare_fm", "dyn"))
+    lut, missing = table.lut("sus")
+    assert missing == [7, 8]
+    np.testing.assert_array_equal(lut[[7, 8]], [-9.05, -9.05])
+    assert np.isnan(lut[[1, 4, 6]]).all()
+    lut, missing = table.lut("t1")
+    assert missing[:2] == [15, 25] and lut[15] == 0
+
+
+def test_table_is_immutable():
+    table = LabelTable.from_look_up(return_dict_labels("TotalSeg_CT", "mod2"))
+    with pytest.raises(ValueError):
+        table.columns["susceptibility"][0] = 1
+    new_table = table.replace(1, susceptibility=-1.5, name="fat")
+    assert new_table.value(1, "susceptibility") == -1.5
+    assert new_table.label(1).name == "fat"
+    assert table.value(1, "susceptibility") != -1.5
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import nibabel as nib
+
+from tissue2mrprop.functions.utils import label_index
+from tissue2mrprop.functions.utils.label_index import LabelIndex, label_index_path, label_counts
+
+
+def test_label_index_matches_scans():
+    labels = np.random.default_rng(0).choice([0, 2, 5, 90, 264], size=(7, 6, 5)).astype(np.int16)
+    index = LabelIndex.from_volume(labels)
+    np.testing.assert_array_equal(index.labels, np.unique(labels))
+    assert index.counts() == {int(l): int((labels == l).sum()) for l in np.unique(labels)}
+    for l in index.labels:
+        np.testing.assert_array_equal(index.voxels_of(l), np.flatnonzero(labels == l))
+    assert len(index.voxels_of(1)) == 0 and 1 not in index
+    np.testing.assert_array_equal(index.mask([2, 90]), np.isin(labels, [2, 90]))
+    for a, b in zip(index.coords([5, 264]), np.nonzero(np.isin(labels, [5, 264]))):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_label_counts_without_index(monkeypatch):
+    # A few slices at a time
+    monkeypatch.setattr(label_index, "SLAB_VOXELS", 50)
+    rng = np.random.default_rng(3)
+    for labels in [rng.choice([0, 2, 5, 90, 264], size=(7, 6, 5)).astype(np.int16),
+                   rng.choice([-3, 0, 7], size=(4, 3, 6)).astype(np.int16),
+                   rng.choice([1, 4], size=(3, 3, 2)).astype(np.uint8),
+                   rng.choice([0.0, 2.0, 5.0], size=(3, 3, 2)),
+                   np.array([0, 10**9], dtype=np.int64).reshape(1, 1, 2)]:
+        assert label_counts(labels) == LabelIndex.from_volume(labels).counts()
+
+
+def test_label_index_saved_and_validated(tmp_path):
+    labels = np.random.default_rng(1).choice([0, 2, 5], size=(4, 4, 3)).astype(np.int16)
+    source = str(tmp_path / "seg.nii.gz")
+    nib.save(nib.Nifti1Image(labels, np.eye(4)), source)
+    path = label_index_path(source)
+    assert path == str(tmp_path / "seg.labelindex.npz")
+
+    LabelIndex.from_volume(labels).save(path, source)
+    loaded = LabelIndex.load(path, source)
+    np.testing.assert_array_equal(loaded.voxels_of(5), np.flatnonzero(labels == 5))
+    assert loaded.shape == labels.shape
+    # The segmentation changed since the index was saved
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert LabelIndex.load(path, source) is None
+    assert LabelIndex.load(str(tmp_path / "missing.npz"), source) is None
+
+
+def test_converter_reuses_label_index(make_segmentation, run_converter):
+    make_segmentation(seed=2)
+    args = ['-t', 'sus', '-g', '1', '--seed', '3', '--label-index']
+    first = run_converter(*args, '-o', 'a.nii.gz')
+    assert "Label index saved" in first.output and os.path.isfile("seg.labelindex.npz")
+    second = run_converter(*args, '-o', 'b.nii.gz')
+    assert "Label index loaded" in second.output
+    np.testing.assert_array_equal(np.asanyarray(nib.load("output/gauss_a.nii.gz").dataobj),
+                                  np.asanyarray(nib.load("output/gauss_b.nii.gz").dataobj))
@@ -0,0 +1,50 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from tissue2mrprop.functions.utils.label_index import LabelIndex
+from tissue2mrprop.functions.utils.label_stats import label_statistics
+from tissue2mrprop.functions.volume import label_table
+
+
+def test_label_statistics_matches_masks():
+    labels = np.random.default_rng(0).choice([0, 2, 5, 90, 264], size=(7, 6, 5)).astype(np.int16)
+    affine = np.diag([0.5, 2.0, 3.0, 1.0])
+    table = label_table("TotalSeg_CT", "mod0")
+    stats = label_statistics(LabelIndex.from_volume(labels), affine, table)
+    rows = {row["label_id"]: row for row in stats if row["level"] == "label"}
+    assert sorted(rows) == [0, 2, 5, 90, 264]
+    for l, row in rows.items():
+        coords = np.argwhere(labels == l)
+        assert row["voxels"] == len(coords)
+        assert row["volume_mm3"] == pytest.approx(len(coords) * 3.0)
+        assert row["bbox_min"] == coords.min(axis=0).tolist() and row["bbox_max"] == coords.max(axis=0).tolist()
+        assert row["name"] == table.names[table.rows[l]]
+        assert row["susceptibility"] == table.value(l, "susceptibility")
+
+    tissues = {row["name"]: row for row in stats if row["level"] == "tissue"}
+    for name, row in tissues.items():
+        members = [l for l in rows if rows[l]["name"] == name]
+        assert sorted(row["label_id"]) == members
+        assert row["voxels"] == sum(rows[l]["voxels"] for l in members)
+        coords = np.argwhere(np.isin(labels, members))
+        assert row["bbox_min"] == coords.min(axis=0).tolist()
+
+
+def test_converter_stats(tmp_path, make_segmentation, run_converter):
+    data = make_segmentation(seed=1)
+    for fmt in ["csv", "json"]:
+        run_converter('-t', 'sus', '--stats', fmt, '-o', f'{fmt}.nii.gz')
+    with open("output/csv_stats.csv", newline='') as f:
+        rows = list(csv.DictReader(f))
+    labels = [row for row in rows if row["level"] == "label"]
+    assert [int(row["label_id"]) for row in labels] == [0, 1, 2, 5, 90, 264]
+    assert int(labels[-1]["voxels"]) == int((data == 264).sum())
+    assert {"bbox_min_x", "bbox_max_z", "susceptibility"} <= set(rows[0])
+
+    table = json.loads((tmp_path / "output" / "json_stats.json").read_text())
+    assert table["voxel_volume_mm3"] == 1.0
+    assert table["rows"][0]["label_id"] == 0
+    assert json.loads((tmp_path / "output" / "json.json").read_text())["label stats"] == "json_stats.json"
@@ -0,0 +1,31 @@
+import gzip
+
+import numpy as np
+import nibabel as nib
+import pytest
+
+from tissue2mrprop.functions.utils.nifti_io import BlockGzipFile, save_nifti
+
+
+@pytest.mark.parametrize("name,threads", [("vol.nii.gz", 1), ("vol.nii.gz", 3), ("vol.nii", 3)])
+def test_save_nifti(tmp_path, name, threads):
+    data = np.random.default_rng(0).normal(size=(20, 16, 12, 2))
+    path = str(tmp_path / name)
+    save_nifti(data, np.diag([2, 2, 3, 1]), path, dtype=np.float32, compresslevel=6, threads=threads)
+
+    img = nib.load(path)
+    assert img.get_data_dtype() == np.float32
+    np.testing.assert_array_equal(np.asanyarray(img.dataobj), data.astype(np.float32))
+    np.testing.assert_array_equal(img.affine, np.diag([2, 2, 3, 1]))
+
+
+def test_block_gzip_is_standard_gzip(tmp_path):
+    path = str(tmp_path / "blocks.gz")
+    chunks = [bytes([i]) * size for i, size in enumerate([5, 100, 3, 64, 1])]
+    f = BlockGzipFile(path, threads=2, block_size=16)
+    for chunk in chunks:
+        f.write(chunk)
+    assert f.tell() == sum(len(c) for c in chunks)
+    f.close()
+    with gzip.open(path) as f:
+        assert f.read() == b"".join(chunks)
@@ -0,0 +1,35 @@
+import numpy as np
+
+from tissue2mrprop.cli.tissue_to_mr import convert
+from tissue2mrprop.functions.utils.profiler import StageProfiler
+
+
+def test_nested_stages_and_memory():
+    profiler = StageProfiler(memory=True)
+    with profiler.stage("outer"):
+        for _ in range(2):
+            with profiler.stage("inner"):
+                data = np.ones(2**22)  # 32 MB
+                del data
+    profiler.close()
+
+    stats = profiler.stats()
+    assert list(stats) == ["outer/inner", "outer"]
+    assert stats["outer/inner"]["calls"] == 2
+    assert stats["outer/inner"]["peak_mb"] >= 32
+    # The peak of a nested stage is part of the peak of its parent
+    assert stats["outer"]["peak_mb"] >= stats["outer/inner"]["peak_mb"]
+    assert profiler.slowest() == "outer"
+
+
+def test_convert_stats(tmp_path, segmentation):
+
+    profiler = StageProfiler(memory=True, cprofile=True)
+    assert convert("seg.nii.gz", "TotalSeg_CT", "mod0", ["sus", "t1"], profiler=profiler)
+    profiler.close()
+
+    stats = profiler.stats()
+    for stage in ["load", "load/decompress", "group labels", "check pixels", "convert/map sus", "convert/save t1"]:
+        assert stats[stage]["calls"] == 1
+    assert profiler.dump_slowest(str(tmp_path / "slowest.prof")) == profiler.slowest()
+    assert (tmp_path / "slowest.prof").exists()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from tissue2mrprop.functions.utils.provenance import (find_git_dir, read_commit, read_remote, provenance,
+                                                       peak_memory_mb, reset_peak_memory)
+
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+
+
+def make_repo(path, config):
+    git = path / ".git"
+    (git / "refs" / "heads").mkdir(parents=True)
+    (git / "HEAD").write_text("ref: refs/heads/master\n")
+    (git / "config").write_text(config)
+    return git
+
+
+def test_loose_ref_and_origin(tmp_path):
+    git = make_repo(tmp_path, '[core]\n\tbare = false\n[remote "upstream"]\n\turl = https://a/b.git\n'
+                              '[remote "origin"]\n\turl = https://c/d.git\n\tfetch = +refs/heads/*\n')
+    (git / "refs" / "heads" / "master").write_text(COMMIT + "\n")
+    (tmp_path / "pkg" / "sub").mkdir(parents=True)
+    assert find_git_dir(tmp_path) == git
+    # A folder inside the repository is not the top of it
+    assert find_git_dir(tmp_path / "pkg" / "sub") is None
+    assert read_commit(git) == COMMIT
+    assert read_remote(git) == "https://c/d.git"
+
+
+def test_packed_ref_and_no_origin(tmp_path):
+    git = make_repo(tmp_path, '[core]\n\tbare = false\n')
+    (git / "packed-refs").write_text("# pack-refs with: peeled\n" + COMMIT + " refs/heads/master\n")
+    assert read_commit(git) == COMMIT
+    assert read_remote(git) is None
+
+
+def test_provenance_is_cached():
+    assert provenance() is provenance()
+    assert provenance()["version"]
+
+
+def test_worktree_git_file(tmp_path):
+    git = make_repo(tmp_path / "main", '[core]\n\tbare = false\n')
+    (tmp_path / "tree").mkdir()
+    (tmp_path / "tree" / ".git").write_text(f"gitdir: {git}\n")
+    assert find_git_dir(tmp_path / "tree") == git
+
+
+def test_peak_memory_since_reset():
+    if not reset_peak_memory():
+        pytest.skip("The memory peak can only be reset on Linux")
+    big = np.ones(2**24)  # 128 MB
+    del big
+    high = peak_memory_mb(since_reset=True)
+    # A new conversion doesn't report the peak of the previous one
+    assert reset_peak_memory()
+    assert peak_memory_mb(since_reset=True) < high - 64
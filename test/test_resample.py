@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import nibabel as nib
+
+from tissue2mrprop.functions.utils.resample import resample, voxel_size_grid, block_factors
+
+
+def test_block_mean_matches_label_fractions():
+    labels = np.random.default_rng(0).integers(0, 4, size=(9, 8, 7)).astype(np.int16)
+    lut = np.array([0.0, 1.0, 10.0, 100.0])
+    affine = np.diag([1.0, 1.0, 2.0, 1.0])
+    shape, target = voxel_size_grid(labels.shape, affine, [2, 2, 4])
+    assert shape == (5, 4, 4) and block_factors(affine, target) == (2, 2, 2)
+    out = resample(labels, affine, shape, target, values=lambda s: lut[s], dtype=np.float64)
+    expected = np.empty(shape)
+    for x, y, z in np.ndindex(shape):
+        block = labels[2 * x:2 * x + 2, 2 * y:2 * y + 2, 2 * z:2 * z + 2]
+        # Fraction of the block filled by every label times its value
+        expected[x, y, z] = sum(np.mean(block == l) * lut[l] for l in range(4))
+    np.testing.assert_allclose(out, expected)
+    # The supersampling of an aligned grid gives the same fractions
+    np.testing.assert_allclose(resample(labels, affine, shape, target, values=lambda s: lut[s], supersample=2),
+                               expected, rtol=1e-6)
+
+
+def test_supersample_shifted_grid():
+    labels = np.zeros((6, 6, 6), dtype=np.int16)
+    labels[3:] = 1
+    affine = np.eye(4)
+    # Target voxels of 2 mm shifted by half a voxel straddle the boundary between the labels
+    target = np.diag([2.0, 2.0, 2.0, 1.0])
+    target[:3, 3] = [1.0, 0.5, 0.5]
+    assert block_factors(affine, target) is None
+    out = resample(labels, affine, (3, 3, 3), target)
+    np.testing.assert_allclose(out[:, 0, 0], [0, 0.5, 1])
+
+
+def test_converter_voxel_size(tmp_path, make_segmentation, run_converter):
+    make_segmentation(affine=np.diag([1.0, 1.0, 2.0, 1.0]), seed=1)
+    run_converter('-t', 'sus', '--voxel-size', '2,2,4', '-o', 'coarse.nii.gz')
+    run_converter('-t', 'sus', '-o', 'fine.nii.gz')
+    coarse = nib.load("output/coarse.nii.gz")
+    fine = np.asanyarray(nib.load("output/fine.nii.gz").dataobj).astype(np.float64)
+    assert coarse.shape == (4, 4, 2)
+    np.testing.assert_allclose(coarse.header.get_zooms(), (2, 2, 4))
+    np.testing.assert_allclose(np.asanyarray(coarse.dataobj), fine.reshape(4, 2, 4, 2, 2, 2).mean(axis=(1, 3, 5)),
+                               rtol=1e-5)
+    sidecar = json.loads((tmp_path / "output" / "coarse.json").read_text())
+    assert sidecar["grid"]["method"] == "block" and "update" not in sidecar
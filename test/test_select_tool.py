@@ -0,0 +1,36 @@
+import pytest
+
+from tissue2mrprop.functions.utils.select_tool import return_dict_labels, compile_labels
+
+
+def test_versions_are_overlays():
+    base = return_dict_labels("TotalSeg_CT", "v2")
+    mod2 = return_dict_labels("TotalSeg_CT", "mod2")
+    assert set(mod2) - set(base) == {264, 289, 196, 324}
+    assert all(mod2[k] == v for k, v in base.items())
+
+
+def test_compiled_once_and_frozen():
+    look_up = compile_labels("TotalSeg_CT", "mod1")
+    assert compile_labels("TotalSeg_CT", "mod1") is look_up
+    with pytest.raises(TypeError):
+        look_up[0] = ("water", -9.05)
+    # Callers get a copy they can modify
+    copy = return_dict_labels("TotalSeg_CT", "mod1")
+    copy[0] = ("water", -9.05)
+    assert return_dict_labels("TotalSeg_CT", "mod1")[0] == ("air", 0.35)
+
+
+def test_dynamic_chi():
+    look_up = return_dict_labels("compare_fm", "dyn", new_chi=-3.5)
+    assert look_up[7] == ("lungs", -3.5) and look_up[8] == ("trachea", -3.5)
+    assert return_dict_labels("compare_fm", "mod0")[7] == ("lungs", -4.2)
+
+
+@pytest.mark.parametrize("tool, version, choices", [
+    ("ProCord_MRI", "v1", "TotalSeg_CT"),
+    ("TotalSeg_CT", "v1", "mod2"),
+])
+def test_unknown_tool_or_version(tool, version, choices):
+    with pytest.raises(ValueError, match=choices):
+        return_dict_labels(tool, version)
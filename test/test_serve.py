@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+import signal
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import nibabel as nib
+import pytest
+from click.testing import CliRunner
+
+from tissue2mrprop import convert_labels
+from tissue2mrprop.cli.serve import ConversionService, make_server, serve, is_loopback
+
+
+@pytest.fixture(scope="module")
+def server():
+    service = ConversionService(workers=1)
+    httpd = make_server(service, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+
+def request(url, body=None, content_type="application/json"):
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_serve_convert(server, tmp_path, make_segmentation):
+    labels = make_segmentation(labels=(0, 1, 2, 90, 264))
+    seg = tmp_path / "seg.nii.gz"
+    expected = convert_labels(labels, "TotalSeg_CT", "mod0", ["sus", "t1"])
+
+    # Path in, file out
+    params = {"input": str(seg), "segtool": "TotalSeg_CT", "version": "mod0", "type": ["sus", "t1"],
+              "output": str(tmp_path / "out" / "phantom.nii.gz")}
+    status, _, body = request(server + "/convert", json.dumps(params).encode())
+    assert status == 200, body
+    outputs = json.loads(body)["outputs"]
+    np.testing.assert_array_equal(np.asanyarray(nib.load(outputs["t1"]).dataobj), expected["t1"])
+
+    # Buffer in, buffer out
+    status, headers, body = request(server + "/convert?segtool=TotalSeg_CT&version=mod0&type=sus",
+                                    seg.read_bytes(), "application/octet-stream")
+    assert status == 200
+    assert headers["X-Properties"] == "sus"
+    result = nib.Nifti1Image.from_bytes(gzip.decompress(body))
+    np.testing.assert_array_equal(np.asanyarray(result.dataobj), expected["sus"])
+
+    # Errors are reported, not raised
+    params["version"] = "v1"
+    status, _, body = request(server + "/convert", json.dumps(params).encode())
+    assert status == 400 and "v1" in json.loads(body)["error"]
+
+    status, _, body = request(server + "/metrics")
+    metrics = json.loads(body)
+    assert metrics["succeeded"] == 2 and metrics["failed"] == 1
+    assert metrics["latency_s"]["count"] == 3
+    assert json.loads(request(server + "/health")[2])["status"] == "ok"
+
+
+def test_serve_restarts_dead_workers(tmp_path, make_segmentation):
+    make_segmentation(shape=(4, 4, 2))
+    params = {"input": str(tmp_path / "seg.nii.gz"), "segtool": "TotalSeg_CT", "version": "mod0", "type": ["sus"]}
+    service = ConversionService(workers=1)
+    try:
+        assert "nifti" in service.convert(params)
+        for pid in list(service.pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        with pytest.raises(RuntimeError, match="died"):
+            service.convert(params)
+        # The next requests run on the new pool
+        assert "nifti" in service.convert(params)
+        assert service.health()["pool_restarts"] == 1
+    finally:
+        service.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix sockets only")
+def test_serve_socket_only_replaces_sockets(tmp_path):
+    path = str(tmp_path / "service.sock")
+    with open(path, "w") as f:
+        f.write("not a socket")
+    with pytest.raises(OSError):
+        make_server(None, socket_path=path)
+    assert open(path).read() == "not a socket"
+
+    os.remove(path)
+    make_server(None, socket_path=path).server_close()
+    # The socket left by a previous run is replaced
+    httpd = make_server(None, socket_path=path)
+    httpd.server_close()
+    os.remove(path)
+
+
+def test_serve_refuses_remote_host():
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and is_loopback("localhost")
+    assert not is_loopback("0.0.0.0") and not is_loopback("192.168.1.2")
+    result = CliRunner().invoke(serve, ["--host", "0.0.0.0", "--port", "0"])
+    assert result.exit_code == 2
+    assert "--allow-remote" in result.output
@@ -0,0 +1,44 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from tissue2mrprop.cli.tissue_to_mr import convert
+
+
+@pytest.fixture
+def segmentation(make_segmentation, workdir):
+    # TotalSeg_CT mod2 labels with the spinal cord, anisotropic voxels
+    make_segmentation(labels=(0, 1, 2, 5, 10, 90, 264, 289, 196, 324), shape=(12, 10, 9),
+                      affine=np.diag([0.5, 0.5, 2, 1]))
+    return workdir
+
+
+@pytest.mark.parametrize("layout, gauss", [("split", "0"), ("4d", "0"), ("split", "1")])
+def test_stream_matches_in_memory(segmentation, layout, gauss):
+    kwargs = dict(input_file="seg.nii.gz", segtool="TotalSeg_CT", version="mod2", type=["sus", "t2s"],
+                  layout=layout, gauss=gauss, seed=3)
+    assert convert(output_file="mem.nii.gz", **kwargs)
+    assert convert(output_file="slab.nii.gz", stream=True, mem_budget=0.001, **kwargs)
+
+    prefix = "gauss_" if gauss == "1" else ""
+    names = [""] if layout == "4d" else ["_sus", "_t2s"]
+    for name in names:
+        mem = nib.load(segmentation / "output" / f"{prefix}mem{name}.nii.gz")
+        slab = nib.load(segmentation / "output" / f"{prefix}slab{name}.nii.gz")
+        np.testing.assert_array_equal(mem.get_fdata(), slab.get_fdata())
+        np.testing.assert_array_equal(mem.affine, slab.affine)
+        assert slab.get_data_dtype() == np.float32
+
+
+def test_stream_zero_policy_writes_corrected_labels(segmentation):
+    img = nib.load("seg.nii.gz")
+    labels = np.asanyarray(img.dataobj).copy()
+    labels[3, 4, 5] = 999
+    nib.save(nib.Nifti1Image(labels, img.affine), "bad.nii.gz")
+
+    assert not convert("bad.nii.gz", "TotalSeg_CT", "mod2", "sus", stream=True, output_file="fail.nii.gz")
+    assert convert("bad.nii.gz", "TotalSeg_CT", "mod2", "sus", stream=True, pixel_policy="zero",
+                   output_file="zero.nii.gz")
+    corrected = np.asanyarray(nib.load(segmentation / "output" / "badcorrected_pixels.nii.gz").dataobj)
+    assert corrected[3, 4, 5] == 0 and corrected.dtype == np.int16
+    assert nib.load(segmentation / "output" / "zero.nii.gz").get_fdata()[3, 4, 5] == np.float32(0.35)
@@ -0,0 +1,78 @@
+import json
+
+import numpy as np
+import nibabel as nib
+import pytest
+from click.testing import CliRunner
+
+from tissue2mrprop.cli.update import update
+from tissue2mrprop.functions.update import update_phantom
+from tissue2mrprop.functions.utils.label_index import LabelIndex
+
+
+@pytest.fixture
+def convert(run_converter):
+    # Phantom made by the converter, the output file is the last argument
+    def run(*args):
+        run_converter(*args)
+        return np.asanyarray(nib.load(f"output/{args[-1]}").dataobj)
+    return run
+
+
+def test_ref_and_update(tmp_path, segmentation, convert):
+    data = segmentation
+    chi = convert('-t', 'sus', '-o', 'chi.nii.gz')
+    # The reference shifts every voxel
+    shifted = convert('-t', 'sus', '-r', '-9.05', '-o', 'ref.nii.gz')
+    np.testing.assert_allclose(shifted, chi + 9.05, atol=1e-6)
+
+    result = CliRunner().invoke(update, ['-i', 'output/ref.nii.gz', '--set', 'fat=-8.5', '--set', '1=0.3',
+                                         '-r', '-9', '-o', 'output/updated.nii.gz'])
+    assert result.exit_code == 0, result.output
+    updated = np.asanyarray(nib.load("output/updated.nii.gz").dataobj)
+    expected = chi + 9.0
+    expected[data == 264] = -8.5 + 9
+    expected[data == 1] = 0.3 + 9
+    np.testing.assert_allclose(updated, expected, atol=1e-6)
+
+    sidecar = json.loads((tmp_path / "output" / "updated.json").read_text())
+    assert sidecar["update"]["ref"] == -9
+    assert sidecar["update"]["property table"]["sus"]["264"] == -8.5
+    assert sidecar["updates"][0]["labels"] == {"1": 0.3, "264": -8.5}
+
+
+def test_update_other_type_ignores_ref(segmentation, run_converter):
+    # The reference of a susceptibility converted at the same time doesn't shift the other properties
+    run_converter('-t', 'sus', '-t', 't1', '-r', '1', '-o', 'multi.nii.gz')
+    # The sidecar multi.json of the conversion is found from the name of the phantom
+    result = CliRunner().invoke(update, ['-i', 'output/multi_t1.nii.gz', '--set', '1=1000', '-o', 'output/t1.nii.gz'])
+    assert result.exit_code == 0, result.output
+    before = np.asanyarray(nib.load("output/multi_t1.nii.gz").dataobj)
+    updated = np.asanyarray(nib.load("output/t1.nii.gz").dataobj)
+    np.testing.assert_allclose(updated[segmentation == 1], 1000)
+    np.testing.assert_array_equal(updated[segmentation != 1], before[segmentation != 1])
+    assert json.loads(open("output/t1.json").read())["update"]["ref"] == 1
+
+    # Same for the textured phantoms
+    run_converter('-t', 'sus', '-t', 't1', '-g', '1', '--seed', '1', '-o', 'tex.nii.gz')
+    result = CliRunner().invoke(update, ['-i', 'output/gauss_tex_t1.nii.gz', '--set', '1=1000'])
+    assert result.exit_code == 0, result.output
+    np.testing.assert_allclose(np.asanyarray(nib.load("output/gauss_tex_t1.nii.gz").dataobj)[segmentation == 1], 1000)
+
+
+def test_update_phantom_keeps_texture():
+    labels = np.array([[[1, 2], [2, 3]]])
+    phantom = np.array([[[1.0, 2.1], [1.9, 3.0]]], dtype=np.float32)
+    count = update_phantom(phantom, labels, {1: 1, 2: 2, 3: 3}, {1: 1, 2: 5, 3: 3}, textured=True)
+    assert count == 2
+    np.testing.assert_allclose(phantom, [[[1.0, 5.1], [4.9, 3.0]]], rtol=1e-6)
+
+
+def test_update_phantom_with_index():
+    labels = np.random.default_rng(0).choice([0, 1, 2, 5], size=(5, 4, 3))
+    old, new = {0: 0.0, 1: 1.0, 2: 2.0, 5: 5.0}, {0: 0.0, 1: 1.5, 2: 2.0, 5: -3.0}
+    scanned = labels.astype(np.float32)
+    indexed = labels.astype(np.float32)
+    count = update_phantom(scanned, labels, old, new, new_ref=1)
+    assert update_phantom(indexed, None, old, new, new_ref=1, index=LabelIndex.from_volume(labels)) == count
+    np.testing.assert_array_equal(indexed, scanned)
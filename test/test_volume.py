@@ -0,0 +1,224 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from tissue2mrprop.functions.volume import volume
+from tissue2mrprop.functions.utils.select_tool import return_dict_labels
+from tissue2mrprop.functions.utils.random_streams import draw_label_samples
+
+
+def make_volume(tool, version, type, shape=(6, 5, 4), seed=0, new_chi=None, dtype=np.float64, label_dtype=np.float64):
+    rng = np.random.default_rng(seed)
+    look_ids = np.array(sorted(return_dict_labels(tool, version, new_chi=new_chi)))
+    data = rng.choice(look_ids, size=shape).astype(label_dtype)
+    vol = volume(nib.Nifti1Image(data, affine=np.eye(4)), dtype=dtype)
+    vol.new_chi = new_chi
+    vol.group_seg_labels(tool, version, type, ref=0)
+    return vol
+
+
+def loop_reference(vol, attr, fallback):
+    # Voxel by voxel mapping, as originally done by the create_* methods
+    out = np.zeros(vol.dimensions)
+    for idx in np.ndindex(*vol.dimensions):
+        value = getattr(vol.segmentation_labels[vol.volume[idx]], attr)
+        out[idx] = fallback if value is None else value
+    return out
+
+
+@pytest.mark.parametrize("type, method, attr, fallback", [
+    ("sus", "create_sus_dist", "susceptibility", -9.05),
+    ("t1", "create_t1_vol", "T1_val", 0),
+    ("t2", "create_t2_vol", "T2_val", 0.001),
+    ("t2s", "create_t2_star_vol", "T2star_val", 0.001),
+    ("pd", "create_pd_vol", "PD_val", 0),
+])
+def test_create_vol_matches_loop(tmp_path, monkeypatch, type, method, attr, fallback):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "mod2", type)
+    out = getattr(vol, method)()
+    assert out.dtype == np.float64
+    np.testing.assert_array_equal(out, loop_reference(vol, attr, fallback))
+
+
+def test_native_labels_and_float32_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "mod2", "sus", label_dtype=np.int16, dtype=np.float32)
+    img = nib.Nifti1Image(vol.volume, affine=np.eye(4))
+    nib.save(img, "seg.nii")
+    # Uncompressed labels are memory-mapped in their stored dtype
+    loaded = volume(nib.load("seg.nii"))
+    assert loaded.volume.dtype == np.int16
+    assert isinstance(loaded.volume, np.memmap)
+    loaded.group_seg_labels("TotalSeg_CT", "mod2", "sus", ref=0)
+    out = loaded.create_sus_dist()
+    assert out.dtype == np.float32
+    np.testing.assert_array_equal(out, loop_reference(loaded, "susceptibility", -9.05).astype(np.float32))
+
+
+def test_create_static_vol_matches_loop(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("compare_fm", "ds005616", "perm3T")
+    out = vol.create_static_vol("perm3T")
+    np.testing.assert_array_equal(out, loop_reference(vol, "perm3T", np.nan))
+
+
+def test_sus_fallback_for_undefined_chi(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Dynamic version without chi leaves lungs and trachea undefined
+    vol = make_volume("compare_fm", "dyn", "sus", new_chi=None)
+    out = vol.create_sus_dist()
+    air_cavities = np.isin(vol.volume, [7, 8])
+    assert np.all(out[air_cavities] == -9.05)
+    np.testing.assert_array_equal(out, loop_reference(vol, "susceptibility", -9.05))
+
+
+def test_unknown_label_raises(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "v2", "sus")
+    vol.volume[0, 0, 0] = 500
+    vol.uniq_labels = np.unique(vol.volume)
+    with pytest.raises(KeyError):
+        vol.create_sus_dist()
+
+
+def make_bad_volume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "v2", "sus")
+    vol.volume[1:3, 2, 1] = 500
+    vol.volume[4, 4, 3] = 501
+    vol.uniq_labels = np.unique(vol.volume)
+    return vol
+
+
+def test_check_pixels_fail_reports(tmp_path, monkeypatch, capsys):
+    vol = make_bad_volume(tmp_path, monkeypatch)
+    before = vol.volume.copy()
+    assert vol.check_pixels("seg.nii.gz", "fail") == 1
+    np.testing.assert_array_equal(vol.volume, before)
+    assert not (tmp_path / "output" / "segcorrected_pixels.nii.gz").exists()
+    report = vol.bad_pixel_report(np.nonzero(~np.isin(vol.volume, list(vol.look_up))))
+    assert report == {500.0: (2, (1, 2, 1), (2, 2, 1)), 501.0: (1, (4, 4, 3), (4, 4, 3))}
+
+
+@pytest.mark.parametrize("policy, map_label, expected", [("zero", None, 0), ("map", 79, 79)])
+def test_check_pixels_replace(tmp_path, monkeypatch, policy, map_label, expected):
+    vol = make_bad_volume(tmp_path, monkeypatch)
+    assert vol.check_pixels("seg.nii.gz", policy, map_label) == 0
+    assert vol.volume[1, 2, 1] == expected and vol.volume[4, 4, 3] == expected
+    assert (tmp_path / "output" / "segcorrected_pixels.nii.gz").exists()
+    vol.create_sus_dist()
+
+
+def test_check_pixels_nearest(tmp_path, monkeypatch):
+    vol = make_bad_volume(tmp_path, monkeypatch)
+    vol.volume[:3] = 5
+    vol.volume[3:] = 6
+    vol.volume[1:3, 2, 1] = 500
+    vol.volume[4:6, 0, 0] = 501
+    vol.uniq_labels = np.unique(vol.volume)
+    assert vol.check_pixels("seg.nii", "nearest") == 0
+    assert np.all(vol.volume[:3] == 5) and np.all(vol.volume[3:] == 6)
+    assert (tmp_path / "output" / "segcorrected_pixels.nii").exists()
+
+
+def test_check_pixels_clean_volume_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "v2", "sus")
+    assert vol.check_pixels("seg.nii.gz") == 0
+    # The volume doesn't create any folder either
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_create_multi_vol_matches_single_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    types = ["sus", "t1", "perm3T"]
+    vol = make_volume("compare_fm", "ds005616", types)
+    multi = vol.create_multi_vol(types)
+    assert multi.shape == tuple(vol.dimensions) + (3,)
+    np.testing.assert_array_equal(multi[..., 0], vol.create_sus_dist())
+    np.testing.assert_array_equal(multi[..., 1], vol.create_t1_vol())
+    np.testing.assert_array_equal(multi[..., 2], vol.create_static_vol("perm3T"))
+
+
+@pytest.mark.parametrize("type", ["sus", "t2s"])
+def test_create_gauss_sc_dist(tmp_path, monkeypatch, type):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "mod2", type, shape=(20, 20, 10))
+    vol.calc_regions()
+    vol.create_gauss_sc_dist(type)
+    # Counting the labels and texturing don't build the index of the whole volume
+    assert vol._label_index is None
+    piecewise = vol.map_property(type)
+    textured = np.isin(vol.volume, [196, 324])
+    np.testing.assert_array_equal(vol.gaussian_phantom[~textured], piecewise[~textured])
+    for label_id in (196, 324):
+        voxels = vol.volume == label_id
+        # Every voxel of the label gets one of the samples drawn for it
+        np.testing.assert_array_equal(np.sort(vol.gaussian_phantom[voxels]), np.sort(vol.label_gaussians[label_id]))
+    if type != "sus":
+        assert np.all(vol.gaussian_phantom[textured] >= 0)
+
+
+def test_gauss_texture_is_reproducible_and_slab_invariant(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    phantoms = []
+    for indexed in [False, True]:
+        vol = make_volume("TotalSeg_CT", "mod2", "t2s", shape=(12, 10, 9))
+        vol.seed = 1234
+        if indexed:
+            # Same texture with the voxels of the labels taken from the index
+            vol.label_index
+        vol.calc_regions()
+        vol.create_gauss_sc_dist("t2s")
+        phantoms.append(vol.gaussian_phantom)
+    np.testing.assert_array_equal(phantoms[0], phantoms[1])
+
+    # Drawing the samples of a label slab by slab gives the same values as in one piece
+    voxels = np.flatnonzero(vol.volume == 196)
+    sample = lambda rng, n: rng.normal(38.65, 4.6875, n)
+    full = np.zeros(vol.volume.shape)
+    full.flat[voxels] = draw_label_samples(voxels, vol.volume.shape, 1234, "t2s", 196, sample)
+    slabs = np.zeros(vol.volume.shape)
+    for z0, z1 in [(0, 4), (4, 5), (5, 9)]:
+        slab = vol.volume[..., z0:z1]
+        slab_voxels = np.flatnonzero(slab == 196)
+        values = np.zeros(slab.shape)
+        values.flat[slab_voxels] = draw_label_samples(slab_voxels, slab.shape, 1234, "t2s", 196, sample, z_offset=z0)
+        slabs[..., z0:z1] = values
+    np.testing.assert_array_equal(full, slabs)
+
+
+def test_gauss_multi_vol_and_save_property(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    types = ["sus", "t2s"]
+    vol = make_volume("TotalSeg_CT", "mod2", types, shape=(12, 10, 9))
+    vol.seed = 1234
+    vol.gauss_flag = 1
+    vol.calc_regions()
+    # The frames of the 4D volume are textured in place, like the single phantoms
+    multi = vol.create_multi_vol(types).copy()
+    assert vol.gaussian_phantom is None
+    for i, type in enumerate(types):
+        vol.create_gauss_sc_dist(type)
+        np.testing.assert_array_equal(multi[..., i], vol.gaussian_phantom)
+
+    # The writer saves the phantom of the last type and frees it
+    (tmp_path / "output").mkdir(exist_ok=True)
+    vol.save_gauss_dist("t2s", release=True)
+    assert vol.gaussian_phantom is None
+    saved = np.asanyarray(nib.load(tmp_path / "output" / "gauss_t2_star.nii.gz").dataobj)
+    np.testing.assert_array_equal(saved, multi[..., 1])
+
+
+def test_gauss_textures_of_properties_are_independent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vol = make_volume("TotalSeg_CT", "mod2", ["sus", "pd"], shape=(12, 10, 9))
+    vol.seed = 1234
+    vol.calc_regions()
+    mask = vol.volume == 196
+    textures = []
+    for type in ["sus", "pd"]:
+        vol.create_gauss_sc_dist(type)
+        textures.append(vol.gaussian_phantom[mask])
+    assert abs(np.corrcoef(*textures)[0, 1]) < 0.5
@@ -3,4 +3,7 @@ from pathlib import Path
 
 version_file = Path(__file__).parent / "version.txt"
 with open(version_file, 'r') as f:
-    __version__ = f.read().rstrip()
\ No newline at end of file
+    __version__ = f.read().rstrip()
+
+# In-memory API, see tissue2mrprop/api.py
+from tissue2mrprop.api import convert_labels
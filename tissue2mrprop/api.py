@@ -0,0 +1,86 @@
+# In-memory Python API of the converter
+# Takes a label array (or a nibabel image) and returns the property arrays: nothing is written to
+# disk and nothing is printed, so the conversion can run in a loop over subjects inside a pipeline.
+#   from tissue2mrprop import convert_labels
+#   maps = convert_labels(labels, "TotalSeg_CT", "mod2", ["sus", "t1"], affine=affine)
+import numpy as np
+
+from tissue2mrprop.functions.utils.property_map import PROPERTY_ATTRS, PIXEL_POLICIES
+from tissue2mrprop.functions.utils.select_tool import check_tool, compile_labels
+
+# Susceptibility of air of compare_fm dyn when chi is not given, same default as the CLI
+DEFAULT_DYN_CHI = -2.438
+
+
+def convert_labels(labels, segtool, version, types, affine=None, dtype=np.float32, gauss=False, seed=None,
+                   chi=None, ref=0, pixel_policy="fail", map_label=None, verbose=False):
+    """
+    Convert a segmentation to MR property volumes in memory.
+
+    Args:
+        labels (np.ndarray or nibabel image): 3D label volume
+        segtool (str): segmentation tool, e.g. TotalSeg_CT
+        version (str): version of the tool
+        types (str or list): MR properties (sus, t1, t2, t2s, pd, perm3T, cond3T, perm7T, cond7T) or "all"
+        affine (np.ndarray): 4x4 affine of a label array, the image's own affine is used for a nibabel image
+        dtype: dtype of the property volumes
+        gauss (bool): add the Gaussian texture to the spinal cord labels
+        seed (int): seed of the Gaussian texture, random if None
+        chi (float): susceptibility of air for compare_fm dyn
+        ref (float): reference susceptibility, see the -r option of the CLI
+        pixel_policy (str): what to do with labels not in the look up table: fail, zero, map or nearest
+        map_label (int): label used by the map policy
+        verbose (bool): print the progress of the conversion like the CLI
+
+    Returns:
+        dict: property -> np.ndarray with the shape of labels
+
+    Raises:
+        ValueError: unknown tool, version, property or pixel policy, map_label not in the look up table, or
+            labels not in the look up table
+    """
+    import nibabel as nib
+    from tissue2mrprop.functions.volume import volume
+
+    check_tool(segtool, version)
+    if isinstance(types, str):
+        types = [types]
+    types = list(PROPERTY_ATTRS) if "all" in types else list(dict.fromkeys(types))
+    unknown = [t for t in types if t not in PROPERTY_ATTRS]
+    if unknown:
+        raise ValueError(f"Unknown properties {unknown}, choose from: {list(PROPERTY_ATTRS)}")
+    if pixel_policy not in PIXEL_POLICIES:
+        raise ValueError(f"Unknown pixel policy {pixel_policy}, choose from: {PIXEL_POLICIES}")
+    if pixel_policy == "map" and map_label not in compile_labels(segtool, version):
+        raise ValueError(f"map_label {map_label} is not in the look up table of {segtool} {version}")
+
+    if not hasattr(labels, "dataobj"):
+        labels = np.asanyarray(labels)
+        # The pixel policies correct the labels in place, the caller's array is left untouched
+        if pixel_policy != "fail":
+            labels = labels.copy()
+        labels = nib.Nifti1Image(labels, np.eye(4) if affine is None else np.asarray(affine), dtype=labels.dtype)
+
+    vol = volume(labels, dtype=dtype, verbose=verbose)
+    if segtool == "compare_fm" and version == "dyn":
+        vol.new_chi = DEFAULT_DYN_CHI if chi is None else chi
+    vol.group_seg_labels(segtool, version, types, ref=ref)
+    if vol.check_pixels("", pixel_policy, map_label, save=False) != 0:
+        raise ValueError(f"Labels {[l for l in vol.uniq_labels if l not in vol.look_up]} are not in the look up "
+                         f"table of {segtool} {version}, use another pixel policy to correct them")
+
+    maps = {}
+    if gauss:
+        vol.gauss_flag = 1
+        vol.seed = seed
+        vol.calc_regions()
+    for type in types:
+        # Every volume is handed over and dropped from the converter as soon as it is made
+        if gauss:
+            vol.create_gauss_sc_dist(type)
+            maps[type] = vol.gaussian_phantom
+        else:
+            maps[type] = vol.create_property(type)
+        vol.release(type)
+    del vol
+    return maps
@@ -0,0 +1,228 @@
+import contextlib
+import csv
+import glob
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+
+from tissue2mrprop.cli.tissue_to_mr import convert, PROPERTIES
+from tissue2mrprop.functions.utils.utils import split_ext
+# tissue_to_MR_batch --manifest [manifest.csv] --jobs [number_of_processes]
+
+# Columns of a manifest row, input/segtool/version/type are required
+MANIFEST_COLUMNS = ["input", "segtool", "version", "type", "output", "layout", "gauss", "seed", "chi", "ref",
+                    "pixel_policy", "map_label", "dtype", "mem_budget", "compresslevel"]
+SUMMARY_COLUMNS = ["job", "input", "type", "output", "status", "seconds", "error"]
+
+
+def read_manifest(manifest):
+    # Rows of a CSV (with header) or JSON (list of objects) manifest
+    if manifest.endswith(".json"):
+        with open(manifest, 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+    else:
+        with open(manifest, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+
+    for i, row in enumerate(rows):
+        unknown = set(row) - set(MANIFEST_COLUMNS)
+        if unknown:
+            raise click.BadParameter(f"Row {i}: unknown columns {sorted(unknown)}, use: {MANIFEST_COLUMNS}")
+        missing = [col for col in ["input", "segtool", "version", "type"] if not row.get(col)]
+        if missing:
+            raise click.BadParameter(f"Row {i}: missing {missing}")
+    return rows
+
+
+def make_job(i, row):
+    # Keyword arguments of convert from a manifest row, empty cells use the CLI defaults
+    types = row["type"] if isinstance(row["type"], list) else row["type"].replace(";", " ").split()
+    job = {"input_file": row["input"], "segtool": row["segtool"], "version": row["version"], "type": types}
+    if row.get("output"):
+        job["output_file"] = row["output"]
+    else:
+        job["output_file"] = default_output(row["input"], types)
+    for col, cast in [("layout", str), ("gauss", str), ("seed", int), ("chi", float), ("ref", float),
+                      ("pixel_policy", str), ("map_label", int), ("dtype", str),
+                      ("mem_budget", float), ("compresslevel", int)]:
+        if row.get(col) not in (None, ""):
+            job[col] = cast(row[col])
+
+    return {"job": i, "kwargs": job, "command": make_command(i, job)}
+
+
+def default_output(input_file, types, parents=0):
+    # Output name of a row without one: basename_types.nii.gz, with the names of parent directories
+    # in front (sub01_seg_types.nii.gz) to tell apart inputs with the same basename
+    path = os.path.abspath(split_ext(input_file)[0])
+    parts = [os.path.basename(path)]
+    for _ in range(parents):
+        path = os.path.dirname(path)
+        if os.path.basename(path):
+            parts.insert(0, os.path.basename(path))
+    return "_".join(parts) + "_" + "_".join(types) + ".nii.gz"
+
+
+def check_outputs(job_list, rows):
+    # Default output names of inputs with the same basename collide, the parent directories are added
+    # until they don't. Two jobs still writing the same output are refused
+    for parents in range(1, 4):
+        counts = Counter(job["kwargs"]["output_file"] for job in job_list)
+        clashes = [job for job, row in zip(job_list, rows) if not row.get("output")
+                   and counts[job["kwargs"]["output_file"]] > 1]
+        if not clashes:
+            break
+        for job in clashes:
+            job["kwargs"]["output_file"] = default_output(job["kwargs"]["input_file"], job["kwargs"]["type"], parents)
+    counts = Counter(job["kwargs"]["output_file"] for job in job_list)
+    clashes = sorted(name for name, count in counts.items() if count > 1)
+    if clashes:
+        raise click.UsageError(f"Several jobs write the same output: {clashes}, set the output column")
+    for job in job_list:
+        job["command"] = make_command(job["job"], job["kwargs"])
+
+
+def make_command(i, kwargs):
+    return f"tissue_to_MR_batch job {i}: " + " ".join(f"{k}={v}" for k, v in kwargs.items())
+
+
+def failed_result(job, error):
+    # Summary row of a job that didn't return (e.g. its worker process died)
+    kwargs = job["kwargs"]
+    return {"job": job["job"], "input": kwargs["input_file"], "type": ";".join(kwargs["type"]),
+            "output": kwargs["output_file"], "status": "failed", "seconds": "", "error": error}
+
+
+def job_log(job):
+    # Log file of a job, it is created when the job starts
+    return os.path.join("output", "batch_logs", f"job_{job['job']}.log")
+
+
+def run_job(job):
+    # Runs one conversion in a worker process, its prints go to a log file per job
+    start = time.time()
+    kwargs = job["kwargs"]
+    result = {"job": job["job"], "input": kwargs["input_file"], "type": ";".join(kwargs["type"]),
+              "output": kwargs["output_file"], "error": ""}
+    log_path = job_log(job)
+    try:
+        with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+            success = convert(command=job["command"], **kwargs)
+        result["status"] = "success" if success else "failed"
+        if not success:
+            result["error"] = f"Conversion failed, see {log_path}"
+    except (Exception, SystemExit) as e:
+        # A failed job must not stop the others
+        result["status"] = "failed"
+        result["error"] = f"{e.__class__.__name__}: {e}"
+    result["seconds"] = round(time.time() - start, 3)
+    return result
+
+
+def run_pool(job_list, jobs, report):
+    """
+    Runs the jobs on a pool of processes and reports the result of every job.
+
+    A worker that dies (killed, out of memory, segfault) breaks the pool and every job without a result
+    comes back as BrokenProcessPool. The jobs that never started (no log file yet) run again on a new
+    pool. A job that was running is the one that died if it was the only one, else every such job runs
+    again alone to find it.
+
+    Args:
+        job_list (list): jobs made by make_job
+        jobs (int): number of worker processes
+        report (callable): called with the summary row of every job
+    """
+    pending = list(job_list)
+    while pending:
+        suspects, not_started = [], []
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+            futures = {pool.submit(run_job, job): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    report(future.result())
+                except BrokenProcessPool:
+                    (suspects if os.path.exists(job_log(job)) else not_started).append(job)
+                except Exception as e:
+                    report(failed_result(job, f"{e.__class__.__name__}: {e}"))
+        if len(suspects) == 1:
+            report(failed_result(suspects[0], "The worker process died (killed, out of memory...), "
+                                              f"see {job_log(suspects[0])}"))
+        else:
+            for job in suspects:
+                os.remove(job_log(job))
+                run_pool([job], 1, report)
+        if suspects or not_started:
+            print(f"A worker process died, {len(not_started)} jobs run again on a new pool")
+        pending = not_started
+
+
+@click.command()
+@click.option("-f", "--manifest", required=False, type=click.Path(exists=True), default=None,
+              help="CSV or JSON manifest with one conversion per row, columns: " + ", ".join(MANIFEST_COLUMNS))
+@click.option("-i", "--glob", "pattern", required=False, default=None,
+              help="Glob of the segmentations to convert (quote it), e.g. 'data/*.nii.gz'. Uses -s, -v and -t for all of them")
+@click.option('-s', "--segtool", required=False, default=None, help="Segmentation tool of the globbed inputs")
+@click.option('-v', "--version", required=False, default=None, help="Version of the globbed inputs")
+@click.option('-t', "--type", required=False, multiple=True, type=click.Choice(list(PROPERTIES.keys()) + ["all"]),
+              help="MR properties of the globbed inputs")
+@click.option("-j", "--jobs", required=False, type=click.IntRange(1), default=os.cpu_count(),
+              help="Number of conversions running in parallel")
+@click.option("--summary", required=False, type=click.Path(), default=os.path.join("output", "batch_summary.csv"),
+              help="CSV file with the status and timing of every job")
+def batch(manifest, pattern, segtool, version, type, jobs, summary):
+    # Runs many conversions on a pool of processes, every process imports the package once
+    if (manifest is None) == (pattern is None):
+        raise click.UsageError("Use either a manifest (-f) or a glob (-i)")
+
+    if manifest:
+        rows = read_manifest(manifest)
+    else:
+        if not (segtool and version and type):
+            raise click.UsageError("-s, -v and -t are required with a glob")
+        rows = [{"input": path, "segtool": segtool, "version": version, "type": list(type)}
+                for path in sorted(glob.glob(pattern))]
+    if not rows:
+        raise click.UsageError("No segmentation to convert")
+
+    job_list = [make_job(i, row) for i, row in enumerate(rows)]
+    check_outputs(job_list, rows)
+    os.makedirs(os.path.join("output", "batch_logs"), exist_ok=True)
+    # The log of a job tells if it started, the logs of a previous batch are removed
+    for job in job_list:
+        if os.path.exists(job_log(job)):
+            os.remove(job_log(job))
+    print(f"Running {len(job_list)} conversions on {jobs} processes")
+
+    start = time.time()
+    results = []
+
+    def report(result):
+        results.append(result)
+        print(f"[{len(results)}/{len(job_list)}] job {result['job']} {result['status']} "
+              f"in {result['seconds']} s: {result['input']} {result['error']}")
+
+    if jobs == 1:
+        for job in job_list:
+            report(run_job(job))
+    else:
+        run_pool(job_list, jobs, report)
+    results.sort(key=lambda r: r["job"])
+    elapsed = time.time() - start
+
+    with open(summary, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    failed = [r for r in results if r["status"] != "success"]
+    print(f"{len(results) - len(failed)} succeeded, {len(failed)} failed. Time elapsed: {elapsed}")
+    print("Summary saved to: ", summary)
+    if failed:
+        raise SystemExit(1)
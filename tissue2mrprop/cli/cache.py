@@ -0,0 +1,46 @@
+import datetime
+
+import click
+
+from tissue2mrprop.functions.utils.cache import ResultCache, cache_dir
+# tissue_to_MR_cache info | list | clear
+# The cache is in $TISSUE2MRPROP_CACHE_DIR (~/.cache/tissue2mrprop by default) and bounded by
+# $TISSUE2MRPROP_CACHE_SIZE_MB (5000 by default)
+
+
+@click.group()
+@click.option("-d", "--dir", "folder", required=False, type=click.Path(), default=None,
+              help="Folder of the cache, $TISSUE2MRPROP_CACHE_DIR or ~/.cache/tissue2mrprop by default")
+@click.pass_context
+def cache(ctx, folder):
+    # Inspect or clear the cache of the conversions made with tissue_to_MR --cache
+    ctx.obj = ResultCache(folder or cache_dir())
+
+
+@cache.command()
+@click.pass_obj
+def info(result_cache):
+    # Folder, number of entries and size of the cache
+    for key, value in result_cache.info().items():
+        print(f"{key}: {value}")
+
+
+@cache.command("list")
+@click.pass_obj
+def list_entries(result_cache):
+    # Entries of the cache, most recently used first
+    for key, size, used in reversed(result_cache.entries()):
+        date = datetime.datetime.fromtimestamp(used).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{key}  {size / 2**20:8.1f} MB  last used {date}")
+
+
+@cache.command()
+@click.option("--max-size", "max_size", required=False, type=float, default=None,
+              help="Only evict the least recently used entries until the cache is smaller than this size in MB")
+@click.pass_obj
+def clear(result_cache, max_size):
+    # Removes every entry, or the least recently used ones with --max-size
+    if max_size is None:
+        print(f"Removed {result_cache.clear()} entries from {result_cache.root}")
+    else:
+        print(f"Removed {len(result_cache.evict(int(max_size * 2**20)))} entries from {result_cache.root}")
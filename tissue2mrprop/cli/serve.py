@@ -0,0 +1,357 @@
+import gzip
+import ipaddress
+import json
+import os
+import socketserver
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import click
+
+from tissue2mrprop.functions.utils.select_tool import TOOL_VERSIONS
+from tissue2mrprop.functions.utils.utils import add_suffix
+# tissue_to_MR_serve --port 8765 --workers 4    (or --socket /tmp/tissue2mrprop.sock)
+#
+# Long running conversion service: the worker processes import the converter and compile the look up
+# tables of every tool once, then serve the conversions sent over HTTP (localhost or a Unix socket).
+#   GET  /health   status of the service, with the number of times the pool was restarted after a worker died
+#   GET  /metrics  request counts and conversion latencies
+#   POST /convert  JSON body {"input": path, "segtool", "version", "type", "output": path, ...}
+#                  or the segmentation file (.nii or .nii.gz) as body with the parameters in the query string:
+#                  /convert?segtool=TotalSeg_CT&version=mod2&type=sus&type=t1
+#                  Without output, the result is returned as a .nii.gz (4D with several types)
+
+# Parameters of a conversion request and how they are read from the query string
+REQUEST_FIELDS = {
+    "input": str, "output": str, "segtool": str, "version": str, "type": list, "layout": str,
+    "gauss": lambda v: str(v).lower() in ("1", "true"), "seed": int, "chi": float, "ref": float,
+    "pixel_policy": str, "map_label": int, "dtype": str, "compresslevel": int,
+}
+# Parameters passed as they are to convert_labels
+CONVERT_FIELDS = ["gauss", "seed", "chi", "ref", "pixel_policy", "map_label", "dtype"]
+# Number of latencies kept for the metrics
+LATENCY_WINDOW = 1000
+
+
+def warm_up():
+    # Worker initializer: imports the converter and compiles the label tables of every tool and version
+    from tissue2mrprop.functions.volume import label_table
+    for tool, versions in TOOL_VERSIONS.items():
+        for version in versions:
+            label_table(tool, version)
+            label_table(tool, version, static=True)
+
+
+def load_image(params, data):
+    # Segmentation from the path of the request, or from the bytes of a .nii or .nii.gz file
+    import nibabel as nib
+    if data is None:
+        if not params.get("input"):
+            raise ValueError("Give the segmentation as input path or as the body of the request")
+        return nib.load(params["input"])
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return nib.Nifti1Image.from_bytes(data)
+
+
+def run_request(params, data=None):
+    """
+    Runs a conversion request in a worker process.
+
+    Args:
+        params (dict): parameters of the request, see REQUEST_FIELDS
+        data (bytes): segmentation file, None to read params["input"]
+
+    Returns:
+        dict: files written ({"outputs": {type: path}}), or the result as .nii.gz bytes ({"nifti": bytes})
+    """
+    import numpy as np
+    import nibabel as nib
+    from tissue2mrprop.api import convert_labels
+    from tissue2mrprop.functions.utils.nifti_io import save_nifti
+
+    missing = [field for field in ["segtool", "version", "type"] if not params.get(field)]
+    if missing:
+        raise ValueError(f"Missing parameters {missing}")
+    image = load_image(params, data)
+    maps = convert_labels(image, params["segtool"], params["version"], params["type"],
+                          **{field: params[field] for field in CONVERT_FIELDS if params.get(field) is not None})
+    types = list(maps)
+
+    output = params.get("output")
+    if output is None:
+        volume = maps[types[0]] if len(types) == 1 else np.stack([maps[type] for type in types], axis=-1)
+        maps.clear()
+        nifti = gzip.compress(nib.Nifti1Image(volume, image.affine).to_bytes(), compresslevel=1)
+        return {"properties": types, "nifti": nifti}
+
+    compresslevel = params.get("compresslevel") or 1
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    if len(types) > 1 and params.get("layout") == "4d":
+        volume = np.stack([maps.pop(type) for type in types], axis=-1)
+        save_nifti(volume, image.affine, output, compresslevel=compresslevel)
+        return {"properties": types, "outputs": {"4d": output}}
+    outputs = {}
+    for type in types:
+        outputs[type] = output if len(types) == 1 else add_suffix(output, "_" + type)
+        save_nifti(maps.pop(type), image.affine, outputs[type], compresslevel=compresslevel)
+    return {"properties": types, "outputs": outputs}
+
+
+class ServiceMetrics:
+    # Request counts and latencies of the conversions, shared by the request threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.counts = {"requests": 0, "succeeded": 0, "failed": 0, "rejected": 0}
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def begin(self):
+        with self.lock:
+            self.counts["requests"] += 1
+            self.in_flight += 1
+
+    def end(self, seconds, ok):
+        with self.lock:
+            self.in_flight -= 1
+            self.counts["succeeded" if ok else "failed"] += 1
+            self.latencies.append(seconds)
+
+    def reject(self):
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["rejected"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+            in_flight = self.in_flight
+        stats = {}
+        if latencies:
+            stats = {"count": len(latencies),
+                     "mean": round(sum(latencies) / len(latencies), 4),
+                     "p50": round(latencies[len(latencies) // 2], 4),
+                     "p95": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 4),
+                     "max": round(latencies[-1], 4)}
+        return {"uptime_s": round(time.time() - self.start, 1), "in_flight": in_flight, **counts,
+                "latency_s": stats}
+
+
+class ConversionService:
+    """
+    Pool of warm worker processes with a bound on the conversions running or waiting.
+
+    Args:
+        workers (int): number of worker processes
+        max_concurrent (int): conversions accepted at the same time, the others are rejected (workers by default)
+        queue_timeout (float): seconds a request waits for a free slot before being rejected
+    """
+
+    def __init__(self, workers=2, max_concurrent=None, queue_timeout=30):
+        self.workers = workers
+        self.pool = self.make_pool()
+        self.pool_lock = threading.Lock()
+        self.restarts = 0
+        self.last_restart = None
+        self.slots = threading.BoundedSemaphore(max_concurrent or workers)
+        self.queue_timeout = queue_timeout
+        self.metrics = ServiceMetrics()
+
+    def make_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+
+    def restart_pool(self, broken):
+        # A worker died (killed, out of memory...) and the pool refuses any new work: it is replaced by a
+        # warm one. Requests failing on the same broken pool restart it only once
+        with self.pool_lock:
+            if self.pool is not broken:
+                return
+            self.pool = self.make_pool()
+            self.restarts += 1
+            self.last_restart = time.time()
+        print(f"A worker process died, pool of {self.workers} workers restarted ({self.restarts} restarts)")
+        broken.shutdown(wait=False)
+
+    def convert(self, params, data=None):
+        # Result of run_request, None if the service is busy
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self.metrics.reject()
+            return None
+        self.metrics.begin()
+        start = time.perf_counter()
+        ok = False
+        pool = self.pool
+        try:
+            result = pool.submit(run_request, params, data).result()
+            ok = True
+            return result
+        except BrokenProcessPool:
+            # The request isn't run again, it may be what killed the worker
+            self.restart_pool(pool)
+            raise RuntimeError("The worker process running the conversion died, the workers were restarted")
+        finally:
+            self.slots.release()
+            self.metrics.end(time.perf_counter() - start, ok)
+
+    def health(self):
+        return {"status": "ok", "workers": self.workers, "pool_restarts": self.restarts,
+                "last_restart": self.last_restart, "tools": {tool: list(v) for tool, v in TOOL_VERSIONS.items()}}
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def read_params(query, body, content_type):
+    # Parameters from a JSON body, or from the query string when the body is the segmentation file
+    if content_type.startswith("application/json"):
+        params, data = json.loads(body or b"{}"), None
+    else:
+        params = {key: values if REQUEST_FIELDS.get(key) is list else values[-1]
+                  for key, values in parse_qs(query).items()}
+        data = body or None
+    unknown = set(params) - set(REQUEST_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}, use: {list(REQUEST_FIELDS)}")
+    for key, cast in REQUEST_FIELDS.items():
+        if params.get(key) is not None and cast is not list:
+            params[key] = cast(params[key])
+    if isinstance(params.get("type"), str):
+        params["type"] = params["type"].replace(";", " ").split()
+    return params, data
+
+
+def make_handler(service):
+    class ServiceHandler(BaseHTTPRequestHandler):
+        def send(self, status, body, content_type="application/json", headers=None):
+            if content_type == "application/json":
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self.send(200, service.health())
+            elif path == "/metrics":
+                self.send(200, service.metrics.snapshot())
+            else:
+                self.send(404, {"error": f"Unknown endpoint {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/convert":
+                self.send(404, {"error": f"Unknown endpoint {url.path}"})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                params, data = read_params(url.query, body, self.headers.get("Content-Type", ""))
+                result = service.convert(params, data)
+            except (ValueError, KeyError, OSError) as e:
+                self.send(400, {"error": f"{e.__class__.__name__}: {e}"})
+                return
+            except Exception as e:
+                self.send(500, {"error": f"{e.__class__.__name__}: {e}"})
+                return
+            if result is None:
+                self.send(503, {"error": "Too many conversions running, try again later"})
+            elif "nifti" in result:
+                self.send(200, result["nifti"], "application/gzip", {"X-Properties": ",".join(result["properties"])})
+            else:
+                self.send(200, result)
+
+        def address_string(self):
+            # Clients of a Unix socket don't have an address
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} - {format % args}")
+
+    return ServiceHandler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Left by a previous run
+        remove_socket(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address, 0
+
+
+def remove_socket(path):
+    # Removes a Unix socket file, any other file at that path is left alone (binding then fails)
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def is_loopback(host):
+    # localhost or a loopback address (127.0.0.0/8, ::1)
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def make_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    # HTTP server of the service on localhost, or on a Unix socket if socket_path is given
+    handler = make_handler(service)
+    if socket_path:
+        return UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.option("--host", required=False, default="127.0.0.1",
+              help="Address to listen on, localhost by default. Other addresses need --allow-remote")
+@click.option("--allow-remote", "allow_remote", required=False, is_flag=True, default=False,
+              help="Listen on a non loopback --host. There is no authentication and /convert reads and writes "
+                   "any path given in the request: only use it on a trusted network")
+@click.option("--port", required=False, type=int, default=8765, help="Port to listen on")
+@click.option("--socket", "socket_path", required=False, type=click.Path(), default=None,
+              help="Listen on a Unix socket instead of a port")
+@click.option("-j", "--workers", required=False, type=click.IntRange(1), default=min(4, os.cpu_count() or 1),
+              help="Number of worker processes")
+@click.option("--max-concurrent", "max_concurrent", required=False, type=click.IntRange(1), default=None,
+              help="Conversions accepted at the same time (running or waiting), the number of workers by default")
+@click.option("--queue-timeout", "queue_timeout", required=False, type=float, default=30,
+              help="Seconds a request waits for a free slot before being rejected with 503")
+def serve(host, port, socket_path, workers, max_concurrent, queue_timeout, allow_remote):
+    if not socket_path and not is_loopback(host):
+        if not allow_remote:
+            raise click.BadParameter(f"{host} is not a loopback address, the service has no authentication and "
+                                     "reads and writes any path of a request. Add --allow-remote to listen on it anyway",
+                                     param_hint="'--host'")
+        print(f"WARNING: listening on {host} without authentication, any client that can reach it can read and "
+              "write files with the permissions of this process")
+    service = ConversionService(workers, max_concurrent, queue_timeout)
+    server = make_server(service, host, port, socket_path)
+    where = socket_path if socket_path else f"http://{host}:{server.server_port}"
+    print(f"Serving conversions on {where} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path:
+            remove_socket(socket_path)
@@ -2,32 +2,28 @@ import time
 
 import click
 import logging
-import nibabel as nib
 # With the next line we add to path the project folder to navigate into functions folder
 #sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 #from tissue2mrprop.functions import __dir_converter__, __dir_functions__, __dir_utils__
-from tissue2mrprop.functions.volume import volume
-from tissue2mrprop.functions.utils.utils import is_nifti
+from tissue2mrprop.functions.utils.property_map import PIXEL_POLICIES
+from tissue2mrprop.functions.utils.utils import is_nifti, add_suffix, split_ext, parse_values
+from tissue2mrprop.functions.utils.select_tool import TOOL_VERSIONS, check_tool, dynamic_labels
+from tissue2mrprop.functions.utils.random_streams import stream_layout, STREAM_KEY
+from tissue2mrprop.functions.utils.provenance import provenance, file_hash, peak_memory_mb, reset_peak_memory
+from tissue2mrprop.functions.utils.profiler import StageProfiler
+from tissue2mrprop.functions.utils.cache import ResultCache, conversion_key
 # tissue_to_mr --input [labeled_nifti] --type [choose_MR_property] --output [name=default]
 
-import time
-
 # For the json sidecar
 from pathlib import Path
-import argparse
 import os
 
-from typing import List
-import numpy.typing as npt
-
-import numpy as np
-import pandas as pd
-import matplotlib as plt
 import json
 import datetime
-import git
 import sys
+# Heavy modules (nibabel) are imported where they are needed
+# so that --help and argument errors are fast, see test/test_import_time.py
 
 @click.group()
 def my_commands():
@@ -49,28 +45,200 @@ PROPERTIES = {
 @click.command()
 @click.option('-i','--input','input_file', type=click.Path(exists=True), required=True,
               help="Input segmentations distribution, supported extensions: .nii, .nii.gz")
-@click.option('-s',"--segtool",required=True,type=click.Choice(['TotalSeg_CT','TotalSeg_MRI','ProCord_MRI', 'charles','compare_fm']), help="State what segmentator was used")
-@click.option('-v',"--version",required=True,type=click.Choice(['v1','v2','mod0','mod1','mod2','dyn','mod_PAM50',"ds005616"]), help="Select the version of your segmentation file")
-@click.option('-t',"--type",required=True, type=click.Choice(PROPERTIES.keys()), help="Please choose MR property to convert to")
+@click.option('-s',"--segtool",required=True,type=click.Choice(list(TOOL_VERSIONS)), help="State what segmentator was used")
+@click.option('-v',"--version",required=True,type=click.Choice(list(dict.fromkeys(v for versions in TOOL_VERSIONS.values() for v in versions))), help="Select the version of your segmentation file")
+@click.option('-t',"--type",required=True, multiple=True, type=click.Choice(list(PROPERTIES.keys()) + ["all"]),
+              help="Please choose MR property to convert to. Repeat the option (-t sus -t t1) or use all to convert to several properties at once")
+@click.option("-l", "--layout", required=False, type=click.Choice(["split", "4d"]), default="split",
+              help="Output layout when converting to several properties: one file per property (split) or a single 4D volume (4d)")
 @click.option("-g", "--gauss",required=False, type= click.Choice(["0","1"]), default = "0", help = "Set to 1 to use Gaussian distribution")
-@click.option("-x","--chi", required = False, type = float, default = None, help = "Used to define new chi value for FM comparison approach")
+@click.option("--seed", required=False, type=int, default=None,
+              help="Seed of the Gaussian distribution, to reproduce a phantom. A random seed is used and recorded in the json sidecar if not set")
+@click.option("-x","--chi", required = False, type = str, default = None,
+              help = "Used to define new chi value for FM comparison approach. A list (-2.4,-2.2) or a range start:stop:step (-3:-2:0.25) "
+                     "makes one susceptibility phantom per value, in a 4D series with -l 4d or in separate files")
 @click.option("-r", "--ref",required=False,type=float,default=0,help="Use as a reference flag to demodulate the values by a constant. Only use with Susceptibility property")
+@click.option("-p", "--pixel-policy", "pixel_policy", required=False, type=click.Choice(PIXEL_POLICIES), default="fail",
+              help="What to do with pixels whose value is not in the look up table: fail, set them to 0 (zero), "
+                   "set them to --map-label (map) or to the label of the nearest correct pixel (nearest)")
+@click.option("-m", "--map-label", "map_label", required=False, type=int, default=None,
+              help="Label used to replace the wrong pixels with the map pixel policy")
+@click.option("--dtype", required=False, type=click.Choice(["float32", "float64"]), default="float32",
+              help="Data type of the output volumes")
+@click.option("--mem-budget", "mem_budget", required=False, type=float, default=None,
+              help="Memory budget in MB. If converting the whole volume in memory needs more, the volume is streamed slab by slab")
+@click.option("--stream", required=False, is_flag=True, default=False,
+              help="Read, convert and write the volume slab by slab along z to bound memory (automatic with --mem-budget)")
+@click.option("--compression", "compresslevel", required=False, type=click.IntRange(1, 9), default=1,
+              help="gzip level of the .nii.gz outputs, 1 (fastest) to 9 (smallest). Name the output .nii to not compress")
+@click.option("--threads", required=False, type=click.IntRange(1), default=min(4, os.cpu_count() or 1),
+              help="Number of threads compressing the .nii.gz outputs")
+@click.option("--cache", required=False, is_flag=True, default=False,
+              help="Copy the outputs of an identical conversion from the cache, or store them in it (see tissue_to_MR_cache)")
+@click.option("--label-index", "label_index", required=False, is_flag=True, default=False,
+              help="Save the voxels of every label next to the input ([input].labelindex.npz) and reuse them in the next "
+                   "runs: faster Gaussian texture, pixel policies, chi sweeps and tissue_to_MR_update")
+@click.option("--target", required=False, type=click.Path(exists=True), default=None,
+              help="Nifti image on the grid to make the properties on (e.g. of a field simulation): every voxel gets "
+                   "the mean of the property over the labels it covers")
+@click.option("--voxel-size", "voxel_size", required=False, type=str, default=None,
+              help="Voxel size in mm of the grid to make the properties on, one value or x,y,z. "
+                   "Integer multiples of the input voxel size are exact block averages")
+@click.option("--crop", required=False, is_flag=True, default=False,
+              help="Convert only the bounding box of the labels that are not background (0), plus --crop-margin voxels. "
+                   "The outputs are written on the box with a translated affine")
+@click.option("--crop-labels", "crop_labels", required=False, type=str, default=None,
+              help="Crop to the box of these labels instead (ids or names, comma separated, e.g. sc_wm,sc_gm,50)")
+@click.option("--crop-margin", "crop_margin", required=False, type=click.IntRange(0), default=5,
+              help="Voxels added on every side of the crop box")
+@click.option("--pad", required=False, is_flag=True, default=False,
+              help="Put the cropped outputs back into the grid of the input, the voxels outside of the box take the "
+                   "value of the background")
+@click.option("--stats", required=False, type=click.Choice(["csv", "json"]), default=None,
+              help="Save the voxel count, volume in mm³, bounding box and property values of every label and tissue "
+                   "to output/[output]_stats.csv (or .json)")
+@click.option("--profile", required=False, is_flag=True, default=False,
+              help="Save the wall time, CPU time and memory peak of every stage to output/[output]_profile.json")
+@click.option("--cprofile", required=False, is_flag=True, default=False,
+              help="With --profile, also save the cProfile statistics of the slowest stage to output/[output]_slowest.prof")
 @click.option('-o', '--output', 'output_file', type=click.Path(), default= "sus_dist.nii.gz", required= False,
               help = "By default it saves the chimap to the output folder")
-def converter(input_file, segtool, version, type, gauss, chi, ref, output_file):
+def converter(input_file, segtool, version, type, layout, gauss, seed, chi, ref, pixel_policy, map_label, dtype, mem_budget, stream,
+              compresslevel, threads, cache, label_index, target, voxel_size, crop, crop_labels, crop_margin, pad, stats,
+              profile, cprofile, output_file):
 
+    # Not every version exists for every tool
+    try:
+        check_tool(segtool, version)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'-v'")
+    # Several chi values make a sweep of the labels of a dynamic version
+    if chi is not None:
+        try:
+            chi = parse_values(chi)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'-x'")
+        if len(chi) > 1 and not dynamic_labels(segtool, version):
+            raise click.BadParameter("A list or range of chi needs a dynamic version (-s compare_fm -v dyn)", param_hint="'-x'")
+        chi = chi if len(chi) > 1 else chi[0]
+    if voxel_size is not None:
+        try:
+            voxel_size = parse_values(voxel_size)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--voxel-size'")
+        if len(voxel_size) not in (1, 3) or min(voxel_size) <= 0:
+            raise click.BadParameter("Give one positive voxel size or one per axis (x,y,z)", param_hint="'--voxel-size'")
+    if target is not None and voxel_size is not None:
+        raise click.UsageError("Use --target or --voxel-size, not both")
+    if (target is not None or voxel_size is not None) and isinstance(chi, list):
+        raise click.UsageError("The chi sweep can't be resampled to another grid")
+    if pad and (target is not None or voxel_size is not None):
+        raise click.UsageError("--pad puts the crop box back into the grid of the input, it can't be used with a target grid")
     # Pulling information of the command for output json file
     command = " ".join(sys.argv)
+    if not convert(input_file, segtool, version, type, layout=layout, gauss=gauss, seed=seed, chi=chi, ref=ref,
+            pixel_policy=pixel_policy, map_label=map_label, dtype=dtype, mem_budget=mem_budget, stream=stream,
+            compresslevel=compresslevel, threads=threads, cache=cache, label_index=label_index, target=target, voxel_size=voxel_size, crop=crop, crop_labels=crop_labels, crop_margin=crop_margin, pad=pad,
+            stats=stats, profile=profile, cprofile=cprofile,
+            output_file=output_file, command=command):
+        # A failed conversion exits with an error for the shell and the batch scripts
+        raise SystemExit(1)
+
+
+def output_files(types, layout, output_file, gauss=False):
+    # Name of every output file in the output folder: one file per type, or a single 4D file
+    prefix = "gauss_" if gauss else ""
+    if len(types) > 1 and layout == "4d":
+        return {"4d": prefix + output_file}
+    return {type: prefix + (output_file if len(types) == 1 else add_suffix(output_file, "_" + type)) for type in types}
 
+
+def convert(input_file, segtool, version, type, layout="split", gauss="0", seed=None, chi=None, ref=0,
+            pixel_policy="fail", map_label=None, dtype="float32", mem_budget=None, stream=False,
+            compresslevel=1, threads=1, cache=False, label_index=False, target=None, voxel_size=None, crop=False,
+            crop_labels=None, crop_margin=5, pad=False, stats=None,
+            profile=False, cprofile=False, profiler=None,
+            output_file="sus_dist.nii.gz", command=None):
+    # Conversion behind tissue_to_MR, it can be called from python with the same arguments as the CLI
+    # (e.g. by the batch mode). Returns True if the conversion succeeded
+    # The stages are timed by profiler, a StageProfiler the caller can pass to get the statistics back:
+    #   profiler = StageProfiler(memory=True); convert(..., profiler=profiler); profiler.stats()
+    import nibabel as nib
+    from tissue2mrprop.functions.volume import volume
+    from tissue2mrprop.functions.utils.label_index import label_index_path
+    from tissue2mrprop.functions.utils.resample import target_grid, block_factors
+    from tissue2mrprop.functions.utils.crop import resolve_labels
+    from tissue2mrprop.functions.stream import (stream_convert, estimate_footprint, slab_depth, iter_slabs,
+                                                DEFAULT_SLAB_BUDGET)
+
+    if isinstance(type, str):
+        type = [type]
+    success = False
+    # The labels are decoded and checked once for all the properties requested
+    types = list(PROPERTIES.keys()) if "all" in type else list(dict.fromkeys(type))
+    outputs = {}
+    new_vol = None
+    depth = None
+    cache_key = None
+    cached = None
+    # A list of chi is a sweep: one susceptibility phantom per value
+    chis = list(chi) if isinstance(chi, (list, tuple)) else None
+    sweep = None
+    stats_file = None
+    grid_info = None
+    crop_info = None
+    if chis is not None:
+        if types != ["sus"]:
+            print("A sweep of chi only makes susceptibility phantoms, use -t sus")
+            return False
+        if target is not None or voxel_size is not None:
+            print("The chi sweep can't be resampled to another grid")
+            return False
+        chi = chis[0]
+    # Wall time of every stage for the json sidecar, and memory peaks and cProfile with --profile
+    own_profiler = profiler is None
+    # Memory peak of this conversion, not of the earlier ones of the process (batch workers)
+    own_peak = reset_peak_memory()
+    if own_profiler:
+        profiler = StageProfiler(memory=profile, cprofile=profile and cprofile)
+
+    # Outputs and json sidecar go to the output folder of the current directory
+    os.makedirs("output", exist_ok=True)
     # We need to check if the input is a  nifti file
     if is_nifti(input_file):
         start = time.time()
         print("start")
         #logging.info(f"Creating a new volume with {type} values")
-        print(f"Creating a new volume with {type} values")
-        file = nib.load(input_file)
-        print("file loaded")
-        new_vol = volume(file)
+        print(f"Creating a new volume with {', '.join(types)} values")
+        with profiler.stage("load"):
+            file = nib.load(input_file)
+            # Streaming mode if asked, or if converting the whole volume in memory doesn't fit in the budget
+            footprint = estimate_footprint(file.shape, file.get_data_dtype(), len(types), dtype)
+            if mem_budget is not None and footprint > mem_budget * 2**20:
+                print(f"Converting in memory needs {footprint / 2**20:.0f} MB, more than the budget of {mem_budget} MB")
+                stream = True
+            if stream and chis is not None:
+                print("The chi sweep is converted in memory, not streamed")
+                stream = False
+            resampled = target is not None or voxel_size is not None
+            if stream and resampled:
+                print("Resampling maps the labels slab by slab, not streamed")
+                stream = False
+            if stream and (crop or crop_labels):
+                print("The crop box is converted in memory, not streamed")
+                stream = False
+            if stream:
+                budget = mem_budget * 2**20 if mem_budget is not None else DEFAULT_SLAB_BUDGET
+                depth = slab_depth(file.shape, file.get_data_dtype(), len(types), dtype, budget)
+                # Keeping the file open, a compressed input is decompressed only once while streaming
+                file = nib.load(input_file, keep_file_open=True)
+            print("file loaded")
+            new_vol = volume(file, dtype=dtype, load=not stream, profiler=profiler)
+            new_vol.compresslevel = compresslevel
+            new_vol.threads = threads
+            if label_index and not stream:
+                # Loaded, or built and saved, the first time a label is looked up
+                new_vol.use_label_index(label_index_path(input_file), input_file)
         print("# Step 1. Group segmentation labels #")
         # Using the type:
 
@@ -86,48 +254,139 @@ def converter(input_file, segtool, version, type, gauss, chi, ref, output_file):
                 print("Using default: ", new_vol.new_chi) # Value found while Optimization Abstract work
                 # Is a value used in single value optimization of measured FM vs simulated FM
         if ref != 0:
-            if type == 'sus':
-                new_vol.group_seg_labels(segtool, version,type, ref = ref)  # Automatically adding the names to known labels
+            if 'sus' in types:
                 print(f"Using {ref} as a reference value")
             else:
                 print("Type must be susceptibility to use the reference flag")
-                exit()
+                return False
 
-        new_vol.group_seg_labels(segtool, version, type, ref=ref)
+        with profiler.stage("group labels"):
+            new_vol.group_seg_labels(segtool, version, types, ref=ref)
+
+        # Only the bounding box of the anatomy (or of the labels of --crop-labels) is converted
+        if crop or crop_labels:
+            keep = None
+            if crop_labels:
+                try:
+                    keep = resolve_labels(crop_labels.replace(";", ",").split(","), new_vol.look_up)
+                except ValueError as e:
+                    print(e)
+                    return False
+            box = new_vol.crop(keep, crop_margin, pad)
+            if box is None:
+                print("No voxel to crop to, converting the whole volume")
+            else:
+                print(f"Cropped to {tuple(new_vol.dimensions)} voxels of {tuple(file.shape)}, from voxel "
+                      f"{tuple(b.start for b in box)}" + (" (outputs padded back to the input grid)" if pad else ""))
+                crop_info = {'start': [b.start for b in box], 'stop': [b.stop for b in box], 'margin': crop_margin,
+                             'labels': keep, 'padded': pad}
+        # The grid of --voxel-size starts at the first voxel converted (of the crop box)
+        if resampled:
+            new_vol.set_grid(*target_grid(tuple(new_vol.dimensions), new_vol.label_affine, reference=target,
+                                          voxel_size=voxel_size))
+            factors = block_factors(new_vol.label_affine, new_vol.grid[1])
+            grid_info = {'shape': list(new_vol.grid[0]), 'affine': new_vol.grid[1].tolist(),
+                         'method': 'block' if factors else 'supersample'}
+            if target is not None:
+                grid_info['target'] = os.path.abspath(target)
+            else:
+                grid_info['voxel size'] = voxel_size
+            print(f"Resampling to a grid of shape {new_vol.grid[0]} ({grid_info['method']} average)")
         # Printing one label can help see the structure as well as verifying values selected
         # Specially when working with field map comparison project where chi can be changed
 
-        print("# Step 2. Checking pixel integrity #")
-        ans = new_vol.check_pixels(input_file)
+        # An identical conversion (same voxels, affine, look up tables and parameters) is copied from the cache
+        files = output_files(types, layout, output_file, gauss == "1")
+        if cache:
+            if chis is not None:
+                print("The chi sweep is not cached")
+            elif gauss == "1" and seed is None:
+                print("The Gaussian texture is random without --seed, the cache is not used")
+            else:
+                result_cache = ResultCache()
+                params = {"segtool": segtool, "version": version, "types": types, "layout": layout, "gauss": gauss,
+                          "seed": seed, "chi": new_vol.new_chi, "ref": ref, "pixel_policy": pixel_policy,
+                          "map_label": map_label, "dtype": str(dtype), "extension": split_ext(output_file)[1],
+                          "grid": [list(new_vol.grid[0]), new_vol.grid[1].tolist()] if new_vol.grid is not None else None,
+                          "crop": crop_info, "streams": STREAM_KEY if gauss == "1" else None,
+                          "compression": {"level": compresslevel, "threads": threads}}
+                with profiler.stage("cache key"):
+                    slabs = [new_vol.volume] if not stream else (slab for _, slab in iter_slabs(file, depth))
+                    luts = {type: new_vol.label_table.lut(type)[0] for type in types}
+                    cache_key = conversion_key(slabs, file.shape, file.get_data_dtype(), file.affine, luts, params)
+                cached = result_cache.restore(cache_key, files, "output")
+
+        if cached:
+            print("# Step 2. Conversion found in the cache #")
+            print("Outputs copied from: ", result_cache.path(cache_key))
+            # Under the names of this run
+            outputs = {i: type for i, type in enumerate(types)} if "4d" in files else dict(files)
+            ans = 0
+        elif stream:
+            print("# Step 2. Checking pixel integrity and converting slab by slab #")
+            new_vol.gauss_flag = 1 if gauss == "1" else 0
+            new_vol.seed = seed
+            with profiler.stage("stream"):
+                ans, outputs = stream_convert(new_vol, input_file, types, layout, output_file, pixel_policy, map_label, depth)
+        else:
+            print("# Step 2. Checking pixel integrity #")
+            with profiler.stage("check pixels"):
+                ans = new_vol.check_pixels(input_file, pixel_policy, map_label)
 
         if ans == 0:
-            print("# Step 3. Converting ... #")
-
-            if gauss == "1":
-
-                new_vol.gauss_flag = 1
-                print("Gaussian option enabled ...")
-                new_vol.calc_regions()
-                # print("Calc region done")
-                new_vol.create_gauss_sc_dist(type)
-                print("Creating a Gaussian distribution phantom from ", type, " values")
-                if output_file == None:
-                    new_vol.save_gauss_dist(type)
-                    print("Gaussian phantom created")
-                else:
-                    new_vol.save_gauss_dist(type,output_file)
-                    print("Gaussian phantom created - custom out_fn")
+            if not stream and not cached:
+                print("# Step 3. Converting ... #")
+                with profiler.stage("convert"):
+                    if gauss == "1":
+                        new_vol.gauss_flag = 1
+                        new_vol.seed = seed
+                        print("Gaussian option enabled ...")
+                        with profiler.stage("calc regions"):
+                            new_vol.calc_regions()
+                        # print("Calc region done")
 
-            else:
+                    if chis is not None:
+                        print(f"Sweeping the susceptibility of {segtool} {version} labels {dynamic_labels(segtool, version)}"
+                              f" over {len(chis)} values")
+                        sweep = new_vol.save_chi_sweep(segtool, version, chis, output_file, layout)
+                        outputs = {}
 
-                if output_file == None:
-                    print("Piece-wise mode: on")
-                    new_vol.create_type_vol(type)  # This creates and saves a Nifti file
+                    elif len(types) > 1 and layout == "4d":
+                        print(f"Stacking {len(types)} properties in a 4D volume: {types}")
+                        new_vol.create_multi_vol(types)
+                        new_vol.save_multi_vol(output_file, release=True)
+                        outputs = {i: type for i, type in enumerate(types)}
 
-                else:
-                    print("Piece-wise ON - custom out_fn")
-                    new_vol.create_type_vol(type, output_file)
+                    else:
+                        for type in types:
+                            # With several properties, one file per property: sus_dist_t1.nii.gz
+                            out_fn = output_file if len(types) == 1 else add_suffix(output_file, "_" + type)
+                            if gauss == "1":
+                                new_vol.create_gauss_sc_dist(type)
+                                print("Creating a Gaussian distribution phantom from ", type, " values")
+                                with profiler.stage("save " + type):
+                                    new_vol.save_gauss_dist(type, out_fn, release=True)
+                                print("Gaussian phantom created - custom out_fn")
+                            else:
+                                print("Piece-wise ON - custom out_fn")
+                                new_vol.create_type_vol(type, out_fn)
+                            outputs[type] = "gauss_" + out_fn if gauss == "1" else out_fn
 
+            if stats is not None:
+                if stream:
+                    print("The label statistics need the whole volume, they are not made with --stream")
+                else:
+                    if cached and pixel_policy != "fail":
+                        # The pixels weren't checked on a cache hit, the statistics are of the corrected labels
+                        new_vol.check_pixels(input_file, pixel_policy, map_label, save=False)
+                    stats_file = new_vol.save_label_stats(split_ext(output_file)[0] + "_stats." + stats)
+                    print("Label statistics saved to ", stats_file)
+            # Last use of the label index, its memory is freed before the outputs are cached
+            new_vol.release_label_index()
+            if cache_key is not None and not cached:
+                with profiler.stage("cache store"):
+                    result_cache.store(cache_key, files, "output", {"command": command})
+            success = True
             print(f"Input segmented by: {segtool}, version: {version}")
             end = time.time()
             elapsed = end-start
@@ -141,12 +400,10 @@ def converter(input_file, segtool, version, type, gauss, chi, ref, output_file):
         print("Input must be a Nifti file (.nii or .nii.gz extensions)")
 
     # After everything is finished, we can create the json side car
-    try:
-        repo = git.Repo(search_parent_directories=True)
-    except git.exc.InvalidGitRepositoryError:
-        # This in case that converter tool is not ran under the folder
-        print("No Git repository found in parent directories.")
-        repo = None
+    # Version, commit and remote of the converter are resolved once per process
+    script_info = provenance()
+    if script_info['commit'] is None:
+        print("No Git repository found for the converter.")
     print("# Step 3. Creating json sidecar for the convertion #")
 
     converter_sidecar = {}
@@ -156,14 +413,61 @@ def converter(input_file, segtool, version, type, gauss, chi, ref, output_file):
     converter_sidecar['date'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     converter_sidecar['script'] = str(Path(os.path.abspath(__file__)).resolve())
     converter_sidecar['command'] = command
-    if repo:
-        converter_sidecar['script source'] = repo.remotes.origin.url
-        converter_sidecar['script commit hash'] = repo.head.object.hexsha
+    converter_sidecar['script version'] = script_info['version']
+    converter_sidecar['script source'] = script_info['remote'] or "tissue_to_MR"
+    converter_sidecar['script commit hash'] = script_info['commit'] or "check with git status"
+    if os.path.isfile(input_file):
+        converter_sidecar['input sha256'] = file_hash(input_file)
+    if new_vol is not None:
+        converter_sidecar['input dtype'] = str(new_vol.nifti.get_data_dtype())
+    converter_sidecar['dtype'] = str(dtype)
+    if output_file.endswith('.gz'):
+        converter_sidecar['compression'] = {'level': compresslevel, 'threads': threads}
+    converter_sidecar['timings (s)'] = profiler.timings()
+    if own_peak:
+        converter_sidecar['memory peak (MB)'] = peak_memory_mb(since_reset=True)
     else:
-        converter_sidecar['script source'] = "tissue_to_MR"
-        converter_sidecar['script commit hash'] = "check with git status"
+        # Where the peak can't be reset it is the peak of the process, maybe of an earlier conversion
+        converter_sidecar['process memory peak (MB)'] = peak_memory_mb()
+    if cache_key is not None:
+        converter_sidecar['cache'] = {'key': cache_key, 'hit': cached is not None}
+    # chi of every frame of the 4D series, or of every file
+    if sweep is not None:
+        converter_sidecar['chi sweep'] = {'layout': layout, ('frames' if layout == "4d" else 'files'): sweep}
+    if crop_info is not None:
+        converter_sidecar['crop'] = crop_info
+    if grid_info is not None:
+        converter_sidecar['grid'] = grid_info
+    if stats_file is not None:
+        converter_sidecar['label stats'] = os.path.basename(stats_file)
+    if depth is not None:
+        converter_sidecar['streaming'] = {'slab depth': depth}
+    if new_vol is not None and new_vol.seed is not None:
+        converter_sidecar['random streams'] = stream_layout(new_vol.seed)
+    # Index of every property in the 4D output, or file of every property
+    if len(types) > 1:
+        converter_sidecar['layout'] = layout
+        converter_sidecar['properties'] = outputs
+    # What tissue_to_MR_update needs to rewrite only the voxels of the labels whose value changes:
+    # the label map and the value of every label (before the reference is subtracted)
+    # (a cache hit doesn't save the labels corrected by a pixel policy, a resampled or cropped phantom isn't on the
+    # grid of the labels)
+    if (success and new_vol is not None and sweep is None and grid_info is None and crop_info is None
+            and not (cached and pixel_policy != "fail")):
+        ids = sorted(new_vol.look_up)
+        converter_sidecar['update'] = {
+            'segtool': segtool,
+            'version': version,
+            'chi': new_vol.new_chi,
+            'labels': os.path.abspath(new_vol.corrected_path or input_file),
+            'ref': ref,
+            'gauss': gauss == "1",
+            'property table': {type: dict(zip(map(str, ids), new_vol.label_table.lut(type)[0][ids].tolist()))
+                               for type in types},
+        }
 
-    json_out_name = output_file.replace(".nii.gz", ".json")
+    # Same name as the output, .nii or .nii.gz
+    json_out_name = split_ext(output_file)[0] + ".json"
     json_out_path = os.path.join("output", json_out_name)
     print(json_out_path)
     if os.path.exists(json_out_path):
@@ -173,6 +477,19 @@ def converter(input_file, segtool, version, type, gauss, chi, ref, output_file):
     with open(json_out_path, 'w', encoding='utf-8') as f:
         json.dump(converter_sidecar, f, ensure_ascii=False, indent=4)
 
+    if profile:
+        base_name = os.path.join("output", json_out_name[:-len(".json")])
+        report = profiler.save(base_name + "_profile.json", cprofile_path=base_name + "_slowest.prof" if cprofile else None)
+        print("Profile saved to: ", base_name + "_profile.json")
+        for name, stage in report["stages"].items():
+            print(f"  {name}: {stage['wall_s']} s wall, {stage['cpu_s']} s CPU, peak {stage['peak_mb']} MB")
+        if cprofile:
+            print(f"cProfile of the slowest stage ({report['slowest']}) saved to: ", base_name + "_slowest.prof")
+    if own_profiler:
+        profiler.close()
+
+    return success
+
 #my_commands.add_command(converter)
 #if __name__ == "__main__":
 #    my_commands()
@@ -0,0 +1,146 @@
+import datetime
+import json
+import os
+import time
+
+import click
+
+from tissue2mrprop.cli.tissue_to_mr import PROPERTIES
+from tissue2mrprop.functions.utils.utils import is_nifti, split_ext
+# tissue_to_MR_update -i output/sus_dist.nii.gz --set lungs=-4.2 --set 264=-8.9 -r -9.05
+# Updates a phantom made by tissue_to_MR to new label values, rewriting only the voxels of the labels
+# whose value changed. The label map and the values the phantom was made with are read from its sidecar.
+
+
+def parse_changes(changes, look_up):
+    # {label_id: value} from LABEL=VALUE strings, LABEL is a label id or a name (all the labels with that name)
+    values = {}
+    for change in changes:
+        if "=" not in change:
+            raise click.BadParameter(f"{change} is not LABEL=VALUE", param_hint="'--set'")
+        label, value = change.rsplit("=", 1)
+        label = label.strip()
+        if label.lstrip("-").isdigit():
+            ids = [int(label)]
+        else:
+            ids = [label_id for label_id, (name, _) in look_up.items() if name == label]
+        if not ids or any(label_id not in look_up for label_id in ids):
+            raise click.BadParameter(f"Label {label} not in the look up table", param_hint="'--set'")
+        for label_id in ids:
+            values[label_id] = float(value)
+    return values
+
+
+def find_sidecar(phantom_file):
+    # Sidecar of a phantom: [output].json is shared by the phantoms of one conversion, which are named
+    # [output].nii.gz, [output]_[type].nii.gz (several types) and gauss_... (Gaussian texture)
+    folder, name = os.path.split(phantom_file)
+    stem, _ = split_ext(name)
+    stems = [stem]
+    if stem.startswith("gauss_"):
+        stems.append(stem[len("gauss_"):])
+    for s in list(stems):
+        stems += [s[:-len(type) - 1] for type in PROPERTIES if s.endswith("_" + type)]
+    for s in stems:
+        path = os.path.join(folder, s + ".json")
+        if os.path.isfile(path):
+            return path
+    return os.path.join(folder, stem + ".json")
+
+
+def phantom_type(sidecar, phantom_file, type):
+    # Property of the phantom: the only one of the sidecar, or found from the file name
+    table = sidecar["update"]["property table"]
+    if type:
+        if type not in table:
+            raise click.BadParameter(f"{type} is not in the sidecar, choose from: {list(table)}", param_hint="'-t'")
+        return type
+    if len(table) == 1:
+        return next(iter(table))
+    for type, name in (sidecar.get("properties") or {}).items():
+        if type in table and os.path.basename(phantom_file) == name:
+            return type
+    raise click.UsageError(f"The sidecar has several properties {list(table)}, choose one with -t")
+
+
+@click.command()
+@click.option("-i", "--input", "phantom_file", type=click.Path(exists=True), required=True,
+              help="Phantom made by tissue_to_MR (3D .nii or .nii.gz)")
+@click.option("-j", "--sidecar", required=False, type=click.Path(exists=True), default=None,
+              help="json sidecar of the phantom, by default the [output].json of the conversion that made the input")
+@click.option("-t", "--type", required=False, default=None, help="Property of the phantom, if the sidecar has several")
+@click.option("--set", "changes", multiple=True,
+              help="New value of a label, LABEL=VALUE where LABEL is a label id or name. Repeat for several labels")
+@click.option("-r", "--ref", required=False, type=float, default=None,
+              help="New reference susceptibility, applied as a single offset of the whole phantom")
+@click.option("-o", "--output", "output_file", type=click.Path(), default=None,
+              help="Updated phantom, the input is overwritten by default")
+def update(phantom_file, sidecar, type, changes, ref, output_file):
+    import numpy as np
+    import nibabel as nib
+    from tissue2mrprop.functions.update import update_phantom, changed_labels
+    from tissue2mrprop.functions.utils.select_tool import return_dict_labels
+    from tissue2mrprop.functions.utils.nifti_io import save_nifti
+    from tissue2mrprop.functions.utils.label_index import LabelIndex, label_index_path
+
+    start = time.time()
+    sidecar_path = sidecar or find_sidecar(phantom_file)
+    if not os.path.isfile(sidecar_path):
+        raise click.UsageError(f"No sidecar {sidecar_path}, give it with -j")
+    with open(sidecar_path, 'r', encoding='utf-8') as f:
+        sidecar = json.load(f)
+    if "update" not in sidecar:
+        raise click.UsageError("The sidecar doesn't have the label map and values of the phantom, convert it again")
+    info = sidecar["update"]
+    type = phantom_type(sidecar, phantom_file, type)
+    if ref is not None and type != "sus":
+        raise click.BadParameter("The reference only applies to susceptibility phantoms", param_hint="'-r'")
+
+    look_up = return_dict_labels(info["segtool"], info["version"], new_chi=info["chi"], verbose=False)
+    old_values = {int(label_id): value for label_id, value in info["property table"][type].items()}
+    new_values = dict(old_values)
+    new_values.update(parse_changes(changes, look_up))
+    # The reference is only subtracted from the susceptibility, the other properties are not shifted
+    old_ref = info["ref"] if type == "sus" else 0
+    new_ref = (old_ref if ref is None else ref) if type == "sus" else 0
+
+    # Not memory-mapped, the phantom can be overwritten
+    img = nib.load(phantom_file, mmap=False)
+    if len(img.shape) != 3:
+        raise click.UsageError("Only 3D phantoms can be updated, convert 4D outputs again")
+    phantom = np.asanyarray(img.dataobj)
+    label_img = nib.load(info["labels"])
+    if label_img.shape != phantom.shape:
+        raise click.UsageError(f"Label map {info['labels']} doesn't have the shape of the phantom")
+    # Index saved next to the label map by tissue_to_MR --label-index, if it is still valid
+    # the label map is then not read at all
+    index = LabelIndex.load(label_index_path(info["labels"]), info["labels"])
+    if index is not None and index.shape != phantom.shape:
+        index = None
+    labels = np.asanyarray(label_img.dataobj) if index is None else None
+    changed = changed_labels(old_values, new_values)
+    count = update_phantom(phantom, labels, old_values, new_values, old_ref=old_ref, new_ref=new_ref,
+                           textured=info["gauss"], index=index)
+    del labels
+    output_file = output_file or phantom_file
+    if not is_nifti(output_file):
+        raise click.BadParameter("Output must be a Nifti file (.nii or .nii.gz)", param_hint="'-o'")
+    save_nifti(phantom, img.affine, output_file)
+    print(f"Updated {len(changed)} labels ({count} voxels)" + (f", reference {new_ref}" if new_ref != old_ref else ""))
+
+    info["property table"][type] = {str(label_id): value for label_id, value in new_values.items()}
+    if type == "sus":
+        info["ref"] = new_ref
+    sidecar.setdefault("updates", []).append({
+        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "file": os.path.basename(output_file),
+        "type": type,
+        "labels": {str(label_id): new_values[label_id] for label_id in changed},
+        "ref": new_ref if type == "sus" else None,
+        "voxels": count,
+        "seconds": round(time.time() - start, 3),
+    })
+    out_sidecar = sidecar_path if output_file == phantom_file else split_ext(output_file)[0] + ".json"
+    with open(out_sidecar, 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f, ensure_ascii=False, indent=4)
+    print("Time elapsed: ", time.time() - start)
@@ -0,0 +1,158 @@
+# Out-of-core conversion for volumes that don't fit comfortably in memory
+# The label map is read in slabs along z, every slab is mapped to the requested properties
+# and written straight into the output files, so memory is bounded by the size of a slab.
+import os
+
+import numpy as np
+
+from tissue2mrprop.functions.volume import bad_pixel_report
+from tissue2mrprop.functions.utils.property_map import map_labels
+from tissue2mrprop.functions.utils.nifti_io import NiftiSlabWriter
+from tissue2mrprop.functions.utils.random_streams import new_seed
+from tissue2mrprop.functions.utils.profiler import profile_stage
+from tissue2mrprop.functions.utils.utils import split_ext, add_suffix
+
+
+# Memory budget of a slab when streaming is asked without a budget
+DEFAULT_SLAB_BUDGET = 256 * 2**20
+
+
+def estimate_footprint(shape, label_dtype, n_types, dtype):
+    # Bytes needed to convert the whole volume in memory: the labels and one output volume per type
+    return int(np.prod(shape)) * (np.dtype(label_dtype).itemsize + n_types * np.dtype(dtype).itemsize)
+
+
+def slab_depth(shape, label_dtype, n_types, dtype, budget):
+    # Number of z slices of a slab that fits in the memory budget (bytes)
+    # Every output slab is in memory twice: mapped and as the bytes being written
+    per_slice = int(shape[0]) * int(shape[1]) * (np.dtype(label_dtype).itemsize + 2 * n_types * np.dtype(dtype).itemsize)
+    return int(max(1, min(shape[2], budget // per_slice)))
+
+
+def iter_slabs(nifti, depth, profiler=None):
+    # Yields (z0, labels[..., z0:z0 + depth]) in the dtype the labels are stored with
+    # Load the image with keep_file_open=True so a compressed file is decompressed only once
+    n_slices = nifti.shape[2]
+    for z0 in range(0, n_slices, depth):
+        with profile_stage(profiler, "read slab"):
+            slab = np.asanyarray(nifti.dataobj[..., z0:min(z0 + depth, n_slices)])
+        yield z0, slab
+
+
+def stream_check_pixels(vol, depth):
+    # Report of the pixels outside the look up table, gathered slab by slab
+    # Returns a dictionary value: (count, bbox_min, bbox_max) like volume.bad_pixel_report
+    known = np.array(sorted(vol.look_up.keys()))
+    report = {}
+    for z0, slab in iter_slabs(vol.nifti, depth, vol.profiler):
+        bad_coords = np.nonzero(~np.isin(slab, known))
+        if len(bad_coords[0]) == 0:
+            continue
+        for value, (count, lo, hi) in bad_pixel_report(slab, bad_coords, offset=(0, 0, z0)).items():
+            if value in report:
+                old_count, old_lo, old_hi = report[value]
+                count = count + old_count
+                lo = tuple(min(a, b) for a, b in zip(lo, old_lo))
+                hi = tuple(max(a, b) for a, b in zip(hi, old_hi))
+            report[value] = (count, lo, hi)
+    return report
+
+
+def stream_convert(vol, input_name, types, layout, output_file, policy="fail", map_label=None, depth=16):
+    """
+    Check, convert and save the volume slab by slab along z.
+
+    Args:
+        vol (volume): volume created with load=False, after group_seg_labels
+        input_name (str): input filename, used to name the corrected pixels file
+        types (list): MR properties to convert to
+        layout (str): split (one file per type) or 4d (a single 4D file)
+        output_file (str): output filename, saved in the output folder
+        policy (str): pixel policy, see volume.check_pixels. nearest is not available when streaming
+        map_label (int): label used by the map pixel policy
+        depth (int): number of z slices per slab
+
+    Returns:
+        ans (int): 0 if the conversion succeeded, 1 otherwise
+        outputs (dict): output file of every type, or index of every type in the 4D output
+    """
+    vol.log(f"Streaming mode: slabs of {depth} slices")
+    with vol.stage("check pixels"):
+        report = stream_check_pixels(vol, depth)
+    if report:
+        for value, (count, bbox_min, bbox_max) in report.items():
+            vol.log(f"Pixel with wrong value: {value} found {count} times between {bbox_min} and {bbox_max}")
+        vol.log("(indexed from [0,0,0])")
+        if policy == "fail":
+            vol.log("Use a pixel policy (zero or map) to correct them")
+            return 1, {}
+        if policy == "nearest":
+            vol.log("The nearest pixel policy needs the whole volume in memory, use zero or map when streaming")
+            return 1, {}
+        if policy == "map" and map_label not in vol.look_up:
+            vol.log(f"Label {map_label} not in look up table")
+            return 1, {}
+        vol.log(f"Changing the wrong pixels using the {policy} policy")
+    else:
+        vol.log("Input has correct pixel integrity!")
+
+    luts = {type: vol.property_lut(type) for type in types}
+    params = {}
+    if vol.gauss_flag:
+        if vol.seed is None:
+            vol.seed = new_seed()
+        vol.log("Seed of the Gaussian texture: ", vol.seed)
+        params = {type: vol.gauss_sc_params(type, vol.look_up.keys()) for type in types}
+    prefix = "gauss_" if vol.gauss_flag else ""
+    shape = tuple(vol.nifti.shape)
+    affine = vol.nifti.affine
+
+    os.makedirs(vol.output_dir, exist_ok=True)
+    writers = {}
+    if len(types) > 1 and layout == "4d":
+        # A 4D file is written frame by frame, so the labels are streamed once per type
+        writer = NiftiSlabWriter(os.path.join(vol.output_dir, prefix + output_file), shape + (len(types),), affine,
+                                 vol.dtype, vol.compresslevel, vol.threads)
+        passes = [[type] for type in types]
+        writers = {type: writer for type in types}
+        outputs = {i: type for i, type in enumerate(types)}
+    else:
+        passes = [types]
+        outputs = {}
+        for type in types:
+            out_fn = output_file if len(types) == 1 else add_suffix(output_file, "_" + type)
+            writers[type] = NiftiSlabWriter(os.path.join(vol.output_dir, prefix + out_fn), shape, affine, vol.dtype,
+                                            vol.compresslevel, vol.threads)
+            outputs[type] = prefix + out_fn
+
+    corrected = None
+    if report:
+        base_name, extension = split_ext(os.path.basename(input_name))
+        corrected = NiftiSlabWriter(os.path.join(vol.output_dir, base_name + "corrected_pixels" + extension),
+                                    shape, affine, vol.nifti.get_data_dtype(), vol.compresslevel, vol.threads)
+
+    known = np.array(sorted(vol.look_up.keys()))
+    for i, pass_types in enumerate(passes):
+        for z0, slab in iter_slabs(vol.nifti, depth, vol.profiler):
+            if report:
+                slab = np.array(slab)
+                slab[~np.isin(slab, known)] = 0 if policy == "zero" else map_label
+                if i == 0:
+                    corrected.write(slab)
+            for type in pass_types:
+                with vol.stage("map " + type):
+                    out = map_labels(slab, luts[type], dtype=vol.dtype)
+                if vol.gauss_flag:
+                    vol.add_gauss_texture(out, slab, type, params[type], z_offset=z0)
+                with vol.stage("write " + type):
+                    writers[type].write(out)
+                del out
+
+    for writer in {id(w): w for w in writers.values()}.values():
+        writer.close()
+    if corrected is not None:
+        vol.log("Saving corrected volume for later usage!")
+        corrected.close()
+        vol.corrected_path = corrected.path
+
+    return 0, outputs
@@ -0,0 +1,73 @@
+# Incremental update of a phantom when property values of some labels change
+# A phantom is saved with its label map and the value of every label (see the "update" entry of
+# the json sidecar). When values change, only the voxels of the labels whose value changed are
+# rewritten, and a new reference (-r) is a single offset of the whole volume.
+import numpy as np
+
+
+def changed_labels(old_values, new_values):
+    """
+    Labels whose value differs between two tables.
+
+    Args:
+        old_values (dict): label_id -> value the phantom was made with
+        new_values (dict): label_id -> new value
+
+    Returns:
+        list: sorted ids of the labels whose value changed (NaN equals NaN)
+    """
+    changed = []
+    for label_id, value in new_values.items():
+        old = old_values.get(label_id)
+        if old is None or not (value == old or (np.isnan(value) and np.isnan(old))):
+            changed.append(label_id)
+    return sorted(changed)
+
+
+def update_phantom(phantom, labels, old_values, new_values, old_ref=0, new_ref=0, textured=False, index=None):
+    """
+    Update a phantom in place to new label values.
+    The phantom holds the value of the label of every voxel minus a reference (see -r of tissue_to_MR).
+
+    Args:
+        phantom (np.ndarray): the phantom, modified in place
+        labels (np.ndarray): label map the phantom was made from, can be None with an index
+        old_values (dict): label_id -> value the phantom was made with
+        new_values (dict): label_id -> new value
+        old_ref (float): reference subtracted from the values in the phantom
+        new_ref (float): new reference, a change of reference is a single offset of every voxel
+        textured (bool): the phantom has a Gaussian texture, the changed labels are shifted by the change
+            of their value to keep the texture instead of being overwritten
+        index (LabelIndex): index of labels, the voxels of the changed labels are then found without scanning
+            the label map
+
+    Returns:
+        int: number of voxels rewritten, the offset aside
+    """
+    if old_ref != new_ref:
+        phantom += phantom.dtype.type(old_ref - new_ref)
+
+    changed = changed_labels(old_values, new_values)
+    if not changed:
+        return 0
+    ids = np.asarray(changed)
+    # Value (or change of value) of every changed label, indexed by its position in ids
+    if textured:
+        values = np.array([new_values[l] - old_values[l] for l in changed])
+    else:
+        values = np.array([new_values[l] for l in changed]) - new_ref
+
+    if index is not None:
+        # The voxels of every changed label are read from the index, the label map isn't needed
+        runs = [index.voxels_of(l) for l in changed]
+        voxels = np.concatenate(runs)
+        position = np.repeat(np.arange(len(changed)), [len(run) for run in runs])
+    else:
+        # A single pass over the labels finds the voxels to rewrite
+        voxels = np.flatnonzero(np.isin(labels, ids))
+        position = np.searchsorted(ids, labels.flat[voxels])
+    if textured:
+        phantom.flat[voxels] += values[position].astype(phantom.dtype)
+    else:
+        phantom.flat[voxels] = values[position]
+    return len(voxels)
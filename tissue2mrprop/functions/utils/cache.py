@@ -0,0 +1,184 @@
+# Content-addressed cache of the conversions
+# A conversion is identified by the sha256 of everything its result depends on: the voxels, shape,
+# dtype and affine of the segmentation, the look up tables of the properties and the parameters,
+# including how the files are encoded (compression level and threads of the .nii.gz writer).
+# The output files of a conversion are stored under that key, so an identical conversion is a copy.
+# Entries are evicted least recently used first (by the mtime of their manifest) when the cache is
+# larger than its size bound.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import tissue2mrprop
+
+# Folder and size bound of the cache, can be changed with environment variables
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tissue2mrprop")
+DEFAULT_CACHE_SIZE_MB = 5000
+MANIFEST = "manifest.json"
+
+
+def cache_dir():
+    # Folder of the cache: $TISSUE2MRPROP_CACHE_DIR or ~/.cache/tissue2mrprop
+    return os.environ.get("TISSUE2MRPROP_CACHE_DIR") or DEFAULT_CACHE_DIR
+
+
+def cache_size():
+    # Size bound of the cache in bytes: $TISSUE2MRPROP_CACHE_SIZE_MB or 5 GB
+    return int(float(os.environ.get("TISSUE2MRPROP_CACHE_SIZE_MB") or DEFAULT_CACHE_SIZE_MB) * 2**20)
+
+
+def update_array(digest, array):
+    # Feeds the voxels of array in Fortran order: the slabs along z of a volume give the same
+    # bytes, in the same order, as the whole volume
+    array = np.asfortranarray(array)
+    digest.update(memoryview(array.T).cast('B'))
+
+
+def conversion_key(slabs, shape, dtype, affine, luts, params):
+    """
+    Key of a conversion.
+
+    Args:
+        slabs (iterable): the label volume, whole or as consecutive slabs along z
+        shape (tuple): shape of the label volume
+        dtype: data type of the labels
+        affine (np.ndarray): 4x4 affine of the segmentation
+        luts (dict): look up table (label_id -> value) of every property converted
+        params (dict): parameters of the conversion, JSON serializable
+
+    Returns:
+        str: hex sha256
+    """
+    digest = hashlib.sha256()
+    header = {"version": tissue2mrprop.__version__, "shape": [int(s) for s in shape], "dtype": str(np.dtype(dtype)),
+              "params": params, "luts": list(luts)}
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode())
+    digest.update(np.asarray(affine, dtype=np.float64).tobytes())
+    for lut in luts.values():
+        digest.update(np.ascontiguousarray(lut, dtype=np.float64).tobytes())
+    for slab in slabs:
+        update_array(digest, slab)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Output files of the conversions, stored by key.
+
+    Args:
+        root (str): folder of the cache, cache_dir() if None
+        max_bytes (int): size bound, cache_size() if None
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or cache_dir()
+        self.max_bytes = cache_size() if max_bytes is None else max_bytes
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def restore(self, key, files, folder):
+        """
+        Copies the files of a cached conversion.
+
+        Args:
+            key (str): key of the conversion
+            files (dict): role -> file name, same roles as when the entry was stored
+            folder (str): folder to copy the files to
+
+        Returns:
+            dict: the manifest of the entry, None if the conversion is not cached
+        """
+        entry = self.path(key)
+        try:
+            with open(os.path.join(entry, MANIFEST), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if set(manifest["files"]) != set(files):
+            return None
+        os.makedirs(folder, exist_ok=True)
+        for role, name in files.items():
+            shutil.copyfile(os.path.join(entry, manifest["files"][role]), os.path.join(folder, name))
+        # Most recently used
+        os.utime(os.path.join(entry, MANIFEST))
+        return manifest
+
+    def store(self, key, files, folder, info=None):
+        """
+        Stores the output files of a conversion and evicts the least recently used entries.
+
+        Args:
+            key (str): key of the conversion
+            files (dict): role -> name of the file in folder
+            folder (str): folder of the files
+            info (dict): saved in the manifest, e.g. the properties of the outputs
+        """
+        os.makedirs(os.path.join(self.root, key[:2]), exist_ok=True)
+        # Written in a temporary folder first, a concurrent reader never sees a partial entry
+        tmp = tempfile.mkdtemp(dir=os.path.join(self.root, key[:2]), prefix=".tmp")
+        try:
+            stored = {}
+            for i, (role, name) in enumerate(files.items()):
+                stored[role] = f"{i}_{os.path.basename(name)}"
+                shutil.copyfile(os.path.join(folder, name), os.path.join(tmp, stored[role]))
+            manifest = {"key": key, "files": stored, "created": time.time(), "info": info or {}}
+            with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=4, default=str)
+            if os.path.exists(self.path(key)):
+                shutil.rmtree(self.path(key))
+            os.replace(tmp, self.path(key))
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        self.evict()
+
+    def entries(self):
+        # (key, size in bytes, last use) of every entry, least recently used first
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            if not os.path.isdir(folder):
+                continue
+            for key in os.listdir(folder):
+                manifest = os.path.join(folder, key, MANIFEST)
+                if key.startswith(".") or not os.path.isfile(manifest):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(folder, key)))
+                entries.append((key, size, os.path.getmtime(manifest)))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            list: keys of the entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for key, size, _ in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        # Removes every entry, returns how many there were
+        return len(self.evict(max_bytes=0))
+
+    def info(self):
+        entries = self.entries()
+        return {"folder": self.root, "entries": len(entries), "size_mb": round(sum(e[1] for e in entries) / 2**20, 1),
+                "max_size_mb": round(self.max_bytes / 2**20, 1)}
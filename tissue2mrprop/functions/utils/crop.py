@@ -0,0 +1,93 @@
+# Cropping of a segmentation to the anatomy
+# Most of a CT field of view is air (label 0): the conversion only needs the bounding box of the other
+# labels (or of a chosen set, e.g. the spine), plus a margin. The outputs are written on the box with
+# the affine translated to its first voxel, or put back into the grid of the input.
+import numpy as np
+
+# Voxels of the labels tested at a time while looking for the box
+SLAB_VOXELS = 1 << 24
+
+
+def crop_box(labels, keep=None, background=0, margin=0):
+    """
+    Bounding box of the labels to keep, slab by slab along z.
+
+    Args:
+        labels (np.ndarray): 3D label volume
+        keep (list): label ids to keep, every label but background if None
+        background (int): label of the background
+        margin (int): voxels added on every side of the box, clipped to the volume
+
+    Returns:
+        tuple: slice of every axis, None if there is no voxel to keep
+    """
+    shape = labels.shape[:3]
+    hits = [np.zeros(n, dtype=bool) for n in shape]
+    depth = max(1, SLAB_VOXELS // (shape[0] * shape[1]))
+    for z0 in range(0, shape[2], depth):
+        slab = labels[..., z0:z0 + depth]
+        mask = np.isin(slab, keep) if keep is not None else slab != background
+        hits[0] |= mask.any(axis=(1, 2))
+        hits[1] |= mask.any(axis=(0, 2))
+        hits[2][z0:z0 + depth] = mask.any(axis=(0, 1))
+    if not hits[2].any():
+        return None
+    box = []
+    for n, hit in zip(shape, hits):
+        voxels = np.flatnonzero(hit)
+        box.append(slice(max(int(voxels[0]) - margin, 0), min(int(voxels[-1]) + 1 + margin, n)))
+    return tuple(box)
+
+
+def crop_affine(affine, box):
+    # Affine of the box: the same voxel axes starting at the first voxel of the box
+    affine = np.array(affine, dtype=np.float64)
+    start = np.array([s.start for s in box], dtype=np.float64)
+    affine[:3, 3] = affine[:3, :3] @ start + affine[:3, 3]
+    return affine
+
+
+def uncrop(data, box, shape, fill=0):
+    """
+    Put a cropped volume back into the full grid.
+
+    Args:
+        data (np.ndarray): cropped volume, 3D or 4D (one frame per property)
+        box (tuple): slices of the box in the full grid
+        shape (tuple): 3D shape of the full grid
+        fill (float or sequence): value outside of the box, one per frame for a 4D volume
+
+    Returns:
+        np.ndarray: volume of the full grid
+    """
+    full = np.empty(tuple(shape[:3]) + data.shape[3:], dtype=data.dtype, order="F")
+    full[...] = fill
+    full[box] = data
+    return full
+
+
+def resolve_labels(names, look_up):
+    """
+    Label ids from ids or tissue names.
+
+    Args:
+        names (list): label ids or names (a name gives all the labels with that name)
+        look_up (dict): label_id -> (name, susceptibility)
+
+    Returns:
+        list: sorted label ids
+
+    Raises:
+        ValueError: a name or id not in the look up table
+    """
+    ids = set()
+    for name in names:
+        name = str(name).strip()
+        if name.lstrip("-").isdigit():
+            found = [int(name)] if int(name) in look_up else []
+        else:
+            found = [label_id for label_id, (label_name, _) in look_up.items() if label_name == name]
+        if not found:
+            raise ValueError(f"Label {name} not in the look up table")
+        ids.update(found)
+    return sorted(ids)
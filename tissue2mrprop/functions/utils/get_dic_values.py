@@ -1,17 +1,53 @@
 # This function is a util as it will be used to create CSV files from the dictionaries from both label and Volume
 import csv
+import io
+import json
 # From Volume class we will create a CSV file of susceptibility with corresponding ID and name
 # From Label we will create a CSV file with relaxation times
 
-def to_csv_sus(data, filename):
+AXES = ["x", "y", "z"]
+
+
+def write_csv(rows, filename, fieldnames):
+    # The whole table is formatted in memory and written to the file at once
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
     with open(filename, 'w', newline='') as csvfile:
-        fieldnames = ["Label ID", "Name", "Susceptibility"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        csvfile.write(buffer.getvalue())
+
+
+def to_csv_sus(data, filename):
+    write_csv(data, filename, ["Label ID", "Name", "Susceptibility"])
+
+
+def to_csv_relax(data, filename):
+    # One row per tissue with its relaxation values, in the order of RELAX_VALUES
+    write_csv(data, filename, ["Name", "M0", "T1", "T2", "T2*", "PD"])
+
+
+def flat_row(row):
+    # Row of a statistics table for the CSV: lists joined with ";", bounding boxes split per axis
+    flat = {}
+    for key, value in row.items():
+        if key in ("bbox_min", "bbox_max"):
+            flat.update({f"{key}_{AXES[axis] if axis < len(AXES) else axis}": c for axis, c in enumerate(value)})
+        elif isinstance(value, list):
+            flat[key] = ";".join(str(v) for v in value)
+        else:
+            flat[key] = "" if value is None else value
+    return flat
+
+
+def to_csv_stats(stats, filename):
+    # Statistics of label_stats.label_statistics as a single CSV table, one row per label and per tissue
+    rows = [flat_row(row) for row in stats]
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    write_csv(rows, filename, fieldnames)
 
-        writer.writeheader()
-        for row in data:
-            writer.writerow(row)
 
-def to_csv_relax():
-    # Future implementation
-    pass
+def to_json_stats(stats, filename, info=None):
+    # Same table as JSON, info (e.g. the voxel size) is saved next to the rows
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump({**(info or {}), "rows": stats}, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,148 @@
+# Per-label voxel index of a segmentation
+# The flat indices of the voxels are sorted by label once (stable sort, radix sort for small integer
+# labels), and every label is a contiguous run of that array, like the rows of a CSR matrix:
+#   voxels[offsets[i]:offsets[i + 1]] are the flat indices (C order, like ndarray.flat) of labels[i]
+# Masks, counts and scatter writes of a label then cost the size of the label, not of the volume.
+# When only the counts are needed, label_counts gets them without the index (np.bincount slab by slab).
+import os
+
+import numpy as np
+
+from tissue2mrprop.functions.utils.utils import split_ext
+
+# Extension of the index saved next to a segmentation
+INDEX_EXTENSION = ".labelindex.npz"
+# Voxels counted at a time by label_counts (the slab is copied as intp for np.bincount)
+SLAB_VOXELS = 1 << 24
+
+
+def label_index_path(source):
+    # Saved index of a segmentation: seg.nii.gz -> seg.labelindex.npz
+    return split_ext(source)[0] + INDEX_EXTENSION
+
+
+def label_counts(volume):
+    """
+    Number of voxels of every label, without sorting the volume.
+
+    Args:
+        volume (np.ndarray): label volume
+
+    Returns:
+        dict: label: number of voxels, for the labels present, sorted by label
+    """
+    if volume.size == 0:
+        return {}
+    integer = volume.dtype.kind in "biu"
+    low, high = (int(volume.min()), int(volume.max())) if integer else (0, 0)
+    # Float labels, or label values so far apart that the bins would outweigh the volume
+    if not integer or high - low > max(volume.size, 1 << 16):
+        labels, counts = np.unique(volume, return_counts=True)
+        return dict(zip(labels.tolist(), counts.tolist()))
+    counts = np.zeros(high - low + 1, dtype=np.int64)
+    # Slabs along the last axis, the copies made by bincount stay small
+    depth = max(1, SLAB_VOXELS // (volume.size // volume.shape[-1]))
+    for z0 in range(0, volume.shape[-1], depth):
+        slab = volume[..., z0:z0 + depth].ravel()
+        counts += np.bincount(slab.astype(np.intp) - low, minlength=len(counts))
+    present = np.flatnonzero(counts)
+    return dict(zip((present + low).tolist(), counts[present].tolist()))
+
+
+class LabelIndex:
+    """
+    Voxels of every label of a volume.
+
+    Args:
+        labels (np.ndarray): sorted label values present in the volume
+        offsets (np.ndarray): start of every label in voxels, and the total number of voxels at the end
+        voxels (np.ndarray): flat indices of the voxels, grouped by label and ascending within a label
+        shape (tuple): shape of the volume
+    """
+
+    __slots__ = ["labels", "offsets", "voxels", "shape", "positions"]
+
+    def __init__(self, labels, offsets, voxels, shape):
+        self.labels = labels
+        self.offsets = offsets
+        self.voxels = voxels
+        self.shape = tuple(int(s) for s in shape)
+        self.positions = {label: i for i, label in enumerate(labels.tolist())}
+
+    @classmethod
+    def from_volume(cls, volume):
+        # Builds the index of a label volume
+        flat = volume.reshape(-1)
+        # 32 bit indices are enough for volumes of up to 2**31 voxels and halve the memory
+        index_dtype = np.int32 if flat.size < 2**31 else np.int64
+        voxels = np.argsort(flat, kind="stable").astype(index_dtype, copy=False)
+        sorted_labels = flat[voxels]
+        starts = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+        starts = np.concatenate(([0], starts)) if flat.size else starts
+        labels = sorted_labels[starts]
+        offsets = np.append(starts, flat.size).astype(np.int64)
+        return cls(labels, offsets, voxels, volume.shape)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.positions
+
+    def voxels_of(self, label):
+        # Flat indices of the voxels of a label (a view, empty if the label is not in the volume)
+        i = self.positions.get(label)
+        if i is None:
+            return self.voxels[:0]
+        return self.voxels[self.offsets[i]:self.offsets[i + 1]]
+
+    def select(self, labels):
+        # Sorted flat indices of the voxels of several labels
+        runs = [self.voxels_of(label) for label in labels]
+        return np.sort(np.concatenate(runs)) if runs else self.voxels[:0]
+
+    def count(self, label):
+        return len(self.voxels_of(label))
+
+    def counts(self):
+        # Dictionary label: number of voxels
+        return dict(zip(self.labels.tolist(), np.diff(self.offsets).tolist()))
+
+    def coords(self, labels):
+        # Coordinates (tuple of arrays, like np.nonzero) of the voxels of labels, in C order
+        return np.unravel_index(self.select(labels), self.shape)
+
+    def mask(self, labels):
+        # Boolean volume, True on the voxels of labels
+        mask = np.zeros(self.shape, dtype=bool)
+        mask.flat[self.select(labels)] = True
+        return mask
+
+    def save(self, path, source):
+        """
+        Save the index with the size and modification time of the file it was made from.
+
+        Args:
+            path (str): .npz file
+            source (str): segmentation the index was made from
+        """
+        stat = os.stat(source)
+        np.savez(path, labels=self.labels, offsets=self.offsets, voxels=self.voxels, shape=np.array(self.shape),
+                 source=np.array([stat.st_size, stat.st_mtime_ns]))
+
+    @classmethod
+    def load(cls, path, source):
+        """
+        Load an index saved by save, if it was made from source as it is now.
+
+        Returns:
+            LabelIndex: the index, None if there is no index or source changed since
+        """
+        try:
+            stat = os.stat(source)
+            with np.load(path) as saved:
+                if saved["source"].tolist() != [stat.st_size, stat.st_mtime_ns]:
+                    return None
+                return cls(saved["labels"], saved["offsets"], saved["voxels"], saved["shape"])
+        except (OSError, KeyError, ValueError):
+            return None
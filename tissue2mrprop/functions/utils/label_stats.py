@@ -0,0 +1,100 @@
+# Statistics of every label and every tissue of a segmentation
+# Computed in one pass over the LabelIndex: the voxels of a label are contiguous in the index, so the
+# counts are the differences of the offsets and the bounding boxes are np.minimum/maximum.reduceat of
+# the coordinates. Labels of the same tissue (same name) are then summed with np.bincount.
+import numpy as np
+
+from tissue2mrprop.functions.label import LABEL_COLUMNS
+
+
+def voxel_volume(affine):
+    # Volume of a voxel in mm³, from the 3x3 part of the affine
+    return float(abs(np.linalg.det(np.asarray(affine, dtype=np.float64)[:3, :3])))
+
+
+def label_bboxes(index):
+    """
+    Bounding box of every label of an index.
+
+    Args:
+        index (LabelIndex): index of the segmentation
+
+    Returns:
+        (np.ndarray, np.ndarray): first and last voxel coordinates, one row per label of index.labels
+    """
+    starts = index.offsets[:-1]
+    bbox_min = np.empty((len(index), len(index.shape)), dtype=np.int64)
+    bbox_max = np.empty_like(bbox_min)
+    stride = 1
+    # One axis at a time, the coordinates of the whole volume are never held together
+    for axis in reversed(range(len(index.shape))):
+        coord = index.voxels // stride % index.shape[axis]
+        bbox_min[:, axis] = np.minimum.reduceat(coord, starts)
+        bbox_max[:, axis] = np.maximum.reduceat(coord, starts)
+        stride *= index.shape[axis]
+    return bbox_min, bbox_max
+
+
+def label_statistics(index, affine, table=None, look_up=None):
+    """
+    Per label and per tissue statistics of a segmentation.
+
+    Args:
+        index (LabelIndex): index of the segmentation
+        affine (np.ndarray): 4x4 affine of the segmentation, for the physical volumes
+        table (LabelTable): label table of the tool, adds the name and the property values of the labels
+        look_up (dict): label_id -> (name, susceptibility), gives the names without a table
+
+    Returns:
+        list: one dict per label (level "label") then one per tissue (level "tissue"), with the voxel
+            count, the volume in mm³, the bounding box and the property values
+    """
+    if len(index) == 0:
+        return []
+    counts = np.diff(index.offsets)
+    bbox_min, bbox_max = label_bboxes(index)
+    voxel_mm3 = voxel_volume(affine)
+    ids = index.labels.tolist()
+    if table is not None:
+        names = [table.names[table.rows[int(l)]] if l in table else None for l in ids]
+    else:
+        names = [look_up[l][0] if look_up and l in look_up else None for l in ids]
+    # Value of every property column for every label, NaN if the label or the value is unknown
+    columns = {}
+    if table is not None:
+        rows = np.array([table.rows.get(int(l), -1) for l in ids])
+        for col in LABEL_COLUMNS:
+            values = table.columns[col]
+            if np.isnan(values).all():
+                continue
+            columns[col] = np.where(rows >= 0, values[rows], np.nan)
+
+    stats = []
+    for i, label_id in enumerate(ids):
+        row = {"level": "label", "label_id": label_id, "name": names[i], "voxels": int(counts[i]),
+               "volume_mm3": float(counts[i] * voxel_mm3), "bbox_min": bbox_min[i].tolist(), "bbox_max": bbox_max[i].tolist()}
+        row.update({col: none_if_nan(values[i]) for col, values in columns.items()})
+        stats.append(row)
+
+    # Tissues: the labels with the same name summed together
+    tissue_names, tissue_of = np.unique(np.array([str(n) for n in names], dtype=object), return_inverse=True)
+    tissue_counts = np.bincount(tissue_of, weights=counts, minlength=len(tissue_names))
+    tissue_min = np.full((len(tissue_names), len(index.shape)), np.iinfo(np.int64).max)
+    tissue_max = np.full((len(tissue_names), len(index.shape)), -1)
+    np.minimum.at(tissue_min, tissue_of, bbox_min)
+    np.maximum.at(tissue_max, tissue_of, bbox_max)
+    for t, name in enumerate(tissue_names):
+        members = np.flatnonzero(tissue_of == t)
+        row = {"level": "tissue", "label_id": [ids[i] for i in members], "name": names[members[0]],
+               "voxels": int(tissue_counts[t]), "volume_mm3": float(tissue_counts[t] * voxel_mm3),
+               "bbox_min": tissue_min[t].tolist(), "bbox_max": tissue_max[t].tolist()}
+        # Value of the tissue if all its labels have the same, else left empty
+        row.update({col: none_if_nan(values[members[0]]) if np.all(values[members] == values[members[0]]) else None
+                    for col, values in columns.items()})
+        stats.append(row)
+    return stats
+
+
+def none_if_nan(value):
+    return None if np.isnan(value) else float(value)
+
@@ -0,0 +1,166 @@
+# Writing of NIfTI files slab by slab
+# NIfTI data is stored in Fortran order, so a slab along the last (z) axis is a contiguous block of the file:
+# the volume can be written straight to disk one slab at a time, without holding it in memory.
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+# gzip level of the outputs: the fastest one, phantoms are mostly piecewise constant and
+# compress almost as well as with the default level (6) for a fraction of the time
+DEFAULT_COMPRESSLEVEL = 1
+# Size of the blocks compressed in parallel by BlockGzipFile
+GZIP_BLOCK_SIZE = 4 * 2**20
+# Size of the slabs an in-memory volume is written by, see save_nifti
+SLAB_BYTES = 64 * 2**20
+
+
+def make_header(shape, affine, dtype):
+    """
+    NIfTI header of a volume, the same as the one nibabel writes for an array of this shape and dtype.
+
+    Args:
+        shape (tuple): shape of the volume, 3D or 4D
+        affine (np.ndarray): 4x4 affine
+        dtype: data type of the volume
+
+    Returns:
+        nib.Nifti1Header
+    """
+    # Broadcasting a 0-d array gives an image of the right shape without allocating it
+    img = nib.Nifti1Image(np.broadcast_to(np.zeros((), dtype=dtype), shape), affine)
+    header = img.header
+    header.set_data_dtype(dtype)
+    return header
+
+
+class BlockGzipFile:
+    """
+    Write-only gzip file compressed by blocks on a pool of threads (zlib releases the GIL).
+    Every block is a complete gzip member, concatenated members are a standard gzip file that
+    gzip, zlib and nibabel read as a single stream.
+
+    Args:
+        path (str): path of the file
+        compresslevel (int): gzip level, 1 (fastest) to 9 (smallest)
+        threads (int): number of blocks compressed at the same time
+        block_size (int): bytes of data per block
+    """
+
+    def __init__(self, path, compresslevel=DEFAULT_COMPRESSLEVEL, threads=4, block_size=GZIP_BLOCK_SIZE):
+        self.file = open(path, 'wb')
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        # Blocks being compressed, written in order. Bounded so the memory doesn't grow with the file
+        self.pending = deque()
+        self.max_pending = 2 * threads
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        # data must not change after the call (bytes), its blocks are compressed later
+        view = memoryview(data).cast('B')
+        self.size += len(view)
+        if self.buffer:
+            missing = self.block_size - len(self.buffer)
+            self.buffer += view[:missing]
+            view = view[missing:]
+            if len(self.buffer) < self.block_size:
+                return len(data)
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(view) >= self.block_size:
+            self.submit(view[:self.block_size])
+            view = view[self.block_size:]
+        self.buffer += view
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(gzip.compress, block, self.compresslevel, mtime=0))
+        while len(self.pending) > self.max_pending:
+            self.file.write(self.pending.popleft().result())
+
+    def tell(self):
+        # Position in the uncompressed data, like gzip.GzipFile
+        return self.size
+
+    def close(self):
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.file.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.file.close()
+
+
+def open_output(path, compresslevel=DEFAULT_COMPRESSLEVEL, threads=1):
+    # .nii.gz is compressed (by blocks on several threads if threads > 1), .nii is written as it is
+    if not path.endswith('.gz'):
+        return open(path, 'wb')
+    if threads > 1:
+        return BlockGzipFile(path, compresslevel, threads)
+    return gzip.open(path, 'wb', compresslevel=compresslevel)
+
+
+class NiftiSlabWriter:
+    """
+    Writes a NIfTI volume (.nii or .nii.gz) slab by slab along the z axis.
+    4D volumes are written frame by frame: all the slabs of the first frame, then of the second...
+    The slabs are cast to dtype, the data type of the file.
+    """
+
+    def __init__(self, path, shape, affine, dtype, compresslevel=DEFAULT_COMPRESSLEVEL, threads=1):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.header = make_header(self.shape, affine, self.dtype)
+        self.file = open_output(path, compresslevel, threads)
+        self.header.write_to(self.file)
+        # Padding up to the data
+        self.file.write(b'\x00' * (int(self.header.get_data_offset()) - self.file.tell()))
+        self.written = 0
+
+    def write(self, slab):
+        # Slab of shape (x, y, dz), the next one along z
+        self.file.write(np.asarray(slab, dtype=self.dtype).tobytes(order='F'))
+        self.written += np.prod(slab.shape)
+
+    def close(self):
+        self.file.close()
+        if self.written != np.prod(self.shape):
+            raise ValueError(f"{self.path}: {self.written} voxels written out of {np.prod(self.shape)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def save_nifti(data, affine, path, dtype=None, compresslevel=DEFAULT_COMPRESSLEVEL, threads=1):
+    """
+    Save an in-memory volume (3D or 4D) slab by slab, without building a Nifti1Image.
+    Only a slab is copied at a time to be cast and written in Fortran order.
+
+    Args:
+        data (np.ndarray): the volume
+        affine (np.ndarray): 4x4 affine
+        path (str): .nii or .nii.gz file
+        dtype: data type of the file, the one of data if None
+        compresslevel (int): gzip level of .nii.gz files
+        threads (int): number of threads compressing .nii.gz files
+    """
+    dtype = np.dtype(data.dtype if dtype is None else dtype)
+    shape = data.shape
+    depth = max(1, SLAB_BYTES // max(1, shape[0] * shape[1] * dtype.itemsize))
+    with NiftiSlabWriter(path, shape, affine, dtype, compresslevel, threads) as writer:
+        for frame in np.ndindex(*shape[3:]):
+            for z0 in range(0, shape[2], depth):
+                writer.write(data[(slice(None), slice(None), slice(z0, z0 + depth)) + frame])
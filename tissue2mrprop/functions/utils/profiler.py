@@ -0,0 +1,131 @@
+# Per-stage profiling of the conversion
+# Every stage of the pipeline (decompression, pixel check, mapping, texture, writing...) is wrapped
+# in profiler.stage(name), which records its wall time, CPU time and memory high-water mark.
+# Stages can be nested, a nested stage is named after its parents: "convert/map sus".
+import contextlib
+import cProfile
+import json
+import time
+import tracemalloc
+
+
+class StageProfiler:
+    """
+    Wall time, CPU time and peak memory of the stages of a conversion.
+
+    Args:
+        memory (bool): trace the memory peak of every stage (tracemalloc, NumPy arrays included)
+        cprofile (bool): run cProfile on the top level stages, to dump the slowest one
+    """
+
+    def __init__(self, memory=False, cprofile=False):
+        self.memory = memory
+        self.cprofile = cprofile
+        self.records = {}
+        self.profiles = {}
+        self.tracing = False
+        # Names and running memory peaks of the stages being run
+        self.names = []
+        self.peaks = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        path = "/".join(self.names + [name])
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak of the parent stage is kept before tracing the one of this stage
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.peaks.append(current)
+        # Only one cProfile can run at a time, nested stages are part of their parent's profile
+        profile = None
+        if self.cprofile and not self.names:
+            profile = self.profiles.setdefault(path, cProfile.Profile())
+        self.names.append(name)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.names.pop()
+            peak = None
+            if self.memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+            self.record(path, wall, cpu, peak)
+
+    def record(self, path, wall, cpu, peak):
+        # A stage run several times (e.g. once per slab) accumulates its times
+        record = self.records.setdefault(path, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_mb": None})
+        record["calls"] += 1
+        record["wall_s"] += wall
+        record["cpu_s"] += cpu
+        if peak is not None:
+            record["peak_mb"] = max(record["peak_mb"] or 0, peak / 2**20)
+
+    def stats(self):
+        """
+        Statistics of every stage, in the order the stages started.
+
+        Returns:
+            dict: stage -> {calls, wall_s, cpu_s, peak_mb}, peak_mb is None if memory is not traced
+        """
+        return {path: {"calls": record["calls"],
+                       "wall_s": round(record["wall_s"], 4),
+                       "cpu_s": round(record["cpu_s"], 4),
+                       "peak_mb": None if record["peak_mb"] is None else round(record["peak_mb"], 1)}
+                for path, record in self.records.items()}
+
+    def timings(self):
+        # Wall time of every stage
+        return {path: round(record["wall_s"], 3) for path, record in self.records.items()}
+
+    def slowest(self):
+        # Top level stage with the longest wall time
+        top = [path for path in self.records if "/" not in path]
+        return max(top, key=lambda path: self.records[path]["wall_s"]) if top else None
+
+    def dump_slowest(self, path):
+        """
+        Save the cProfile statistics of the slowest top level stage, to read with pstats or snakeviz.
+
+        Returns:
+            str: name of the stage, None if cProfile was not enabled
+        """
+        slowest = self.slowest()
+        if slowest not in self.profiles:
+            return None
+        self.profiles[slowest].dump_stats(path)
+        return slowest
+
+    def save(self, path, cprofile_path=None):
+        """
+        Save the statistics as JSON, and the cProfile dump of the slowest stage if cprofile_path is given.
+        """
+        report = {"slowest": self.slowest(), "stages": self.stats()}
+        if cprofile_path is not None:
+            report["cprofile"] = {"stage": self.dump_slowest(cprofile_path), "file": cprofile_path}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        return report
+
+    def close(self):
+        # Stop tracing the memory, if this profiler started it
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+
+def profile_stage(profiler, name):
+    # profiler.stage(name), or nothing if there is no profiler
+    return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
@@ -0,0 +1,82 @@
+# Shared mapping engine: label volume -> MR property volume
+# Instead of looking up a SegmentationLabel for every voxel, the label properties are compiled once
+# into a dense array indexed by label ID (a lookup table, LUT), and the whole volume is mapped with a
+# single NumPy gather.
+import numpy as np
+
+# Name of the SegmentationLabel attribute holding each property
+PROPERTY_ATTRS = {
+    "sus": "susceptibility",
+    "t2s": "T2star_val",
+    "pd": "PD_val",
+    "t1": "T1_val",
+    "t2": "T2_val",
+    "perm3T": "perm3T",
+    "cond3T": "cond3T",
+    "perm7T": "perm7T",
+    "cond7T": "cond7T",
+}
+
+# Value used when a label does not have the property defined (None)
+# Susceptibility falls back to the one of water, relaxation times to a tiny value to avoid divisions by 0
+# Perm & Cond are always defined when requested, a missing value is kept as NaN
+PROPERTY_FALLBACK = {
+    "sus": -9.05,
+    "t2s": 0.001,
+    "pd": 0,
+    "t1": 0,
+    "t2": 0.001,
+    "perm3T": np.nan,
+    "cond3T": np.nan,
+    "perm7T": np.nan,
+    "cond7T": np.nan,
+}
+
+# Types using the Permittivity & Conductivity values instead of relaxation values
+STATIC_TYPES = ["perm3T", "cond3T", "perm7T", "cond7T"]
+
+# What volume.check_pixels can do with pixels whose value is not in the look up table
+# Defined here so the CLI can offer them without importing nibabel
+PIXEL_POLICIES = ["fail", "zero", "map", "nearest"]
+
+
+# Number of voxels mapped at a time by map_labels
+CHUNK_SIZE = 1 << 22
+
+
+def map_labels(labels, lut, dtype=np.float32, out=None):
+    """
+    Map a label volume to property values with a gather, CHUNK_SIZE voxels at a time.
+
+    Args:
+        labels (np.ndarray): label volume, integer (any dtype) or integral floats
+        lut (np.ndarray): lookup table from LabelTable.lut
+        dtype: dtype of the returned volume
+        out (np.ndarray): optional volume to write into, same shape as labels
+
+    Returns:
+        np.ndarray with the same shape (and memory order) as labels
+    """
+    lut = np.asarray(lut, dtype=dtype)
+    if out is None:
+        order = "F" if labels.flags.f_contiguous and not labels.flags.c_contiguous else "C"
+        out = np.empty(labels.shape, dtype=dtype, order=order)
+
+    for order in "CF":
+        if labels.flags[order + "_CONTIGUOUS"] and out.flags[order + "_CONTIGUOUS"]:
+            # Mapping by chunks of the flattened volumes bounds the temporary index array
+            flat_labels = labels.reshape(-1, order=order)
+            flat_out = out.reshape(-1, order=order)
+            for start in range(0, flat_labels.size, CHUNK_SIZE):
+                np.take(lut, as_index(flat_labels[start:start + CHUNK_SIZE]), out=flat_out[start:start + CHUNK_SIZE])
+            return out
+
+    out[...] = np.take(lut, as_index(labels))
+    return out
+
+
+def as_index(labels):
+    # Integer labels can index the lookup table directly, floats need to be cast
+    if np.issubdtype(labels.dtype, np.integer):
+        return labels
+    return labels.astype(np.intp)
@@ -0,0 +1,189 @@
+# Provenance and run metadata for the json sidecar
+# The version, commit and remote of the converter are read once per process straight from the
+# .git folder of the source checkout (no gitpython, no subprocess) or, for an installed package, from
+# the metadata pip recorded at install time (direct_url.json).
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import tissue2mrprop
+
+PACKAGE_DIR = Path(tissue2mrprop.__file__).resolve().parent
+
+
+@lru_cache(maxsize=None)
+def provenance():
+    """
+    Version, commit and remote of the converter, resolved once per process.
+
+    Returns:
+        dict: version, commit and remote, commit and remote are None if they can't be found
+    """
+    info = {"version": tissue2mrprop.__version__, "commit": None, "remote": None}
+    # Only a checkout of the converter itself: a package installed in a virtualenv inside another
+    # repository must not report the commit of that repository
+    git_dir = find_git_dir(PACKAGE_DIR.parent)
+    if git_dir is None:
+        git_dir, info["commit"], info["remote"] = install_provenance()
+    if git_dir is not None:
+        info["commit"] = read_commit(git_dir)
+        info["remote"] = read_remote(git_dir)
+    return info
+
+
+def find_git_dir(root):
+    # .git folder of the repository whose top folder is root, None if root is not the top of a repository
+    git = root / ".git"
+    if git.is_dir():
+        return git
+    if git.is_file():
+        # Worktrees and submodules have a file pointing to the real folder
+        content = git.read_text().strip()
+        if content.startswith("gitdir:"):
+            return (root / content[len("gitdir:"):].strip()).resolve()
+    return None
+
+
+def common_dir(git_dir):
+    # Worktrees keep their HEAD but share the refs and config of the main repository
+    common = git_dir / "commondir"
+    if common.is_file():
+        return (git_dir / common.read_text().strip()).resolve()
+    return git_dir
+
+
+def read_commit(git_dir):
+    """
+    Commit hash of HEAD.
+
+    Args:
+        git_dir (Path): .git folder
+
+    Returns:
+        str: the commit hash, None if it can't be read
+    """
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref:"):
+            # Detached HEAD
+            return head
+        ref = head[len("ref:"):].strip()
+        for folder in [git_dir, common_dir(git_dir)]:
+            if (folder / ref).is_file():
+                return (folder / ref).read_text().strip()
+        packed = common_dir(git_dir) / "packed-refs"
+        if packed.is_file():
+            for line in packed.read_text().splitlines():
+                if line.endswith(" " + ref):
+                    return line.split()[0]
+    except OSError:
+        pass
+    return None
+
+
+def read_remote(git_dir, name="origin"):
+    """
+    URL of a remote, or of the first remote if there is no remote with that name.
+
+    Args:
+        git_dir (Path): .git folder
+        name (str): name of the remote
+
+    Returns:
+        str: the URL, None if the repository doesn't have remotes
+    """
+    try:
+        lines = (common_dir(git_dir) / "config").read_text().splitlines()
+    except OSError:
+        return None
+    urls = {}
+    section = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            section = line.strip("[]").split('"')
+            continue
+        if section and section[0].strip() == "remote" and len(section) > 1 and "=" in line:
+            key, value = line.split("=", 1)
+            if key.strip() == "url":
+                urls.setdefault(section[1], value.strip())
+    return urls.get(name, next(iter(urls.values()), None))
+
+
+def install_provenance():
+    # (source folder, commit, remote) recorded by pip when the package was installed
+    # from a git URL (vcs_info) or from a local folder (editable or not)
+    from importlib import metadata
+    try:
+        direct_url = json.loads(metadata.distribution("tissue2mrprop").read_text("direct_url.json") or "{}")
+    except (metadata.PackageNotFoundError, ValueError):
+        return None, None, None
+    url = direct_url.get("url")
+    if "vcs_info" in direct_url:
+        return None, direct_url["vcs_info"].get("commit_id"), url
+    if url and url.startswith("file://"):
+        return find_git_dir(Path(url[len("file://"):])), None, None
+    return None, None, url
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    sha256 of a file, read by chunks.
+
+    Args:
+        path (str): path of the file
+        chunk_size (int): number of bytes read at a time
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reset_peak_memory():
+    """
+    Starts a new peak of the resident memory, so that the peak read after a conversion is its own and not
+    the one of an earlier conversion of the same process (batch workers). Linux only (/proc/self/clear_refs).
+
+    Returns:
+        bool: True if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_mb(since_reset=False):
+    """
+    Peak resident memory in MB, None where it is not available (Windows).
+
+    Args:
+        since_reset (bool): peak since reset_peak_memory (VmHWM), else the peak of the whole process
+    """
+    if since_reset:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    if os.uname().sysname == "Darwin":
+        peak = peak / 1024
+    return round(peak / 1024, 1)
@@ -0,0 +1,82 @@
+# Reproducible random streams for textured phantoms
+# Every (property, label, z slice) triple has its own independent generator derived from the seed, so a
+# label gets exactly the same values whether the phantom is generated in one piece, in slabs along z
+# or in parallel by different workers, and the textures of different properties are independent.
+import numpy as np
+
+# Description of the stream layout written in the json sidecar
+STREAM_KEY = ["property", "label_id", "z_slice"]
+# Index of every property in the stream key, new properties must be appended to keep the streams
+STREAM_PROPERTIES = ["sus", "t2s", "pd", "t1", "t2", "perm3T", "cond3T", "perm7T", "cond7T", "M0"]
+
+
+def new_seed():
+    """
+    Draw a fresh seed from the OS entropy, to be recorded so the phantom can be reproduced.
+
+    Returns:
+        int: the seed
+    """
+    return np.random.SeedSequence().entropy
+
+
+def label_stream(seed, prop, label_id, z):
+    """
+    Independent generator of one property of one label in one z slice.
+
+    Args:
+        seed (int): seed of the phantom
+        prop (str): MR property, one of STREAM_PROPERTIES
+        label_id (int): label ID
+        z (int): index of the slice in the full volume
+
+    Returns:
+        np.random.Generator
+    """
+    key = (STREAM_PROPERTIES.index(prop), int(label_id), int(z))
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
+
+def draw_label_samples(voxels, shape, seed, prop, label_id, sample, z_offset=0):
+    """
+    Draw one sample for every voxel of a label, slice by slice from the streams of the label.
+
+    Args:
+        voxels (np.ndarray): flat (C-order) indices of the label voxels in the array of size shape
+        shape (tuple): shape of the array, the full volume or a slab of it along the last axis
+        seed (int): seed of the phantom
+        prop (str): MR property of the samples
+        label_id (int): label ID
+        sample (callable): sample(rng, n) returns n samples drawn from the generator rng
+        z_offset (int): index in the full volume of the first slice of the array
+
+    Returns:
+        np.ndarray: samples aligned with voxels
+    """
+    z = voxels % shape[-1] + z_offset
+    # Stable sort keeps the C-order of the voxels inside every slice,
+    # which is the same in the full volume and in any slab
+    order = np.argsort(z, kind="stable")
+    slices, counts = np.unique(z[order], return_counts=True)
+
+    samples = np.empty(len(voxels))
+    start = 0
+    for z_slice, count in zip(slices, counts):
+        samples[start:start + count] = sample(label_stream(seed, prop, label_id, z_slice), count)
+        start += count
+
+    aligned = np.empty_like(samples)
+    aligned[order] = samples
+    return aligned
+
+
+def stream_layout(seed):
+    """
+    Record of the seed and stream layout for the json sidecar.
+    """
+    return {
+        "seed": int(seed),
+        "bit_generator": "PCG64",
+        "stream_key": STREAM_KEY,
+        "properties": STREAM_PROPERTIES,
+    }
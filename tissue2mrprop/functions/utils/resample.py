@@ -0,0 +1,172 @@
+# Partial-volume resampling of phantoms to another grid (e.g. the grid of a field simulation)
+# Every target voxel gets the mean of the property over the source voxels it covers, which is the sum
+# of the value of every label weighted by the fraction of the target voxel it fills. The labels are
+# mapped to values slab by slab, so nothing of the size of the source volume is made in float.
+#   - Aligned grids (every target voxel is a block of f_x x f_y x f_z source voxels): block sums with
+#     np.add.reduceat, exact fractions
+#   - Any other grid (other voxel size, rotation, shift): every target voxel is supersampled with a
+#     regular grid of points, each point takes the label of the source voxel it falls in
+import itertools
+
+import numpy as np
+
+# Source voxels handled at a time (the float values of a slab are 8 bytes per voxel)
+SLAB_VOXELS = 1 << 23
+# Tolerance on the affines to consider two grids aligned
+ALIGN_TOLERANCE = 1e-4
+
+
+def voxel_sizes(affine):
+    # Length of the voxel along every axis, in mm
+    return np.sqrt((np.asarray(affine, dtype=np.float64)[:3, :3] ** 2).sum(axis=0))
+
+
+def voxel_size_grid(shape, affine, voxel_size):
+    """
+    Grid with another voxel size covering the same field of view.
+
+    Args:
+        shape (tuple): shape of the source grid
+        affine (np.ndarray): 4x4 affine of the source grid
+        voxel_size (float or sequence): voxel size of the target grid in mm, one value or one per axis
+
+    Returns:
+        (tuple, np.ndarray): shape and affine of the target grid
+    """
+    affine = np.asarray(affine, dtype=np.float64)
+    scale = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,)) / voxel_sizes(affine)
+    target = affine.copy()
+    target[:3, :3] = affine[:3, :3] * scale
+    # The first target voxel starts where the first source voxel starts, an integer scale gives aligned blocks
+    target[:3, 3] = affine[:3, :3] @ ((scale - 1) / 2) + affine[:3, 3]
+    shape = np.ceil(np.asarray(shape[:3], dtype=np.float64) / scale - ALIGN_TOLERANCE).astype(int)
+    return tuple(int(s) for s in np.maximum(shape, 1)), target
+
+
+def block_factors(affine, target_affine):
+    """
+    Size of the blocks of source voxels making a target voxel, if the grids are aligned.
+
+    Returns:
+        tuple: integer factor of every axis, None if a target voxel isn't a block of source voxels
+    """
+    # Target voxel coordinates -> source voxel coordinates
+    m = np.linalg.solve(np.asarray(affine, dtype=np.float64), np.asarray(target_affine, dtype=np.float64))
+    factors = np.rint(np.diag(m[:3, :3]))
+    if (factors < 1).any() or not np.allclose(m[:3, :3], np.diag(factors), atol=ALIGN_TOLERANCE):
+        return None
+    # The center of target voxel 0 is the center of the first block
+    if not np.allclose(m[:3, 3], (factors - 1) / 2, atol=ALIGN_TOLERANCE):
+        return None
+    return tuple(int(f) for f in factors)
+
+
+def resample(source, affine, target_shape, target_affine, values=None, dtype=np.float32, out=None, supersample=None):
+    """
+    Partial-volume resampling of a volume to a target grid.
+
+    Args:
+        source (np.ndarray): 3D source volume, labels or property values
+        affine (np.ndarray): 4x4 affine of the source
+        target_shape (tuple): shape of the target grid
+        target_affine (np.ndarray): 4x4 affine of the target grid
+        values (callable): values(slab) maps a slab of source to float values (e.g. a label look up table),
+            the source values are averaged as they are if None
+        dtype: dtype of the resampled volume
+        out (np.ndarray): optional volume of target_shape to write into
+        supersample (int): points per axis in every target voxel, forces the supersampling even on aligned
+            grids. By default aligned grids are block averaged and the others use the ratio of voxel sizes
+
+    Returns:
+        np.ndarray: the resampled volume, target voxels outside of the source are 0
+    """
+    target_shape = tuple(int(s) for s in target_shape[:3])
+    if out is None:
+        out = np.empty(target_shape, dtype=dtype)
+    if values is None:
+        values = lambda slab: np.asarray(slab, dtype=np.float64)
+    factors = block_factors(affine, target_affine) if supersample is None else None
+    if factors is not None:
+        return block_mean(source, factors, values, out)
+    return supersample_mean(source, affine, target_affine, values, out, supersample)
+
+
+def block_mean(source, factors, values, out):
+    # Mean of every block of factors source voxels, slab by slab of target slices
+    n = source.shape[:3]
+    t = out.shape
+    # Number of source voxels of every target voxel along every axis (0 outside of the source)
+    counts = [np.clip(n[a] - np.arange(t[a]) * factors[a], 0, factors[a]) for a in range(3)]
+    # Blocks inside the source along every axis
+    inside = [int(np.count_nonzero(c)) for c in counts]
+    out[...] = 0
+    if min(inside) == 0:
+        return out
+
+    depth = max(1, SLAB_VOXELS // (n[0] * n[1] * factors[2]))
+    for z0 in range(0, inside[2], depth):
+        z1 = min(z0 + depth, inside[2])
+        slab = values(source[:inside[0] * factors[0], :inside[1] * factors[1], z0 * factors[2]:z1 * factors[2]])
+        for axis in range(3):
+            slab = np.add.reduceat(slab, np.arange(0, slab.shape[axis], factors[axis]), axis=axis)
+        weights = counts[0][:inside[0], None, None] * counts[1][None, :inside[1], None] * counts[2][None, None, z0:z1]
+        out[:inside[0], :inside[1], z0:z1] = slab / weights
+    return out
+
+
+def supersample_mean(source, affine, target_affine, values, out, supersample=None):
+    # Mean of the values at a regular grid of points inside every target voxel, slab by slab of target slices
+    n = np.array(source.shape[:3])
+    t = out.shape
+    m = np.linalg.solve(np.asarray(affine, dtype=np.float64), np.asarray(target_affine, dtype=np.float64))
+    if supersample is None:
+        # About one point per source voxel covered
+        points = np.maximum(1, np.ceil(voxel_sizes(m) - ALIGN_TOLERANCE)).astype(int)
+    else:
+        points = np.full(3, int(supersample))
+    offsets = [(np.arange(p) + 0.5) / p - 0.5 for p in points]
+    i = np.arange(t[0], dtype=np.float64)[:, None, None]
+    j = np.arange(t[1], dtype=np.float64)[None, :, None]
+
+    depth = max(1, SLAB_VOXELS // (8 * t[0] * t[1]))
+    for z0 in range(0, t[2], depth):
+        z1 = min(z0 + depth, t[2])
+        k = np.arange(z0, z1, dtype=np.float64)[None, None, :]
+        sums = np.zeros((t[0], t[1], z1 - z0))
+        hits = np.zeros(sums.shape, dtype=np.int32)
+        for point in itertools.product(*offsets):
+            p = (i + point[0], j + point[1], k + point[2])
+            # Source voxel of the point
+            index = [np.rint(m[a, 0] * p[0] + m[a, 1] * p[1] + m[a, 2] * p[2] + m[a, 3]).astype(np.intp)
+                     for a in range(3)]
+            valid = np.ones(sums.shape, dtype=bool)
+            for a in range(3):
+                valid &= (index[a] >= 0) & (index[a] < n[a])
+                index[a] = np.broadcast_to(np.clip(index[a], 0, n[a] - 1), sums.shape)
+            sums += np.where(valid, values(source[tuple(index)]), 0)
+            hits += valid
+        out[..., z0:z1] = np.where(hits > 0, sums / np.maximum(hits, 1), 0)
+    return out
+
+
+def target_grid(shape, affine, reference=None, voxel_size=None):
+    """
+    Target grid from a reference image or a voxel size.
+
+    Args:
+        shape (tuple): shape of the source grid
+        affine (np.ndarray): 4x4 affine of the source grid
+        reference (str or nibabel image): image on the target grid
+        voxel_size (float or sequence): voxel size of the target grid in mm
+
+    Returns:
+        (tuple, np.ndarray): shape and affine of the target grid
+    """
+    if reference is not None:
+        if isinstance(reference, str):
+            import nibabel as nib
+            reference = nib.load(reference)
+        return tuple(int(s) for s in reference.shape[:3]), np.asarray(reference.affine, dtype=np.float64)
+    if voxel_size is not None:
+        return voxel_size_grid(shape, affine, voxel_size)
+    raise ValueError("Give a reference image or a voxel size")
@@ -4,337 +4,353 @@
 # I encourage to read her repo: https://github.com/evaalonsoortiz/Fourier-based-field-estimation
 
 # Important: When editing this lookup tables don't forget to edit the color map for itk and fsl
-def return_dict_labels(tool, version, new_chi=None):
+from functools import lru_cache
+from numbers import Real
+from types import MappingProxyType
 
-    if tool == "TotalSeg_CT":
+# Using total segmentator we use follow their list for 117 labels
+# and group them up based on their effect to the B0 map impact
+# link: https://github.com/wasserth/TotalSegmentator/blob/master/totalsegmentator/map_to_binary.py
 
-        # Using total segmentator we use follow their list for 117 labels
-        # and group them up based on their effect to the B0 map impact
-        # link: https://github.com/wasserth/TotalSegmentator/blob/master/totalsegmentator/map_to_binary.py
+# Baseline dictionary for Total Segmentator CT
+# id : name, susceptibility_value
 
-        # Baseline dictionary for Total Segmentator CT
-        # id : name, susceptibility_value
+TOTALSEG_CT = {
 
-        dicc= {
+    0: ("air", 0.35),
+    1: ("spleen",-9.05),
+    2: ("kidney",-9.05), # kidney_right
+    3: ("kidney",-9.05), # kidney_left
+    4: ("organ",-9.05), # gallbladder
+    5: ("liver",-9.05), # liver
+    6: ("organ",-9.05), # stomach
+    7: ("organ",-9.05), # pancreas
+    8: ("gland",-9.05), # adrenal gland left
+    9: ("gland",-9.05), # adrenal_gland_left
+    # Updated as of August 2025 (compare_fm + chi_opt)
+    10: ("lungs",-2.41), # lung_upper_lobe_left
+    11: ("lungs",-2.41), # lung_lower_lobe_left
+    12: ("lungs",-2.41), # lung_upper_lobe_right
+    13: ("lungs",-2.41), # lung_middle_lobe_right
+    14: ("lungs",-2.41), # lung_lower_lobe_right
+    15: ("esophagus", -9.05),
+    16: ("trachea", 0.2),
+    #
+    17: ("gland",-9.05), # thyroid_gland
+    18: ("organ",-9.05), # small_bowel
+    19: ("organ",-9.05), # duodenum
+    20: ("organ",-9.05), # colon
+    21: ("organ",-9.05), # urinary_bladder
+    22: ("organ",-9.05), # prostate
+    23: ("kidney",-9.05), # kidney_cyst_left
+    24: ("kidney",-9.05), # kidney_cyst_right
+    25: ("v_bone",-9.7), # sacrum
+    26: ("v_bone",-9.7), #vertebrae_S1
+    27: ("v_bone",-9.7), # vertebrae_L5
+    28: ("v_bone",-9.7), # vertebrae_L4
+    29: ("v_bone",-9.7), # vertebrae_L3
+    30: ("v_bone",-9.7), # vertebrae_L2
+    31: ("v_bone",-9.7), # vertebrae_L1
+    32: ("v_bone",-9.7), # vertebrae_T12
+    33: ("v_bone",-9.7), # vertebrae_T11
+    34: ("v_bone",-9.7), # vertebrae_T10
+    35: ("v_bone",-9.7), # vertebrae_T9
+    36: ("v_bone",-9.7), # vertebrae_T8
+    37: ("v_bone",-9.7), # vertebrae_T7
+    38: ("v_bone",-9.7), # vertebrae_T6
+    39: ("v_bone",-9.7), #vertebrae_T5
+    40: ("v_bone",-9.7), # vertebrae_T4
+    41: ("v_bone",-9.7), #vertebrae_T3
+    42: ("v_bone",-9.7), # vertebrae_T2
+    43: ("v_bone",-9.7), # vertebrae_T1
+    44: ("v_bone",-9.7), # vertebrae_C7
+    45: ("v_bone",-9.7), # vertebrae_C6
+    46: ("v_bone",-9.7), # vertebrae_C5
+    47: ("v_bone",-9.7), # vertebrae_C4
+    48: ("v_bone",-9.7), # vertebrae_C3
+    49: ("v_bone",-9.7), # vertebrae_C2
+    50: ("v_bone",-9.7), # vertebrae_C1
+    51: ("heart",-9.05), # heart
+    52: ("extra",-9.05), # aorta
+    53: ("extra",-9.04), # pulmonary_vein
+    54: ("extra",-9.04), # brachiocephalic_trunk
+    55: ("extra",-9.04), # subclavian_artery_right
+    56: ("extra",-9.04), # subclavian_artery_left
+    57: ("extra",-9.04), # common_carotid_artery_right
+    58: ("extra",-9.04), # common_carotid_artery_left
+    59: ("extra",-9.04), # brachiocephalic_vein_left
+    60: ("extra",-9.04), # brachiocephalic_vein_right
+    61: ("extra",-9.04), # atrial_appendage_left
+    62: ("extra",-9.04), # superior_vena_cava
+    63: ("extra",-9.04), # inferior_vena_cava
+    64: ("extra",-9.04), # portal_vein_and_splenic_vein
+    65: ("extra",-9.04), # iliac_artery_left
+    66: ("extra",-9.04), # iliac_artery_right
+    67: ("extra",-9.04), # iliac_vena_left
+    68: ("extra",-9.04), # iliac_vena_right
+    69: ("bone",-11.1), # humerus_left
+    70: ("bone",-11.1), # humerus_right
+    71: ("bone",-11.1), # scapula_left
+    72: ("bone",-11.1), # scapula_right
+    73: ("bone",-11.1), # clavicula_left
+    74: ("bone",-11.1), # clavicula_right
+    75: ("bone",-11.1), # femur_left
+    76: ("bone",-11.1), # femur_right
+    77: ("bone",-11.1), # hip_left
+    78: ("bone",-11.1), # hip_right
+    79: ("SpinalCanal",-9.055), # Spinal Canal (from Total Seg)
+    80: ("muscle",-9.03), # gluteus_maximus_left
+    81: ("muscle",-9.03), # gluteus_maximus_right
+    82: ("muscle",-9.03), # gluteus_medius_left
+    83: ("muscle",-9.03), # gluteus_medius_right
+    84: ("muscle",-9.03), # gluteus_minimus_left
+    85: ("muscle",-9.03), # gluteus_minimus_right
+    86: ("muscle",-9.03), # autochthon_left
+    87: ("muscle",-9.03), # autochthon_right
+    88: ("muscle",-9.03), # iliopsoas_left
+    89: ("muscle",-9.03), # iliopsoas_right
+    90: ("brain",-9.05), # brain
+    91: ("bone",-11.1), # skull
+    92: ("bone",-11.1), # rib_left_1
+    93: ("bone",-11.1), # rib_left_2
+    94: ("bone",-11.1), # rib_left_3
+    95: ("bone",-11.1), # rib_left_4
+    96: ("bone",-11.1), # rib_left_5
+    97: ("bone",-11.1), # rib_left_6
+    98: ("bone",-11.1), # rib_left_7
+    99: ("bone",-11.1), # rib_left_8
+    100: ("bone",-11.1), # rib_left_9
+    101: ("bone",-11.1), # rib_left_10
+    102: ("bone",-11.1), # rib_left_11
+    103: ("bone",-11.1), # rib_left_12
+    104: ("bone",-11.1), # rib_right_1
+    105: ("bone",-11.1), # rib_right_2
+    106: ("bone",-11.1), # rib_right_3
+    107: ("bone",-11.1), # rib_right_4
+    108: ("bone",-11.1), # rib_right_5
+    109: ("bone",-11.1), # rib_right_6
+    110: ("bone",-11.1), # rib_right_7
+    111: ("bone",-11.1), # rib_right_8
+    112: ("bone",-11.1), # rib_right_9
+    113: ("bone",-11.1), # rib_right_10
+    114: ("bone",-11.1), # rib_right_11
+    115: ("bone",-11.1), # rib_right_12
+    116: ("bone",-11.1), # sternum
+    117: ("cartilage",-9.055) # costal_cartilages
+}
 
-            0: ("air", 0.35),
-            1: ("spleen",-9.05),
-            2: ("kidney",-9.05), # kidney_right
-            3: ("kidney",-9.05), # kidney_left
-            4: ("organ",-9.05), # gallbladder
-            5: ("liver",-9.05), # liver
-            6: ("organ",-9.05), # stomach
-            7: ("organ",-9.05), # pancreas
-            8: ("gland",-9.05), # adrenal gland left
-            9: ("gland",-9.05), # adrenal_gland_left
-            # Updated as of August 2025 (compare_fm + chi_opt)
-            10: ("lungs",-2.41), # lung_upper_lobe_left
-            11: ("lungs",-2.41), # lung_lower_lobe_left
-            12: ("lungs",-2.41), # lung_upper_lobe_right
-            13: ("lungs",-2.41), # lung_middle_lobe_right
-            14: ("lungs",-2.41), # lung_lower_lobe_right
-            15: ("esophagus", -9.05),
-            16: ("trachea", 0.2),
-            #
-            17: ("gland",-9.05), # thyroid_gland
-            18: ("organ",-9.05), # small_bowel
-            19: ("organ",-9.05), # duodenum
-            20: ("organ",-9.05), # colon
-            21: ("organ",-9.05), # urinary_bladder
-            22: ("organ",-9.05), # prostate
-            23: ("kidney",-9.05), # kidney_cyst_left
-            24: ("kidney",-9.05), # kidney_cyst_right
-            25: ("v_bone",-9.7), # sacrum
-            26: ("v_bone",-9.7), #vertebrae_S1
-            27: ("v_bone",-9.7), # vertebrae_L5
-            28: ("v_bone",-9.7), # vertebrae_L4
-            29: ("v_bone",-9.7), # vertebrae_L3
-            30: ("v_bone",-9.7), # vertebrae_L2
-            31: ("v_bone",-9.7), # vertebrae_L1
-            32: ("v_bone",-9.7), # vertebrae_T12
-            33: ("v_bone",-9.7), # vertebrae_T11
-            34: ("v_bone",-9.7), # vertebrae_T10
-            35: ("v_bone",-9.7), # vertebrae_T9
-            36: ("v_bone",-9.7), # vertebrae_T8
-            37: ("v_bone",-9.7), # vertebrae_T7
-            38: ("v_bone",-9.7), # vertebrae_T6
-            39: ("v_bone",-9.7), #vertebrae_T5
-            40: ("v_bone",-9.7), # vertebrae_T4
-            41: ("v_bone",-9.7), #vertebrae_T3
-            42: ("v_bone",-9.7), # vertebrae_T2
-            43: ("v_bone",-9.7), # vertebrae_T1
-            44: ("v_bone",-9.7), # vertebrae_C7
-            45: ("v_bone",-9.7), # vertebrae_C6
-            46: ("v_bone",-9.7), # vertebrae_C5
-            47: ("v_bone",-9.7), # vertebrae_C4
-            48: ("v_bone",-9.7), # vertebrae_C3
-            49: ("v_bone",-9.7), # vertebrae_C2
-            50: ("v_bone",-9.7), # vertebrae_C1
-            51: ("heart",-9.05), # heart
-            52: ("extra",-9.05), # aorta
-            53: ("extra",-9.04), # pulmonary_vein
-            54: ("extra",-9.04), # brachiocephalic_trunk
-            55: ("extra",-9.04), # subclavian_artery_right
-            56: ("extra",-9.04), # subclavian_artery_left
-            57: ("extra",-9.04), # common_carotid_artery_right
-            58: ("extra",-9.04), # common_carotid_artery_left
-            59: ("extra",-9.04), # brachiocephalic_vein_left
-            60: ("extra",-9.04), # brachiocephalic_vein_right
-            61: ("extra",-9.04), # atrial_appendage_left
-            62: ("extra",-9.04), # superior_vena_cava
-            63: ("extra",-9.04), # inferior_vena_cava
-            64: ("extra",-9.04), # portal_vein_and_splenic_vein
-            65: ("extra",-9.04), # iliac_artery_left
-            66: ("extra",-9.04), # iliac_artery_right
-            67: ("extra",-9.04), # iliac_vena_left
-            68: ("extra",-9.04), # iliac_vena_right
-            69: ("bone",-11.1), # humerus_left
-            70: ("bone",-11.1), # humerus_right
-            71: ("bone",-11.1), # scapula_left
-            72: ("bone",-11.1), # scapula_right
-            73: ("bone",-11.1), # clavicula_left
-            74: ("bone",-11.1), # clavicula_right
-            75: ("bone",-11.1), # femur_left
-            76: ("bone",-11.1), # femur_right
-            77: ("bone",-11.1), # hip_left
-            78: ("bone",-11.1), # hip_right
-            79: ("SpinalCanal",-9.055), # Spinal Canal (from Total Seg)
-            80: ("muscle",-9.03), # gluteus_maximus_left
-            81: ("muscle",-9.03), # gluteus_maximus_right
-            82: ("muscle",-9.03), # gluteus_medius_left
-            83: ("muscle",-9.03), # gluteus_medius_right
-            84: ("muscle",-9.03), # gluteus_minimus_left
-            85: ("muscle",-9.03), # gluteus_minimus_right
-            86: ("muscle",-9.03), # autochthon_left
-            87: ("muscle",-9.03), # autochthon_right
-            88: ("muscle",-9.03), # iliopsoas_left
-            89: ("muscle",-9.03), # iliopsoas_right
-            90: ("brain",-9.05), # brain
-            91: ("bone",-11.1), # skull
-            92: ("bone",-11.1), # rib_left_1
-            93: ("bone",-11.1), # rib_left_2
-            94: ("bone",-11.1), # rib_left_3
-            95: ("bone",-11.1), # rib_left_4
-            96: ("bone",-11.1), # rib_left_5
-            97: ("bone",-11.1), # rib_left_6
-            98: ("bone",-11.1), # rib_left_7
-            99: ("bone",-11.1), # rib_left_8
-            100: ("bone",-11.1), # rib_left_9
-            101: ("bone",-11.1), # rib_left_10
-            102: ("bone",-11.1), # rib_left_11
-            103: ("bone",-11.1), # rib_left_12
-            104: ("bone",-11.1), # rib_right_1
-            105: ("bone",-11.1), # rib_right_2
-            106: ("bone",-11.1), # rib_right_3
-            107: ("bone",-11.1), # rib_right_4
-            108: ("bone",-11.1), # rib_right_5
-            109: ("bone",-11.1), # rib_right_6
-            110: ("bone",-11.1), # rib_right_7
-            111: ("bone",-11.1), # rib_right_8
-            112: ("bone",-11.1), # rib_right_9
-            113: ("bone",-11.1), # rib_right_10
-            114: ("bone",-11.1), # rib_right_11
-            115: ("bone",-11.1), # rib_right_12
-            116: ("bone",-11.1), # sternum
-            117: ("cartilage",-9.055) # costal_cartilages
-        }
+TOTALSEG_MRI = {
+    0: ("air", 0.35),
+    1: ("spleen", -9.05),
+    2: ("kidney", -9.05),  # kidney_right
+    3: ("kidney", -9.05),  # kidney_left
+    4: ("organ", -9.05),  # gallbladder
+    5: ("liver", -9.05),  # liver
+    6: ("organ", -9.05),  # stomach
+    7: ("organ", -9.05),  # pancreas
+    8: ("gland", -9.05),  # adrenal_gland_right
+    9: ("gland", -9.05),  # adrenal_gland_left
+    10: ("lungs", 0.2),  # lung_left
+    11: ("lungs", 0.2),  # lung_right
+    12: ("esophagus", -9.05),  # esophagus
+    13: ("organ", -9.05),  # small_bowel
+    14: ("organ", -9.05),  # duodenum
+    15: ("organ", -9.05),  # colon
+    16: ("organ", -9.05),  # urinary_bladder
+    17: ("organ", -9.05),  # prostate
+    18: ("bone", -9),  # sacrum
+    19: ("bone", -9),  # vertebrae
+    20: ("bone", -9),  # intervertebral_discs
+    21: ("spinal_cord", -9.055),  # spinal_cord
+    22: ("heart", -9.04),  # heart
+    23: ("extra", -9.04),  # aorta
+    24: ("extra", -9.04),  # inferior_vena_cava
+    25: ("extra", -9.04),  # portal_vein_and_splenic_vein
+    26: ("extra", -9.04),  # iliac_artery_left
+    27: ("extra", -9.04),  # iliac_artery_right
+    28: ("extra", -9.04),  # iliac_vena_left
+    29: ("extra", -9.04),  # iliac_vena_right
+    30: ("bone", -9),  # humerus_left
+    31: ("bone", -9),  # humerus_right
+    32: ("bone", -9),  # fibula
+    33: ("bone", -9),  # tibia
+    34: ("bone", -9),  # femur_left
+    35: ("bone", -9),  # femur_right
+    36: ("bone", -9),  # hip_left
+    37: ("bone", -9),  # hip_right
+    38: ("extra", -9.04),  # gluteus_maximus_left
+    39: ("extra", -9.04),  # gluteus_maximus_right
+    40: ("extra", -9.04),  # gluteus_medius_left
+    41: ("extra", -9.04),  # gluteus_medius_right
+    42: ("extra", -9.04),  # gluteus_minimus_left
+    43: ("extra", -9.04),  # gluteus_minimus_right
+    44: ("extra", -9.04),  # autochthon_left
+    45: ("extra", -9.04),  # autochthon_right
+    46: ("extra", -9.04),  # iliopsoas_left
+    47: ("extra", -9.04),  # iliopsoas_right
+    48: ("extra", -9.04),  # quadriceps_femoris_left
+    49: ("extra", -9.04),  # quadriceps_femoris_right
+    50: ("extra", -9.04),  # thigh_medial_compartment_left
+    51: ("extra", -9.04),  # thigh_medial_compartment_right
+    52: ("extra", -9.04),  # thigh_posterior_compartment_left
+    53: ("extra", -9.04),  # thigh_posterior_compartment_right
+    54: ("extra", -9.04),  # sartorius_left
+    55: ("extra", -9.04),  # sartorius_right
+    56: ("brain", -9.04)  # brain
+}
 
-        if version == "v2":
-            return dicc
+CHARLES = {
 
-        if version =="mod0":
-            # This means it has labels + fat = Whole body
-            dicc[264]=("fat",-8.92)
-            return dicc
+    0: ("air", 0.35),  # background
+    1: ("water", -9.05),  # body
+    2: ("air", 0.35),  # sinus
+    3: ("air", 0.35),  # ear_canal
+    4: ("trachea", 0.2),  # trachea
+    5: ("lung", 0.2),  # lung_left
+    6: ("lung", 0.2),  # lung_right
+    7: ("bone", -11.5),  # skull
+    8: ("water", -9.05),  # eyes
+    9: ("bone", -11.5),  # vertebrates
+    10: ("cartilage", -9.055),  # discs
+}
 
-        if version =="mod1":
-            # This means its Whole body + Spinal Cord CSF to differentiate Spinal Canal
-            # from spinal cord
-            dicc[264]=("fat",-8.92)
-            dicc[256]=("spinal_cord",-9.055)
-            dicc[289]=("sc_csf",-9.05)
-            return dicc
+# This project aims to simulate only 3 different tissue types
+# Bones, soft tisssue and air
+#
+# Some values were changed for ISMRM abstract. More precise values may be implemented later
+COMPARE_FM = {
+    0: ("air", 0.35), # Outside of the body
+    2: ("fat", -9.05), # Water and muscle surrounding the labels ## Before -9.032
+    3: ("bone", -11), # Spine
+    5: ("inter_vert_discs", -9.05),
+    7: ("lungs", -4.2), # magical air inside lungs and esophagus
+    8: ("trachea", -4.2), # Air in the trachea
+    10: ("organ", -9.05), # Susceptibility of water
+    12: ("muscle", -9.05), # Muscle has slightly different value than water
+    15: ("sinus", -2),
+    23: ("brain", -9.04),  # Brain from Samseg
+    25: ("skull", -11),  # Skull from Samseg with manual correction in Slicer
+    256: ("spinal_cord",-9.055), # Soft tissue for this project
+    289:("sc_csf,",-9.055) # Same as 256 for this project, might change later
+}
 
-        if version=="mod2":
-            # This means it has CSF + Spinal Cord + WM/GM segmentation instead of Spina Canal
-            dicc[264]=("fat",-8.92)
-            #dicc[256] = ("spinal_cord", -9.055)
-            # If labels are done correctly, spinalcord (as well as spinal canal #79)
-            # should not be really appearing and not needed to state values for them
-            # hence my comment on previous line.
-            dicc[289] = ("sc_csf", -9.05)
+COMPARE_FM_PAM50 = {
+    0 : ("air", 0.35), # Air surrounding the body
+    2 : ("fat", -9.05), # Water and muscle surrounding the labels
+    3 : ("bone", -11), #
+    5 : ("inter_vert_discs", -9.055),
+    7 : ("lungs", -4.2), # magical air inside lungs and esophagus
+    8 : ("trachea", -4.2), # Air in the trachea
+    10 : ("organ", -9.05), # Susceptibility of water
+    12: ("muscle", -9.05), # Muscle has slightly different value than water
+    15 : ("sinus", -2), # Air in the sinuses and ear canal
+    256: ("spinal cord",-9.05) # Soft tissue for this project
+}
 
-            dicc[196] = ("sc_wm", -9.083)
-            dicc[324] = ("sc_gm", -9.03)
-            # Future implementation
-            # Currently manually segmentating resampled registered CT image
-            # to get WM/GM segmentation masks
-            return dicc
+COMPARE_FM_DS005616 = {
+    0: ("air", 0.35),  # Air surrounding the body
+    1: ("fat", -9.05),
+    2: ("sinus", -2),
+    3: ("sinus",-2),
+    4: ("trachea",-2.3),
+    5: ("lungs",-2.3),
+    6: ("lungs",-2.3),
+    56: ("brain",-9.04),
+    60: ("eyes",-9.05),
+    91: ("skull",-11),
+    92: ("bone",-11),
+    93: ("inter_vert_discs",-9.055),
+    100:("spinal_cord",-9.05)
 
-    if tool == 'TotalSeg_MRI':
+}
 
-        dicc = {
-            0: ("air", 0.35),
-            1: ("spleen", -9.05),
-            2: ("kidney", -9.05),  # kidney_right
-            3: ("kidney", -9.05),  # kidney_left
-            4: ("organ", -9.05),  # gallbladder
-            5: ("liver", -9.05),  # liver
-            6: ("organ", -9.05),  # stomach
-            7: ("organ", -9.05),  # pancreas
-            8: ("gland", -9.05),  # adrenal_gland_right
-            9: ("gland", -9.05),  # adrenal_gland_left
-            10: ("lungs", 0.2),  # lung_left
-            11: ("lungs", 0.2),  # lung_right
-            12: ("esophagus", -9.05),  # esophagus
-            13: ("organ", -9.05),  # small_bowel
-            14: ("organ", -9.05),  # duodenum
-            15: ("organ", -9.05),  # colon
-            16: ("organ", -9.05),  # urinary_bladder
-            17: ("organ", -9.05),  # prostate
-            18: ("bone", -9),  # sacrum
-            19: ("bone", -9),  # vertebrae
-            20: ("bone", -9),  # intervertebral_discs
-            21: ("spinal_cord", -9.055),  # spinal_cord
-            22: ("heart", -9.04),  # heart
-            23: ("extra", -9.04),  # aorta
-            24: ("extra", -9.04),  # inferior_vena_cava
-            25: ("extra", -9.04),  # portal_vein_and_splenic_vein
-            26: ("extra", -9.04),  # iliac_artery_left
-            27: ("extra", -9.04),  # iliac_artery_right
-            28: ("extra", -9.04),  # iliac_vena_left
-            29: ("extra", -9.04),  # iliac_vena_right
-            30: ("bone", -9),  # humerus_left
-            31: ("bone", -9),  # humerus_right
-            32: ("bone", -9),  # fibula
-            33: ("bone", -9),  # tibia
-            34: ("bone", -9),  # femur_left
-            35: ("bone", -9),  # femur_right
-            36: ("bone", -9),  # hip_left
-            37: ("bone", -9),  # hip_right
-            38: ("extra", -9.04),  # gluteus_maximus_left
-            39: ("extra", -9.04),  # gluteus_maximus_right
-            40: ("extra", -9.04),  # gluteus_medius_left
-            41: ("extra", -9.04),  # gluteus_medius_right
-            42: ("extra", -9.04),  # gluteus_minimus_left
-            43: ("extra", -9.04),  # gluteus_minimus_right
-            44: ("extra", -9.04),  # autochthon_left
-            45: ("extra", -9.04),  # autochthon_right
-            46: ("extra", -9.04),  # iliopsoas_left
-            47: ("extra", -9.04),  # iliopsoas_right
-            48: ("extra", -9.04),  # quadriceps_femoris_left
-            49: ("extra", -9.04),  # quadriceps_femoris_right
-            50: ("extra", -9.04),  # thigh_medial_compartment_left
-            51: ("extra", -9.04),  # thigh_medial_compartment_right
-            52: ("extra", -9.04),  # thigh_posterior_compartment_left
-            53: ("extra", -9.04),  # thigh_posterior_compartment_right
-            54: ("extra", -9.04),  # sartorius_left
-            55: ("extra", -9.04),  # sartorius_right
-            56: ("brain", -9.04)  # brain
-        }
+# Every version of a tool is a base table plus an overlay of the labels it adds or changes
+# A None susceptibility in an overlay is replaced by new_chi (dynamic versions)
+TOOL_VERSIONS = {
+    "TotalSeg_CT": {
+        "v2": (TOTALSEG_CT, {}),
+        # This means it has labels + fat = Whole body
+        "mod0": (TOTALSEG_CT, {264: ("fat", -8.92)}),
+        # This means its Whole body + Spinal Cord CSF to differentiate Spinal Canal
+        # from spinal cord
+        "mod1": (TOTALSEG_CT, {264: ("fat", -8.92), 256: ("spinal_cord", -9.055), 289: ("sc_csf", -9.05)}),
+        # This means it has CSF + Spinal Cord + WM/GM segmentation instead of Spina Canal
+        # If labels are done correctly, spinalcord (as well as spinal canal #79)
+        # should not be really appearing and not needed to state values for them
+        # Currently manually segmentating resampled registered CT image
+        # to get WM/GM segmentation masks
+        "mod2": (TOTALSEG_CT, {264: ("fat", -8.92), 289: ("sc_csf", -9.05),
+                               196: ("sc_wm", -9.083), 324: ("sc_gm", -9.03)}),
+    },
+    "TotalSeg_MRI": {
+        "v1": (TOTALSEG_MRI, {}),
+        # Adding similar to CT case
+        # Adds labels with "head"
+        "mod0": (TOTALSEG_MRI, {145: ("head", -8.97), 169: ("torso", -8.97), 101: ("bone", -9)}),
+    },
+    "charles": {
+        "v1": (CHARLES, {}),
+    },
+    "compare_fm": {
+        "mod0": (COMPARE_FM, {}),
+        # This is for dynamically changing the susceptiblity values
+        # Only changing the value of air in lungs and trachea
+        "dyn": (COMPARE_FM, {7: ("lungs", None), 8: ("trachea", None)}),
+        "mod_PAM50": (COMPARE_FM_PAM50, {}),
+        "ds005616": (COMPARE_FM_DS005616, {}),
+    },
+}
 
-        if version == 'v1':
-            return dicc
 
-        if version == 'mod0':
-            # Adding similar to CT case
-            # Adds labels with "head"
-            dicc[145] = ("head", -8.97)
-            dicc[169] = ("torso",-8.97)
-            dicc[101] = ('bone', -9)
-            return dicc
+def check_tool(tool, version):
+    # Raises an error listing the valid choices if the tool or the version doesn't exist
+    if tool not in TOOL_VERSIONS:
+        raise ValueError(f"Segmentation tool {tool} hasn't been implemented yet, choose from: {list(TOOL_VERSIONS)}")
+    if version not in TOOL_VERSIONS[tool]:
+        raise ValueError(f"Version {version} not available for {tool}, choose from: {list(TOOL_VERSIONS[tool])}")
 
-    if tool == 'ProCord_MRI':
-        pass
 
-    if tool == "charles":
 
-        dicc = {
+def dynamic_labels(tool, version):
+    # IDs of the labels whose susceptibility is new_chi (None in the overlay), e.g. lungs and trachea of compare_fm dyn
+    check_tool(tool, version)
+    return sorted(label_id for label_id, (_, chi) in TOOL_VERSIONS[tool][version][1].items() if chi is None)
 
-            0: ("air", 0.35),  # background
-            1: ("water", -9.05),  # body
-            2: ("air", 0.35),  # sinus
-            3: ("air", 0.35),  # ear_canal
-            4: ("trachea", 0.2),  # trachea
-            5: ("lung", 0.2),  # lung_left
-            6: ("lung", 0.2),  # lung_right
-            7: ("bone", -11.5),  # skull
-            8: ("water", -9.05),  # eyes
-            9: ("bone", -11.5),  # vertebrates
-            10: ("cartilage", -9.055),  # discs
-        }
-        if version == 'v1':
-            return dicc
 
-    if tool == "compare_fm":
-        # This project aims to simulate only 3 different tissue types
-        # Bones, soft tisssue and air
-        #
-        # Some values were changed for ISMRM abstract. More precise values may be implemented later
-        dicc = {
-            0: ("air", 0.35), # Outside of the body
-            2: ("fat", -9.05), # Water and muscle surrounding the labels ## Before -9.032
-            3: ("bone", -11), # Spine
-            5: ("inter_vert_discs", -9.05),
-            7: ("lungs", -4.2), # magical air inside lungs and esophagus
-            8: ("trachea", -4.2), # Air in the trachea
-            10: ("organ", -9.05), # Susceptibility of water
-            12: ("muscle", -9.05), # Muscle has slightly different value than water
-            15: ("sinus", -2),
-            23: ("brain", -9.04),  # Brain from Samseg
-            25: ("skull", -11),  # Skull from Samseg with manual correction in Slicer
-            256: ("spinal_cord",-9.055), # Soft tissue for this project
-            289:("sc_csf,",-9.055) # Same as 256 for this project, might change later
-        }
-        if version == 'mod0':
-            return dicc
+@lru_cache(maxsize=128)
+def compile_labels(tool, version, new_chi=None):
+    """
+    Compile the look up table of a tool and version, once per process.
 
-        if version == "dyn":
-            # This is for dynamically changing the susceptiblity values
-            # Only changing the value of air in lungs and trachea
+    Args:
+        tool (str): segmentation tool, one of TOOL_VERSIONS keys
+        version (str): version of the tool
+        new_chi (float): susceptibility of the labels changed by dynamic versions
 
-            lst1 = list(dicc[7])
-            lst2 = list(dicc[8])
-            lst1[1] = new_chi
-            lst2[1] = new_chi
-            dicc[7] = tuple(lst1)
-            dicc[8] = tuple(lst2)
-            print("Changing susceptibility of air to: ", new_chi)
-            return dicc
+    Returns:
+        MappingProxyType: read-only dictionary id: (name, susceptibility)
+    """
+    check_tool(tool, version)
+    base, overlay = TOOL_VERSIONS[tool][version]
+    look_up = dict(base)
+    for label_id, (name, chi) in overlay.items():
+        look_up[label_id] = (name, new_chi if chi is None else chi)
 
-        if version == 'mod_PAM50':
-            dicc2 = {
-            0 : ("air", 0.35), # Air surrounding the body
-            2 : ("fat", -9.05), # Water and muscle surrounding the labels
-            3 : ("bone", -11), #
-            5 : ("inter_vert_discs", -9.055),
-            7 : ("lungs", -4.2), # magical air inside lungs and esophagus
-            8 : ("trachea", -4.2), # Air in the trachea
-            10 : ("organ", -9.05), # Susceptibility of water
-            12: ("muscle", -9.05), # Muscle has slightly different value than water
-            15 : ("sinus", -2), # Air in the sinuses and ear canal
-            256: ("spinal cord",-9.05) # Soft tissue for this project
-            }
-            return dicc2
+    for label_id, (name, chi) in look_up.items():
+        if not isinstance(label_id, int) or label_id < 0:
+            raise ValueError(f"{tool} {version}: label ID {label_id} must be a non negative integer")
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"{tool} {version}: label {label_id} doesn't have a name")
+        if not (chi is None or isinstance(chi, Real)):
+            raise ValueError(f"{tool} {version}: susceptibility of label {label_id} must be a number, not {chi}")
 
-        if version == 'ds005616':
-            dicc3 = {
-                0: ("air", 0.35),  # Air surrounding the body
-                1: ("fat", -9.05),
-                2: ("sinus", -2),
-                3: ("sinus",-2),
-                4: ("trachea",-2.3),
-                5: ("lungs",-2.3),
-                6: ("lungs",-2.3),
-                56: ("brain",-9.04),
-                60: ("eyes",-9.05),
-                91: ("skull",-11),
-                92: ("bone",-11),
-                93: ("inter_vert_discs",-9.055),
-                100:("spinal_cord",-9.05)
+    return MappingProxyType(look_up)
 
-            }
-            return dicc3
 
-    else:
-        print("This tool hasn't been implemented yet.")
+def return_dict_labels(tool, version, new_chi=None, verbose=True):
+    # Dictionary id: (name, susceptibility) of the tool and version
+    # The table is compiled once, every call returns a copy that can be modified
+    look_up = compile_labels(tool, version, new_chi)
+    if verbose and tool == "compare_fm" and version == "dyn":
+        print("Changing susceptibility of air to: ", new_chi)
+    return dict(look_up)
@@ -1,7 +1,4 @@
-import numpy as np
-import nibabel as nib
-import argparse
-import scipy
+import os
 
 def is_nifti(filepath):
     """
@@ -19,5 +16,60 @@ def is_nifti(filepath):
         return False
 
 
+def split_ext(filepath):
+    """
+    Split a NIfTI filepath into its base and its extension.
+
+    Args:
+        filepath (str): The path of the file, ending in .nii or .nii.gz
+
+    Returns:
+        tuple: (base, extension), e.g. ('output/sus_dist', '.nii.gz')
+    """
+    if filepath.endswith('.nii.gz'):
+        return filepath[:-7], '.nii.gz'
+    if filepath.endswith('.nii'):
+        return filepath[:-4], '.nii'
+    return os.path.splitext(filepath)
 
 
+def add_suffix(filepath, suffix):
+    """
+    Add a suffix to a filepath before its extension, e.g. sus_dist.nii.gz -> sus_dist_t1.nii.gz
+
+    Args:
+        filepath (str): The path of the file
+        suffix (str): The suffix to add
+
+    Returns:
+        str: The new filepath
+    """
+    base, extension = split_ext(filepath)
+    return base + suffix + extension
+
+
+def parse_values(text):
+    """
+    Parse a list or a range of numbers, e.g. for a sweep of the susceptibility of air.
+
+    Args:
+        text (str): a number (-2.4), a list (-2.4,-2.2,-2.0) or a range start:stop:step (-3:-2:0.25),
+            the stop is included when it falls on the grid
+
+    Returns:
+        list: the values as floats
+
+    Raises:
+        ValueError: not a number, or no value at all (e.g. ",")
+    """
+    text = text.strip()
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        if step == 0 or (stop - start) * step < 0:
+            raise ValueError(f"Range {text} is empty, use start:stop:step")
+        count = int(round((stop - start) / step, 9)) + 1
+        return [round(start + i * step, 12) for i in range(count)]
+    values = [float(v) for v in text.replace(";", ",").split(",") if v.strip()]
+    if not values:
+        raise ValueError(f"No value in '{text}', give a number, a list or a range start:stop:step")
+    return values
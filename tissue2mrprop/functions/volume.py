@@ -1,26 +1,94 @@
 #Dependencies
 import numpy as np
-from tissue2mrprop.functions.label import SegmentationLabel
-import nibabel as nib
-from tissue2mrprop.functions.utils.get_dic_values import to_csv_sus
+from tissue2mrprop.functions.label import LabelTable, label_values, RELAX_VALUES, STATIC_VALUES_SHORT
+from tissue2mrprop.functions.utils.get_dic_values import to_csv_sus, to_csv_relax, to_csv_stats, to_json_stats
 import os
-from tissue2mrprop.functions.utils.select_tool import return_dict_labels
+from functools import lru_cache
+from tissue2mrprop.functions.utils.select_tool import return_dict_labels, dynamic_labels
+from tissue2mrprop.functions.utils.property_map import map_labels, PIXEL_POLICIES, STATIC_TYPES
+from tissue2mrprop.functions.utils.utils import split_ext, add_suffix
+from tissue2mrprop.functions.utils.random_streams import new_seed, draw_label_samples
+from tissue2mrprop.functions.utils.profiler import profile_stage
+from tissue2mrprop.functions.utils.nifti_io import save_nifti, NiftiSlabWriter, DEFAULT_COMPRESSLEVEL
+from tissue2mrprop.functions.utils.label_index import LabelIndex, label_counts
+from tissue2mrprop.functions.utils.label_stats import label_statistics, voxel_volume
+from tissue2mrprop.functions.utils.resample import resample
+from tissue2mrprop.functions.utils.crop import crop_box, crop_affine, uncrop
 #from skimage.measure import label, regionprops
 
+def bad_pixel_report(labels, bad_coords, offset=(0, 0, 0)):
+    # Count and bounding box of every wrong pixel value at bad_coords
+    # offset is added to the coordinates, for labels that are a slab of the volume
+    # Returns a dictionary value: (count, bbox_min, bbox_max)
+    bad_pixels = labels[bad_coords]
+    values, inverse, counts = np.unique(bad_pixels, return_inverse=True, return_counts=True)
+    coords = np.stack(bad_coords, axis=1) + np.asarray(offset)
+    bbox_min = np.full((len(values), coords.shape[1]), np.iinfo(np.intp).max)
+    bbox_max = np.full((len(values), coords.shape[1]), -1)
+    np.minimum.at(bbox_min, inverse, coords)
+    np.maximum.at(bbox_max, inverse, coords)
+
+    return {value: (int(count), tuple(int(c) for c in lo), tuple(int(c) for c in hi))
+            for value, count, lo, hi in zip(values.tolist(), counts, bbox_min, bbox_max)}
+
+
+@lru_cache(maxsize=128)
+def label_table(tool, version, static=False, new_chi=None):
+    # Label table of a tool and version, made once per process
+    # The table is immutable so all the volumes can share it
+    return LabelTable.from_look_up(return_dict_labels(tool, version, new_chi=new_chi, verbose=False), static=static)
+
+
+# Attribute holding the volume of every type and its default file name
+# The static types share static_vol and are saved as [type].nii.gz
+PROPERTY_OUTPUTS = {
+    "sus": ("sus_dist", "sus_dist.nii.gz"),
+    "t1": ("t1_vol", "t1_dist.nii.gz"),
+    "t2": ("t2_vol", "t2_map.nii.gz"),
+    "t2s": ("t2star_vol", "t2_star.nii.gz"),
+    "pd": ("pd_dist", "pd_dist.nii.gz"),
+}
+
+
+def property_output(type):
+    # (attribute, default file name) of the volume of a type
+    if type in STATIC_TYPES:
+        return "static_vol", type + ".nii.gz"
+    return PROPERTY_OUTPUTS[type]
+
+
 # Parent class for the creation of a non-finite biomechanical model of the body
 class volume:
     
-    def __init__(self, volume):
+    def __init__(self, volume, dtype=np.float32, load=True, profiler=None, verbose=True, output_dir="output"):
         # Tool and version as input arguments
 
         # In this version we correct that the output should be the nifti image
         # This way we can attribute the information from nifti files to the class
 
         self.nifti = volume # This points to a Nifti file
-        self.volume = self.nifti.get_fdata()
-        self.dimensions = np.array(self.volume.shape) # It is initially a tuple, but it needs to be an array
-        self.uniq_labels = np.unique(self.volume)
+        # StageProfiler timing the stages of the conversion, None to not profile
+        self.profiler = profiler
+        # Labels are read in the dtype they are stored with (no float64 copy),
+        # uncompressed files are memory-mapped by nibabel
+        # With load=False the labels are not read, to be streamed slab by slab (see functions/stream.py)
+        with self.stage("decompress"):
+            self.volume = np.asanyarray(self.nifti.dataobj) if load else None
+        # dtype of the property volumes created
+        self.dtype = np.dtype(dtype)
+        # gzip level and number of compression threads of the .nii.gz outputs
+        self.compresslevel = DEFAULT_COMPRESSLEVEL
+        self.threads = 1
+        self.dimensions = np.array(self.nifti.shape) # It is initially a tuple, but it needs to be an array
+        with self.stage("unique labels"):
+            self.uniq_labels = np.unique(self.volume) if load else None
+        # Voxels of every label, built the first time a label is looked up (see label_index)
+        self._label_index = None
+        # (npz file, segmentation file) to reuse the index between runs, see use_label_index
+        self.label_index_file = None
         self.segmentation_labels = {}
+        # Array-backed table of the label properties, made by group_seg_labels
+        self.label_table = None
         self.sus_dist = None
         self.t2star_vol = None
         self.pd_dist = None
@@ -47,16 +115,17 @@ class volume:
         self.label_gaussians = {}
         self.unique_counts = {}
         self.gauss_flag = 0
+        # Seed of the Gaussian texture, drawn from the OS entropy if not set
+        self.seed = None
 
         self.gaussian_phantom = None
+        self.multi_vol = None
 
-        # Creating folders for the code
-        if not os.path.exists("output"):
-            os.makedirs('output')
-        if not os.path.exists('simulation'):
-            os.makedirs('simulation')
-        if not os.path.exists("data"):
-            os.makedirs("data")
+        # The volume doesn't touch the disk until something is saved: the folder of the outputs
+        # is created by the first save, so the volume can be used in memory (see tissue2mrprop/api.py)
+        self.output_dir = output_dir
+        # Prints the progress of the conversion, False to run silently
+        self.verbose = verbose
 
         self.magnitude = None
         self.phase = None
@@ -65,61 +134,171 @@ class volume:
 
         # For the fieldmap comparison project:
         self.new_chi = None
+        # Reference susceptibility subtracted from the susceptibility of every voxel (-r)
+        self.ref = 0
+        # Labels saved by check_pixels after correcting them, None if the input was used as it is
+        self.corrected_path = None
+        # (shape, affine) of the grid the properties are resampled to, None to keep the grid of the labels
+        self.grid = None
+        # Slices of the box the labels are cropped to (see crop), and if the outputs are put back into the full grid
+        self.crop_box = None
+        self.crop_pad = False
+        # Types stacked in multi_vol
+        self.multi_types = []
+
+    def crop(self, keep=None, margin=0, pad=False):
+        # Converts only the bounding box of the labels of keep (every label but 0 if None) plus margin voxels
+        # The outputs are written on the box with the affine translated to its first voxel, or put back into
+        # the grid of the input with pad (the voxels outside of the box take the value of the background)
+        # Returns the box, None if no voxel has a label of keep (the volume is left as it is)
+        with self.stage("crop"):
+            box = crop_box(self.volume, keep, margin=margin)
+            if box is None:
+                return None
+            # A copy of the box only, the labels of the whole field of view are freed
+            self.volume = self.volume[box].copy(order="K")
+        self.crop_box = box
+        self.crop_pad = pad
+        self.dimensions = np.array(self.volume.shape)
+        self.uniq_labels = np.unique(self.volume)
+        # The saved index is the one of the whole input
+        self._label_index = None
+        self.label_index_file = None
+        return box
+
+    @property
+    def label_affine(self):
+        # Affine of the labels converted, translated to the first voxel of the crop box
+        return self.nifti.affine if self.crop_box is None else crop_affine(self.nifti.affine, self.crop_box)
+
+    def uncropped(self, data, fill=0):
+        # Cropped volume put back into the grid of the input with crop_pad, the volume as it is otherwise
+        if self.crop_box is None or not self.crop_pad or self.grid is not None:
+            return data
+        return uncrop(data, self.crop_box, self.nifti.shape, fill)
+
+    def background_value(self, type):
+        # Value of the background label (0) for a type, the value outside of the crop box
+        lut = self.property_lut(type)
+        return 0.0 if np.isnan(lut[0]) else float(lut[0])
+
+    def set_grid(self, shape, affine):
+        # The properties are made on another grid (e.g. the one of a field simulation): every voxel gets
+        # the mean of the property over the labels it covers, see utils/resample.py
+        self.grid = (tuple(int(s) for s in shape[:3]), np.asarray(affine, dtype=np.float64))
+
+    @property
+    def output_shape(self):
+        # Shape of the property volumes
+        return self.grid[0] if self.grid is not None else tuple(self.dimensions[:3])
+
+    @property
+    def output_affine(self):
+        # Affine of the property volumes
+        if self.grid is not None:
+            return self.grid[1]
+        return self.nifti.affine if self.crop_pad else self.label_affine
+
+    @property
+    def label_index(self):
+        # LabelIndex of the labels: per label masks, counts and writes cost the size of the label
+        if self._label_index is None:
+            with self.stage("label index"):
+                index = self.load_label_index()
+                if index is None:
+                    index = LabelIndex.from_volume(self.volume)
+                    self.save_label_index(index)
+                self._label_index = index
+        return self._label_index
+
+    @property
+    def texture_index(self):
+        # Index used to find the voxels of the textured labels: the full index is only worth building
+        # when it is already there or saved for the next runs (use_label_index), else the few textured
+        # labels are found by scanning the volume
+        if self._label_index is not None or self.label_index_file is not None:
+            return self.label_index
+        return None
+
+    def release_label_index(self):
+        # The index holds 4 bytes per voxel, it is built again if a label is looked up later
+        self._label_index = None
+
+    def use_label_index(self, path, source):
+        # The label index is loaded from path if it was made from the file source as it is now,
+        # else it is saved there once built, for the next runs
+        # Nothing is read or built until a label is looked up
+        self.label_index_file = (path, source)
+
+    def load_label_index(self):
+        if self.label_index_file is None:
+            return None
+        index = LabelIndex.load(*self.label_index_file)
+        if index is None or index.shape != tuple(self.volume.shape):
+            return None
+        self.log("Label index loaded from ", self.label_index_file[0])
+        return index
+
+    def save_label_index(self, index):
+        if self.label_index_file is None:
+            return
+        path, source = self.label_index_file
+        try:
+            index.save(path, source)
+            self.log("Label index saved to ", path)
+        except OSError as e:
+            self.log("Could not save the label index: ", e)
 
     def group_seg_labels(self, tool, version, type, ref):
+        # type can be a single type or a list of types, the labels are grouped once for all of them
+        types = [type] if isinstance(type, str) else list(type)
+        # Static names are needed if any of the types is Perm or Cond
+        name_type = next((t for t in types if t in STATIC_TYPES), types[0])
         #self.look_up = return_dict_labels(tool,version)
         # For the fieldmap comparison project
         if tool == "compare_fm" and version == "dyn":
             # If the version is dynamic
             # The new value will replace None
             # We can check just in case
-            self.look_up = return_dict_labels(tool,version, new_chi = self.new_chi)
+            new_chi = self.new_chi
         else:
-            self.look_up = return_dict_labels(tool,version)
-
-        # Function to get the relaxation values from label
-        for i in self.look_up.keys():
-            self.segmentation_labels[i] = SegmentationLabel(i)
-
-        for key, value in self.look_up.items():
-            # Key is the number of ID and value is (name, sus)
-            name = value[0]
-            sus = value[1]
-
-            if ref != 0:
-                new_sus = sus - ref
-                self.set_label_susceptibility(key, new_sus)
-
-            self.set_label_name(key, name, type)
-            self.set_label_susceptibility(key, sus)
-
-            if type == "sus":
-                print(name, " Chi:", sus)
-            if type == "pd":
-                print(name, " PD:", self.segmentation_labels[key].PD_val)
-            if type == "t2s":
-                print(name, " T2s:", self.segmentation_labels[key].T2star_val)
-            if type == "t1":
-                print(name, " T1:", self.segmentation_labels[key].T1_val)
-            if type == "t2":
-                print(name, " T2:", self.segmentation_labels[key].T2_val)
-            if type == "perm3T":
-                print(name, " Permittivity@3T:", self.segmentation_labels[key].perm3T)
-            if type == "cond3T":
-                print(name, " Conductivity @3T:", self.segmentation_labels[key].cond3T)
-            if type == "perm7T":
-                print(name, " Permittivity @7T:", self.segmentation_labels[key].perm7T)
-            if type == "cond7T":
-                print(name, " Permittivity @7T:", self.segmentation_labels[key].cond7T)
-
-        # Getting the relax values dictionary from any label
-        self.relax_values = self.segmentation_labels[0].relax_values
-        self.static_vals = self.segmentation_labels[0].static_values_short
+            new_chi = None
+        self.look_up = return_dict_labels(tool, version, new_chi=new_chi, verbose=self.verbose)
+        # The reference is a single offset of the susceptibility look up table, see property_lut
+        self.ref = ref
+
+        # Table with the properties of all the labels, key is the number of ID and value is (name, sus)
+        self.label_table = label_table(tool, version, static=name_type in STATIC_TYPES, new_chi=new_chi)
+        self.segmentation_labels = self.label_table.labels()
+
+        for key, (name, sus) in self.look_up.items():
+            for type in types:
+                if type == "sus":
+                    self.log(name, " Chi:", sus)
+                if type == "pd":
+                    self.log(name, " PD:", self.segmentation_labels[key].PD_val)
+                if type == "t2s":
+                    self.log(name, " T2s:", self.segmentation_labels[key].T2star_val)
+                if type == "t1":
+                    self.log(name, " T1:", self.segmentation_labels[key].T1_val)
+                if type == "t2":
+                    self.log(name, " T2:", self.segmentation_labels[key].T2_val)
+                if type == "perm3T":
+                    self.log(name, " Permittivity@3T:", self.segmentation_labels[key].perm3T)
+                if type == "cond3T":
+                    self.log(name, " Conductivity @3T:", self.segmentation_labels[key].cond3T)
+                if type == "perm7T":
+                    self.log(name, " Permittivity @7T:", self.segmentation_labels[key].perm7T)
+                if type == "cond7T":
+                    self.log(name, " Permittivity @7T:", self.segmentation_labels[key].cond7T)
+
+        self.relax_values = RELAX_VALUES
+        self.static_vals = STATIC_VALUES_SHORT
 
     def check_labels(self):
         for i in self.uniq_labels:
             if self.segmentation_labels[i].name == None:
-                print("Label: ",self.segmentation_labels[i]["name"]," doesn't have name assigned")
+                self.log("Label: ",self.segmentation_labels[i]["name"]," doesn't have name assigned")
 
     def set_label_name(self, label_id, name, type):
         '''
@@ -128,434 +307,409 @@ class volume:
         '''
         ids = self.look_up.keys()
         if label_id in ids:
-            if type == "perm3T" or type == "cond3T" or type == "perm7T" or type == "cond7T":
-                self.segmentation_labels[label_id].set_static_name(name)
-
-            self.segmentation_labels[label_id].set_name(name)
+            values = label_values(name, static=type in STATIC_TYPES)
+            del values["susceptibility"]
+            self.update_label(label_id, name=name, **values)
         else:
-            print(f"Label ID {label_id} not found, check version selected")
+            self.log(f"Label ID {label_id} not found, check version selected")
             exit()
 
     def set_label_susceptibility(self, label_id, susceptibility):
         ids = self.look_up.keys()
         if label_id in ids:
-            self.segmentation_labels[label_id].set_susceptibility(susceptibility)
+            self.update_label(label_id, susceptibility=susceptibility)
         else:
-            print(f"Label ID {label_id} not found.")
+            self.log(f"Label ID {label_id} not found.")
             exit()
     def set_T1(self, label_id, t1):
         ids = self.look_up.keys()
         if label_id in ids:
-            self.segmentation_labels[label_id].set_t2star_val(t1)
+            self.update_label(label_id, T1_val=t1)
         else:
-            print(f"Label ID {label_id} not found.")
+            self.log(f"Label ID {label_id} not found.")
             exit()
     def set_label_pd(self,label_id,pd):
         ids = self.look_up.keys()
         if label_id in ids:
-            self.segmentation_labels[label_id].set_pd_val(pd)
-        else: print(f"Label ID {label_id} not found.")
+            self.update_label(label_id, PD_val=pd)
+        else: self.log(f"Label ID {label_id} not found.")
 
     def set_T2star(self, label_id, t2star):
         ids = self.look_up.keys()
         if label_id in ids:
-            self.segmentation_labels[label_id].set_t2star_val(t2star)
+            self.update_label(label_id, T2star_val=t2star)
         else:
-            print(f"Label ID {label_id} not found.")
+            self.log(f"Label ID {label_id} not found.")
 
     def manual_label(self,id,name,sus):
         if id in self.uniq_labels:
-            label = self.segmentation_labels[id]
-            label.name = name
-            label.sus = sus
+            self.update_label(id, name=name, susceptibility=sus)
+
+    def update_label(self, label_id, **values):
+        # The label table is immutable, a new one is made with the new values of the label
+        self.label_table = self.label_table.replace(label_id, **values)
+        self.segmentation_labels[label_id] = self.label_table.label(label_id)
 
     def show_labels(self):
         for i in self.segmentation_labels:
             label = self.segmentation_labels[i]
-            print(label) # Calling __str__ from label
+            self.log(label) # Calling __str__ from label
 
     def create_type_vol(self, type, output_name="default"):
         # This function is for the CLI app
-        # Depending on the type we automatically call the specific function
         # Piece-wise mode: on :P
-        if type == 'sus':
-            self.create_sus_dist()
-            self.save_sus_dist_nii(output_name)
-        if type == 't2s':
-            self.create_t2_star_vol()
-            self.save_t2star_dist(output_name)
-        if type == 'pd':
-            self.create_pd_vol()
-            self.save_pd_dist(output_name)
-        if type == 't1':
-            self.create_t1_vol()
-            self.save_t1_dist(output_name)
-        if type == 't2':
-            print("T2 volume comming soon!")
-
-        if type == 'perm3T' or type == 'cond3T' or type == 'perm7T' or type == 'cond7T':
-            self.create_static_vol(type)
-            self.save_static_vol(type, output_name)
-
-
-
-    def check_pixels(self,input_name):
-        # Important to before going to conversion
-        # If there is a pixel that is outside of range conversion won't work
-        # because it won't be treated as a label but as a float
-        flag = 0  # Flag to save in case there were changes
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i, j, k]
-
-                    if pixel not in self.look_up.keys():
-
-                        flag = 1
-                        print(f"Pixel with wrong value: {pixel} located at {i,j,k}")
-                        print("(indexed from [0,0,0])")
-                        rem = str(input("Do you want to delete the pixel? [Y] [n]: "))
-                        print("[Y] continues checking pixels, [n] lets you edit it")
-
-                        if rem == "n":
-                            print("Maybe you want to change the value?")
-                            rem2 = int(input("Choose the value: "))
-
-                            if rem2 in self.segmentation_labels:
-                                print("Changed value to: ", rem2)
-                                self.volume[i, j, k] = rem2
+        # The volume is freed once written, so converting several types holds one volume at a time
+        self.create_property(type)
+        with self.stage("save " + type):
+            self.save_property(type, output_name, release=True)
+
+    def create_property(self, type):
+        # Piece-wise volume of any type, kept in its attribute (sus_dist, t1_vol...)
+        attr = property_output(type)[0]
+        # The previous volume is freed before mapping the new one
+        setattr(self, attr, None)
+        setattr(self, attr, self.map_property(type))
+        return getattr(self, attr)
+
+    def save_property(self, type, fn="default", release=False):
+        # Single writer of every type: saves the Gaussian phantom with gauss_flag, the piece-wise volume otherwise
+        # The array is written as it is (no Nifti1Image copy), release frees it once written
+        attr, default_fn = property_output(type)
+        data = self.gaussian_phantom if self.gauss_flag else getattr(self, attr)
+        if data is None:
+            raise ValueError(f"No {type} volume to save, create it first")
+        if fn == "default":
+            fn = default_fn
+        if self.gauss_flag:
+            fn = "gauss_" + fn
+        fill = self.background_value(type) if self.crop_pad else 0
+        self.write_nifti(data, os.path.join(self.output_dir, fn), fill=fill)
+        del data
+        if release:
+            self.release(type)
+
+    def release(self, type):
+        # Frees the volumes of a type
+        setattr(self, property_output(type)[0], None)
+        self.gaussian_phantom = None
 
-                            else:
-                                print("Number not in look up table")
-                                return 1
+    def create_multi_vol(self, types):
+        # All the types are created from the same label array and stacked on the 4th dimension
+        # The index of every type in the 4th dimension is the same as in types
+        # Every type is mapped (and textured) in place in its frame, without a temporary volume
+        self.multi_vol = None
+        self.multi_vol = np.empty(self.output_shape + (len(types),), dtype=self.dtype, order="F")
+        self.multi_types = list(types)
+        for i, type in enumerate(types):
+            if self.gauss_flag:
+                self.create_gauss_sc_dist(type, out=self.multi_vol[..., i])
+                self.gaussian_phantom = None
+            else:
+                self.map_property(type, out=self.multi_vol[..., i])
 
-                        if rem == "Y" or rem == "y":
-                            self.volume[i, j, k] = 0
+        return self.multi_vol
 
+    def save_multi_vol(self, fn="default", release=False):
+        # Method to save the 4D volume created with create_multi_vol
+        if fn == "default":
+            fn = 'multi_dist.nii.gz'
+        if self.gauss_flag:
+            fn = "gauss_" + fn
+        path = os.path.join(self.output_dir, fn)
+        fill = [self.background_value(type) for type in self.multi_types] if self.crop_pad else 0
+        with self.stage("save 4D"):
+            self.write_nifti(self.multi_vol, path, fill=fill)
+        if release:
+            self.multi_vol = None
+
+
+
+    def save_chi_sweep(self, tool, version, chis, fn, layout="4d"):
+        # Susceptibility phantoms of a dynamic version (compare_fm dyn) for every chi of chis,
+        # as a 4D series (one frame per chi) or one file per chi
+        # Only the labels taking new_chi (lungs, trachea) change: the phantom is made once (with the texture
+        # if gauss_flag) and only their voxels are rewritten for every chi
+        # Returns frame -> chi with the 4D layout, file name -> chi otherwise
+        if self.grid is not None:
+            raise ValueError("The chi sweep rewrites the voxels of the labels, it can't be resampled to another grid")
+        if self.gauss_flag:
+            self.create_gauss_sc_dist("sus")
+            phantom = self.gaussian_phantom
         else:
+            phantom = self.map_property("sus")
+        voxels = self.label_index.select(dynamic_labels(tool, version))
+        prefix = "gauss_" if self.gauss_flag else ""
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        outputs = {}
+        writer = None
+        if layout == "4d":
+            shape = tuple(self.nifti.shape[:3]) if self.crop_pad else tuple(self.dimensions[:3])
+            writer = NiftiSlabWriter(os.path.join(self.output_dir, prefix + fn), shape + (len(chis),),
+                                     self.output_affine, self.dtype, self.compresslevel, self.threads)
+        fill = self.background_value("sus") if self.crop_pad else 0
+        with self.stage("chi sweep"):
+            for i, chi in enumerate(chis):
+                phantom.flat[voxels] = chi - self.ref
+                if writer is not None:
+                    # The frames are written one after the other, the series is never held in memory
+                    writer.write(self.uncropped(phantom, fill))
+                    outputs[i] = chi
+                else:
+                    out_fn = prefix + add_suffix(fn, f"_chi{chi:g}")
+                    self.write_nifti(phantom, os.path.join(self.output_dir, out_fn), fill=fill)
+                    outputs[out_fn] = chi
+        if writer is not None:
+            writer.close()
+        self.gaussian_phantom = None
+        return outputs
+
+    def property_lut(self, prop):
+        # Compiles the property of every label into a lookup table (label_id -> value)
+        unknown = [l for l in self.uniq_labels if l not in self.label_table] if self.volume is not None else []
+        if unknown:
+            raise KeyError(f"Labels {unknown} not found in look up table, check pixel integrity first")
+
+        lut, missing = self.label_table.lut(prop)
+        if prop == "sus" and self.ref:
+            # Demodulating by the reference shifts every voxel by the same constant
+            lut = lut - self.ref
+        if prop == "t1":
+            for label_id in missing:
+                self.log("Label: ", self.segmentation_labels[label_id].name, " does not have T1 value")
+
+        return lut
+
+    def map_property(self, prop, out=None):
+        # Maps the whole volume at once through the lookup table instead of looping through every voxel
+        # out is an optional volume to map into (e.g. a frame of the 4D volume)
+        with self.stage("map " + prop):
+            lut = self.property_lut(prop)
+            if self.grid is not None:
+                # Mapped slab by slab and averaged over every voxel of the grid
+                return resample(self.volume, self.label_affine, *self.grid,
+                                values=lambda labels: map_labels(labels, lut, dtype=np.float64), dtype=self.dtype, out=out)
+            return map_labels(self.volume, lut, dtype=self.dtype, out=out)
+
+    def log(self, *args):
+        # print, only in verbose mode
+        if self.verbose:
+            print(*args)
+
+    def write_nifti(self, data, path, dtype=None, affine=None, fill=0):
+        # Saves a volume with the affine of the properties (of the segmentation, its crop box, or the grid),
+        # in self.dtype unless dtype is given
+        # A cropped property is put back into the grid of the input with crop_pad, fill is the value outside of the box
+        # Written slab by slab: no Nifti1Image copy, .nii files are not compressed
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if affine is None:
+            data = self.uncropped(data, fill)
+        save_nifti(data, self.output_affine if affine is None else affine, path,
+                   dtype=self.dtype if dtype is None else dtype, compresslevel=self.compresslevel, threads=self.threads)
+
+    def stage(self, name):
+        # Times a stage of the conversion with the profiler of the volume, if any
+        return profile_stage(self.profiler, name)
+
+    def check_pixels(self, input_name, policy="fail", map_label=None, save=True):
+        # Important to before going to conversion
+        # If there is a pixel that is outside of range conversion won't work
+        # because it won't be treated as a label but as a float
+        # All the pixels are checked at once and the policy decides what to do with the wrong ones:
+        #   fail: report and stop the conversion
+        #   zero: set the wrong pixels to 0 (air)
+        #   map: set the wrong pixels to the label map_label
+        #   nearest: set the wrong pixels to the label of the nearest correct pixel
+        # The corrected labels are saved as [input]corrected_pixels.nii.gz unless save is False
+        if policy not in PIXEL_POLICIES:
+            raise ValueError(f"Unknown pixel policy {policy}, choose from: {PIXEL_POLICIES}")
+
+        bad_values = [l for l in self.uniq_labels if l not in self.look_up]
+        if not bad_values:
+            self.log("Input has correct pixel integrity!")
+            return 0
+
+        # Only the voxels of the wrong labels are visited
+        bad_coords = self.label_index.coords(bad_values)
+        report = self.bad_pixel_report(bad_coords)
+        for value, (count, bbox_min, bbox_max) in report.items():
+            self.log(f"Pixel with wrong value: {value} found {count} times between {bbox_min} and {bbox_max}")
+        self.log("(indexed from [0,0,0])")
+
+        if policy == "fail":
+            self.log("Use a pixel policy (zero, map or nearest) to correct them")
+            return 1
+
+        if policy == "zero":
+            self.volume[bad_coords] = 0
+
+        if policy == "map":
+            if map_label not in self.look_up:
+                self.log(f"Label {map_label} not in look up table")
+                return 1
+            self.volume[bad_coords] = map_label
+
+        if policy == "nearest":
+            if len(bad_coords[0]) == self.volume.size:
+                self.log("No correct pixel to take the label from")
+                return 1
+            # The nearest correct pixel of any wrong pixel is always inside the bounding box
+            # of the wrong pixels padded by 1, so the distance transform only runs there
+            box = tuple(slice(max(c.min() - 1, 0), c.max() + 2) for c in bad_coords)
+            bad_mask = np.zeros(self.volume[box].shape, dtype=bool)
+            bad_mask[tuple(c - b.start for c, b in zip(bad_coords, box))] = True
+            from scipy.ndimage import distance_transform_edt
+            nearest = distance_transform_edt(bad_mask, return_distances=False, return_indices=True)
+            sub_volume = self.volume[box]
+            sub_bad = np.nonzero(bad_mask)
+            sub_volume[sub_bad] = sub_volume[tuple(ind[sub_bad] for ind in nearest)]
+            del bad_mask
+
+        self.log(f"Changed {len(bad_coords[0])} pixels using the {policy} policy")
+        self.uniq_labels = np.unique(self.volume)
+        # The labels changed, the index is built again when needed (the saved one is of the input)
+        self._label_index = None
+        self.label_index_file = None
+
+        if not save:
+            return 0
+        self.log("Saving corrected volume for later usage!")
+        base_name, extension = split_ext(os.path.basename(input_name))
+        out_name = base_name + "corrected_pixels" + extension
+        path = os.path.join(self.output_dir, out_name)
+        self.write_nifti(self.volume, path, dtype=self.volume.dtype, affine=self.label_affine)
+        self.corrected_path = path
+        del path
+        return 0
 
-            if flag == 1:
-
-                print("Saving corrected volume for later usage!")
-                tmp_img = nib.Nifti1Image(self.volume, affine = self.nifti.affine)
-                if input_name.endswith(".nii.gz"):  # Maybe code for .nii later (not urgent)
-                    base_name = input_name[:-7]  # Remove the `.nii.gz`
-                    extension = ".nii.gz"
-                out_name = base_name + "corrected_pixels.nii.gz"
-                path = os.path.join('output', out_name)
-                nib.save(tmp_img,path)
-                del tmp_img
-                del path
-                return 0
-
-            else:
-                print("Input has correct pixel integrity!")
-                return 0
+    def bad_pixel_report(self, bad_coords):
+        # Count and bounding box of every wrong pixel value
+        # Returns a dictionary value: (count, bbox_min, bbox_max)
+        return bad_pixel_report(self.volume, bad_coords)
 
     def create_sus_dist(self):
         # Code for create a susceptibility distribution volume
-        # Using the label class
-        self.sus_dist = np.zeros(self.dimensions)
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i,j,k]
-
-                    label = self.segmentation_labels[pixel]
-                    suscep = label.susceptibility
-
-                    if suscep == None:
-                        # THis means the label is not defined
-                        # The only not defined labels are organs
-                        # We can consider the suscp of water
-                        self.sus_dist[i,j,k] = -9.05
-                    else:
-                        self.sus_dist[i,j,k] = suscep
+        # Labels without susceptibility defined are considered as water (-9.05)
+        self.sus_dist = self.map_property("sus")
 
         return self.sus_dist
 
     def save_sus_dist_nii(self, fn):
         # Method to save the susceptibility distribution created to nifti
-        if self.gauss_flag:
-            temp_img = nib.Nifti1Image(self.gaussian_phantom, affine=self.nifti.affine)
-            g_str = "gauss"
-        else:
-            temp_img = nib.Nifti1Image(self.sus_dist, affine=self.nifti.affine)
-
-        if fn == "default":
-            fn = 'sus_dist.nii.gz'
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            # Conditioning if gauss flag is active, if not. We use the susceptibility np array
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        else:
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-
-        del temp_img
-        del path
+        self.save_property("sus", fn)
 
     def create_static_vol(self, type):
-
-        self.static_vol = np.zeros(self.dimensions)
-        # Recall the type will tell us what index to take from the perm&cond dictionary
-
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i,j,k]
-
-                    label = self.segmentation_labels[pixel]
-
-                    if type == "perm3T":
-                        stat = label.perm3T
-                        self.static_vol[i, j, k] = stat
-
-                    if type == "cond3T":
-                        stat = label.cond3T
-                        self.static_vol[i, j, k] = stat
-
-                    if type == "perm7T":
-                        stat = label.perm7T
-                        self.static_vol[i, j, k] = stat
-
-                    if type == "cond7T":
-                        stat = label.cond7T
-                        self.static_vol[i, j, k] = stat
-
-                    #else:
-                        #print(f"Label {label} doesn't have a Perm or Cond value associated, check dictionary")
-                        #exit()
+        # Recall the type will tell us what value to take from the perm&cond dictionary
+        self.static_vol = self.map_property(type)
 
         return self.static_vol
 
     def save_static_vol(self, type, fn="default"):
         # Method to save the Perm or Cond vol created to nifti
-        if self.gauss_flag:
-            temp_img = nib.Nifti1Image(self.gaussian_phantom, affine=self.nifti.affine)
-            g_str = "gauss"
-        else:
-            temp_img = nib.Nifti1Image(self.static_vol, affine=self.nifti.affine)
-
-        if fn == "default":
-            fn = type+'.nii.gz'
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            # Conditioning if gauss flag is active, if not. We use the static_vol np array
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img, path)
-        else:
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img, path)
-
-        del temp_img
-        del path
+        self.save_property(type, fn)
 
     def create_t1_vol(self):
-        self.t1_vol = np.zeros(self.dimensions)
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-                    pixel = self.volume[i,j,k]
-                    label = self.segmentation_labels[pixel]
-                    val_t1 = label.T1_val
-                    if val_t1 == None:
-                        print("Label: ",label.name," does not have T1 value")
-                        self.t1_vol[i,j,k] = 0
-                    else:
-                        self.t1_vol[i, j, k] = val_t1
+        # Labels without T1 value are set to 0
+        self.t1_vol = self.map_property("t1")
         return self.t1_vol
 
     def save_t1_dist(self, fn = "default"):
         # Method to save T1 volume created to nifti
-        if self.gauss_flag:
-            temp_img = nib.Nifti1Image(self.gaussian_phantom, affine=self.nifti.affine)
-        else:
-            temp_img = nib.Nifti1Image(self.t1_vol, affine=self.nifti.affine)
-
-        if fn == "default":
-            fn = 't1_dist.nii.gz'
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            nib.save(temp_img,path)
-        else:
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            nib.save(temp_img,path)
-        del temp_img
-        del path
+        self.save_property("t1", fn)
 
     def create_pd_vol(self):
         # This method will use the lookup table of PD values to create a new volume
         # This new volume will use the labels to quickly create a volume with ProtonDensity values
-        self.pd_dist = np.zeros(self.dimensions)
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i,j,k]
-                    label = self.segmentation_labels[pixel]
-                    pd = label.PD_val
-                    if pd == None:
-                        # THis means the label does not have PD defined
-                        self.pd_dist[i,j,k] = 0
-                    else:
-                        # If the label has PD value it will put this value on the volume
-                        self.pd_dist[i,j,k] = pd
+        # Labels without PD defined are set to 0
+        self.pd_dist = self.map_property("pd")
 
         return self.pd_dist
+
     def save_pd_dist(self, fn = 'default'):
         # Method to save the proton density distribution created to nifti
-        if self.gauss_flag:
-            temp_img = nib.Nifti1Image(self.gaussian_phantom, affine=self.nifti.affine)
-        else:
-            temp_img = nib.Nifti1Image(self.pd_dist, affine=self.nifti.affine)
-
-        if fn == "default":
-            fn = 'pd_dist.nii.gz'
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        else:
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        del temp_img
-        del path
+        self.save_property("pd", fn)
 
     def create_t2_star_vol(self):
         # This method will use the lookup table of T2 star values to create a new volume
         # This new volume will use the labels to quickly create a volume with relaxation time
-        self.t2star_vol = np.zeros(self.dimensions)
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i,j,k]
-                    label = self.segmentation_labels[pixel]
-                    t2star = label.T2star_val
-                    if t2star == None:
-                        # THis means the label does not have T2 star value defined
-                        self.t2star_vol[i,j,k] = 0.001
-                    else:
-                        # If the label has value it will put this value on the volume
-                        self.t2star_vol[i,j,k] = t2star
+        # Labels without T2 star value defined are set to 0.001
+        self.t2star_vol = self.map_property("t2s")
 
         return self.t2star_vol
-    def save_t2star_dist(self, fn = "default"):
-        # Method to save the volume with T2 star values  created to nifti
-        if self.gauss_flag:
-            temp_img = nib.Nifti1Image(self.gaussian_phantom, affine=self.nifti.affine)
-        else:
-            temp_img = nib.Nifti1Image(self.t2star_vol, affine=self.nifti.affine)
 
-        if fn == "default":
-            fn = 't2_star.nii.gz'
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        else:
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        del temp_img
-        del path
+    def save_t2star_dist(self, fn = "default"):
+        # Method to save the volume with T2 star values created to nifti
+        self.save_property("t2s", fn)
 
     def create_t2_vol(self):
-        # This method will use the lookup table of T2 star values to create a new volume
+        # This method will use the lookup table of T2 values to create a new volume
         # This new volume will use the labels to quickly create a volume with relaxation time
-        self.t2_vol = np.zeros(self.dimensions)
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i, j, k]
-                    label = self.segmentation_labels[pixel]
-                    t2val = label.T2_val
-                    if t2val == None:
-                        # THis means the label does not have T2 defined
-                        self.t2_vol[i, j, k] = 0.001
-                    else:
-                        # If the label has value it will put this value on the volume
-                        self.t2_vol[i, j, k] = t2val
+        # Labels without T2 defined are set to 0.001
+        self.t2_vol = self.map_property("t2")
 
         return self.t2_vol
 
     def save_t2_dist(self, fn = "default"):
-        # Method to save the volume with T2 star values  created to nifti
-        if self.gauss_flag:
-            temp_img = nib.Nifti1Image(self.gaussian_phantom, affine=self.nifti.affine)
-        else:
-            temp_img = nib.Nifti1Image(self.t2_vol, affine=self.nifti.affine)
+        # Method to save the volume with T2 values created to nifti
+        self.save_property("t2", fn)
 
-        if fn == "default":
-            fn = 't2_map.nii.gz'
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        else:
-            if self.gauss_flag:
-                fn = "gauss_" + fn
-            path = os.path.join('output', fn)
-            # Save the new NIfTI image to a file
-            nib.save(temp_img,path)
-        del temp_img
-        del path
     def save_sus_csv(self):
-        data = []
-        for i in self.segmentation_labels.keys():
-            label = self.segmentation_labels[i]
-            if label.name is not None and label.susceptibility is not None and label.name not in data:
-                # The last is to get unique names 
-                data.append({
-                    "Name": label.name,
-                    "Susceptibility": label.susceptibility
-                })
+        # One row per label with a name and a susceptibility
+        data = [{"Label ID": i, "Name": label.name, "Susceptibility": label.susceptibility}
+                for i, label in self.segmentation_labels.items()
+                if label.name is not None and label.susceptibility is not None]
         # Call funtion that creates CSV
+        os.makedirs('data', exist_ok=True)
         path = os.path.join('data','susceptibility_values.csv')
         to_csv_sus(data,path)
 
     def save_relax_csv(self):
-        # Further implementation to go through self.relax values of each label?
-        # Think about a more efficient way because the user should be able to change the values
-        # It might be usefull to get this inputs from different researchers and testing
-        pass
+        # One row per tissue of the tool with its relaxation values (M0, T1, T2, T2*, PD)
+        names = dict.fromkeys(name for name, _ in self.look_up.values())
+        data = [dict(zip(["Name", "M0", "T1", "T2", "T2*", "PD"], [name] + list(self.relax_values[name])))
+                for name in names if name in self.relax_values]
+        os.makedirs('data', exist_ok=True)
+        path = os.path.join('data', 'relaxation_values.csv')
+        to_csv_relax(data, path)
+
+    def label_stats(self):
+        # Voxel count, volume in mm³, bounding box and property values of every label and every tissue
+        # Must be run after defining a tool in group_seg_labels to have the names and values
+        with self.stage("label stats"):
+            stats = label_statistics(self.label_index, self.nifti.affine, self.label_table, self.look_up)
+        if self.crop_box is not None:
+            # Bounding boxes in the voxels of the input, not of the crop box
+            start = [s.start for s in self.crop_box]
+            for row in stats:
+                row["bbox_min"] = [c + o for c, o in zip(row["bbox_min"], start)]
+                row["bbox_max"] = [c + o for c, o in zip(row["bbox_max"], start)]
+        return stats
+
+    def save_label_stats(self, fn):
+        # Saves label_stats as a single table: JSON for a .json file name, CSV otherwise
+        stats = self.label_stats()
+        path = os.path.join(self.output_dir, fn)
+        os.makedirs(self.output_dir, exist_ok=True)
+        if fn.endswith(".json"):
+            info = {"shape": [int(s) for s in self.nifti.shape],
+                    "voxel_volume_mm3": voxel_volume(self.nifti.affine)}
+            to_json_stats(stats, path, info)
+        else:
+            to_csv_stats(stats, path)
+        return path
 
     def calc_regions(self):
         # For  creating a gaussian distribution we need to group and count every label
         # Must be run after defining a tool in group_seg_labels
-        self.gaussian_phantom = np.zeros(self.dimensions)
-        unique_labels, counts = np.unique(self.volume, return_counts=True)
-        self.unique_counts = dict(zip(unique_labels,counts))
+        # The counts come from the index if there is one, else from np.bincount (no sort of the volume)
+        index = self.texture_index
+        self.unique_counts = index.counts() if index is not None else label_counts(self.volume)
 
         std_regions_of_interest = ["sc_wm", "sc_gm"]
+        self.label_counts = {}
 
-        if self.look_up is {}:
-            print("Please define a tool for a lookup table")
+        if not self.look_up:
+            self.log("Please define a tool for a lookup table")
 
         else:
             for l, count in self.unique_counts.items():
@@ -563,7 +717,7 @@ class volume:
                 label_name = self.look_up[l][0]
                 #label_suscep = self.look_up[l][1]
                 # Filter only for SC wm and gm
-                if label_name == std_regions_of_interest[0] or std_regions_of_interest[1]:
+                if label_name in std_regions_of_interest:
                     if label_name in self.label_counts.keys():
                         self.label_counts[label_name] += count
                     else:
@@ -576,9 +730,43 @@ class volume:
         # Now should only show SC gm and wm
         for name, count in sorted_label_counts:
             # Display the pixel count per label
-            print(f"Label name: {name}: {count} pixels")
+            self.log(f"Label name: {name}: {count} pixels")
+
+    def create_gauss_sc_dist(self, prop, out=None):
+        if self.grid is not None:
+            # The texture is made on the grid of the labels, then the textured phantom is resampled
+            grid, self.grid = self.grid, None
+            try:
+                self.create_gauss_sc_dist(prop)
+            finally:
+                self.grid = grid
+            phantom, self.gaussian_phantom = self.gaussian_phantom, None
+            with self.stage("resample " + prop):
+                self.gaussian_phantom = resample(phantom, self.label_affine, *grid, dtype=self.dtype, out=out)
+            return
+        if self.seed is None:
+            self.seed = new_seed()
+        self.log("Seed of the Gaussian texture: ", self.seed)
+
+        self.log("Step1 for Texture. Populate phantom with piecewise values")
+        # The texture is added in place, the phantom of the previous type is freed first
+        self.gaussian_phantom = None
+        self.gaussian_phantom = self.map_property(prop, out=out)
+
+        # Step 2: Apply gaussian distribution only to sc_wm and gm
 
-    def create_gauss_sc_dist(self, prop):
+        self.log("Step2 for Texture. Calculate gaussian distribution for sc_wm and sc_gm")
+        params = self.gauss_sc_params(prop, self.unique_counts.keys())
+
+        # Step 3 for Texture. One value of the distribution for every voxel of the label
+        # Slices of a crop box are numbered as in the input, the texture of a label is the same as without cropping
+        z_offset = self.crop_box[2].start if self.crop_box is not None else 0
+        self.label_gaussians.update(self.add_gauss_texture(self.gaussian_phantom, self.volume, prop, params,
+                                                           z_offset=z_offset, index=self.texture_index))
+
+    def gauss_sc_params(self, prop, label_ids):
+        # Mean and STD of the gaussian distribution of the sc_wm and sc_gm labels among label_ids
+        # Returns a dictionary label_id: (mean, std)
         std_values = {
             "sus": {"sc_wm": 0.0104, "sc_gm": 0.031}, # => Avg taken from regions 1 through 7 of QSM RC2 paper (Deep gray matter) and WM
             "t2s": {"sc_wm": 4.6875, "sc_gm": 3.688}, # For WM we use: https://pmc.ncbi.nlm.nih.gov/articles/PMC3508464
@@ -598,66 +786,50 @@ class volume:
         # Which results in 100/242 = 0.413
         # PD_std = M0_std*0.413
 
-        print("Step1 for Texture. Populate phantom with piecewise values")
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-                    pixel = self.volume[i, j, k]
-                    label = self.segmentation_labels[pixel]
-                    l_name = label.name
-
-                    # Determine the property value based on the input prop
-                    if prop == "sus":
-                        property_value = label.susceptibility
-                    else:
-                        property_value = self.relax_values[l_name][{
-                            "t2s": 3, "t2": 2, "t1": 1, "pd": 4, "M0": 1
-                        }[prop]]
-
-                    # Assign the piecewise value directly
-                    self.gaussian_phantom[i, j, k] = property_value
-
-        # Step 2: Apply gaussian distribution only to sc_wm and gm
-
-        print("Step2 for Texture. Calculate gaussian distribution for sc_wm and sc_gm")
-        for l, count in self.unique_counts.items():
+        params = {}
+        for l in label_ids:
             #label_id = l
             label_name = self.look_up[l][0]
             label_sus = self.look_up[l][1]
             # Determine the property value based on the input prop
 
             if label_name in ["sc_wm", "sc_gm"]:
+                if prop not in std_values:
+                    # No texture for the Perm & Cond types, the labels keep their piece-wise value
+                    self.log(f"No Gaussian texture of {prop} for {label_name}")
+                    continue
                 if prop == "sus":
-                    property_value = label_sus
+                    property_value = label_sus - self.ref
                 else:
                     property_value = self.relax_values[label_name][{
                         "t2s": 3, "t2": 2, "t1": 1, "pd": 4, "M0": 1
                     }[prop]]
                 std_dev = std_values.get(prop, {}).get(label_name, 0)
-                print(f"Applying Gaussian noise to {label_name} with STD: {std_dev}")
-
-                print(f"Label: {label_name} | Property: {prop} | Mean Value: {property_value} | STD: {std_dev}")
-
-                self.label_gaussians[l] = self.calc_gauss(
-                num_pixels=count,
-                value = property_value,
-                mr_prop=prop,
-                std_dev=std_dev
+                self.log(f"Applying Gaussian noise to {label_name} with STD: {std_dev}")
+
+                self.log(f"Label: {label_name} | Property: {prop} | Mean Value: {property_value} | STD: {std_dev}")
+                params[l] = (property_value, std_dev)
+
+        return params
+
+    def add_gauss_texture(self, phantom, labels, prop, params, z_offset=0, index=None):
+        # Replaces the values of the labels in params by samples of their gaussian distribution
+        # labels (and phantom) can be the full volume or a slab along z starting at slice z_offset:
+        # the samples are drawn from the random stream of the label in every slice, so they are the same
+        # The samples are drawn once and scattered directly into the voxels of the label
+        # index is the LabelIndex of labels, to find the voxels of a label without scanning the volume
+        samples = {}
+        with self.stage("texture " + prop):
+            for l, (property_value, std_dev) in params.items():
+                voxels = index.voxels_of(l) if index is not None else np.flatnonzero(labels == l)
+                samples[l] = draw_label_samples(
+                voxels, labels.shape, self.seed, prop, l,
+                lambda rng, n: self.calc_gauss(value=property_value, num_pixels=n, mr_prop=prop, std_dev=std_dev, rng=rng),
+                z_offset=z_offset
                 )
-        # Step 3 for Texture. Replacing with gaussian values only in SC WM and SC GM
-        print("Creating gaussian phantom -> longer for big files")
-
-        # Optimized Gaussian Phantom Creation Loop
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-                    pixel = self.volume[i, j, k]
-                    lab_id = self.segmentation_labels[pixel].label_id
-                    # Only apply Gaussian if it is sc_wm or sc_gm
-                    if lab_id in self.label_gaussians:
-                        gaussian_values = self.label_gaussians[lab_id]
-                        value = np.random.choice(gaussian_values)
-                        self.gaussian_phantom[i, j, k] = value
+                phantom.flat[voxels] = samples[l]
+
+        return samples
 
     def create_gauss_dist(self,prop):
         '''
@@ -688,11 +860,11 @@ class volume:
                 sc_gm_std = 0.031 # [ppm]
 
                 if l_name == "sc_wm":
-                    print(f"STD of Chi of {l_name}: {sc_wm_std}")
+                    self.log(f"STD of Chi of {l_name}: {sc_wm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_wm_std)
                 if l_name == "sc_gm":
-                    print(f"STD of Chi of {l_name}: {sc_gm_std}")
+                    self.log(f"STD of Chi of {l_name}: {sc_gm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_gm_std)
 
@@ -704,11 +876,11 @@ class volume:
                 sc_gm_std = 5.6 # [ms]
 
                 if l_name == "sc_wm":
-                    print(f"STD of T2* of {l_name}: {sc_wm_std}")
+                    self.log(f"STD of T2* of {l_name}: {sc_wm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_wm_std)
                 if l_name == "sc_gm":
-                    print(f"STD of T2* of {l_name}: {sc_gm_std}")
+                    self.log(f"STD of T2* of {l_name}: {sc_gm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_gm_std)
 
@@ -720,11 +892,11 @@ class volume:
                 sc_gm_std = 5.6  # [ms]
 
                 if l_name == "sc_wm":
-                    print(f"STD of T2 (same as T2*) of {l_name}: {sc_wm_std}")
+                    self.log(f"STD of T2 (same as T2*) of {l_name}: {sc_wm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_wm_std)
                 if l_name == "sc_gm":
-                    print(f"STD of T2 (same as T2*) of {l_name}: {sc_gm_std}")
+                    self.log(f"STD of T2 (same as T2*) of {l_name}: {sc_gm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_gm_std)
 
@@ -735,11 +907,11 @@ class volume:
                 sc_wm_std = 42  # [ms]
                 sc_gm_std = 44  # [ms]
                 if l_name == "sc_wm":
-                    print(f"STD of T1 of {l_name}: {sc_wm_std}")
+                    self.log(f"STD of T1 of {l_name}: {sc_wm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_wm_std)
                 if l_name == "sc_gm":
-                    print(f"STD of T1 of {l_name}: {sc_gm_std}")
+                    self.log(f"STD of T1 of {l_name}: {sc_gm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_gm_std)
 
@@ -750,11 +922,11 @@ class volume:
                 sc_wm_std = 22.31  # [ms]
                 sc_gm_std = 16.83  # [ms]
                 if l_name == "sc_wm":
-                    print(f"STD of PD of {l_name}: {sc_wm_std}")
+                    self.log(f"STD of PD of {l_name}: {sc_wm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_wm_std)
                 if l_name == "sc_gm":
-                    print(f"STD of PD of {l_name}: {sc_gm_std}")
+                    self.log(f"STD of PD of {l_name}: {sc_gm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_gm_std)
 
@@ -766,11 +938,11 @@ class volume:
                 sc_gm_std = 16.83  # [ms] => Avg taken from regions 1 through 7 of QSM RC2 paper (Deep gray matter)
 
                 if l_name == "sc_wm":
-                    print(f"STD of T1 of {l_name}: {sc_wm_std}")
+                    self.log(f"STD of T1 of {l_name}: {sc_wm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_wm_std)
                 if l_name == "sc_gm":
-                    print(f"STD of T1 of {l_name}: {sc_gm_std}")
+                    self.log(f"STD of T1 of {l_name}: {sc_gm_std}")
                     self.label_gaussians[l] = self.calc_gauss(num_pixels=count, value=property, mr_prop=prop,
                                                               std_dev=sc_gm_std)
 
@@ -778,26 +950,23 @@ class volume:
 
             # This way for every label we have a gaussian distribution
 
-        print("Creating gaussian phantom -> longer for big files")
-        for i in range(self.dimensions[0]):
-            for j in range(self.dimensions[1]):
-                for k in range(self.dimensions[2]):
-
-                    pixel = self.volume[i,j,k]
-                    # Now we need the ID of the label from pixel so
-                    lab_id = self.segmentation_labels[pixel].label_id
-                    # Instead of getting the name of the label we get the label id
-                    # Because label gaussian is created per label
-                    # Now randomly select a value from the gaussian distribution
-                    gaussian_values = self.label_gaussians[lab_id]
-                    value = np.random.choice(gaussian_values)
-                    self.gaussian_phantom[i,j,k] = value
-
-        print("Finished creating gaussian distributed, based on: ", prop)
+        self.log("Creating gaussian phantom")
+        if self.gaussian_phantom is None:
+            self.gaussian_phantom = self.map_property(prop)
+        for lab_id, gaussian_values in self.label_gaussians.items():
+            # Randomly select a value from the gaussian distribution of the label for each of its voxels,
+            # only the voxels of the label are visited
+            voxels = self.label_index.voxels_of(lab_id)
+            self.gaussian_phantom.flat[voxels] = np.random.choice(gaussian_values, len(voxels))
+
+        self.log("Finished creating gaussian distributed, based on: ", prop)
         # Lastly add the gaussian phantom to a Nifti
         # And save it to output folder
-    def calc_gauss(self, value, num_pixels, mr_prop, std_dev):
-        val = np.random.normal(value, std_dev, num_pixels)
+    def calc_gauss(self, value, num_pixels, mr_prop, std_dev, rng=None):
+        # rng is the generator to draw from, the global numpy random state if not given
+        if rng is None:
+            rng = np.random
+        val = rng.normal(value, std_dev, num_pixels)
         # In areas close to 0, the gaussian distribution must always return positive values
         # It is not possible to have negative T1, T2, T2s or PD. But susceptibility can be negative
         if mr_prop == "sus":
@@ -806,24 +975,11 @@ class volume:
             abs_val = np.abs(val)
             return abs_val
 
-    def save_gauss_dist(self, type, out_fn = "default"):
+    def save_gauss_dist(self, type, out_fn = "default", release=False):
         #Saving the gaussian distribution with type defined
-        # This must be run ONLY after creating the create_property.
-        # If not it will automatically save the empty array
+        # This must be run ONLY after creating the create_gauss_sc_dist.
         self.gauss_flag = 1
-        if type == 'sus':
-            self.save_sus_dist_nii(out_fn)
-
-        if type == 't2s':
-            self.save_t2star_dist(out_fn)
-
-        if type == 'pd':
-            self.save_pd_dist(out_fn)
-
-        if type == 't1':
-            self.save_t1_dist(out_fn)
+        self.save_property(type, out_fn, release=release)
 
-        if type == 't2':
-            self.save_t2_dist(out_fn)
     def __repr__(self):
         return f"SegmentationLabelManager == Volume"